@@ -0,0 +1,115 @@
+"""Characteristics visited per poll, service walk against the handle map.
+
+Run from the repository root with the Home Assistant dev environment:
+
+    python -m benchmarks.characteristics_bench
+    python -m benchmarks.characteristics_bench --polls 200 --reconnect-every 10
+
+Polls used to walk every service and characteristic of the machine to find
+the ones with a decoder. The walk run below is that loop, the handle map
+run polls with NespressoClient.poll_bundle(), which resolves the handles
+once per connection. Its time per poll includes decoding the readings.
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.nespresso_prodigio.nespresso import (
+    BLEClientWrapper,
+    NespressoClient,
+    sensor_decoders,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    ProdigioSimulator,
+)
+
+
+class CountingCharacteristics(list):
+    """Characteristics of a simulated service, counting each one visited."""
+
+    def __init__(self, characteristics: list, visits: list):
+        super().__init__(characteristics)
+        self._visits = visits
+
+    def __iter__(self):
+        for characteristic in super().__iter__():
+            self._visits[0] += 1
+            yield characteristic
+
+
+def counted_fleet() -> tuple[ProdigioSimulator, list]:
+    visits = [0]
+    fleet = ProdigioSimulator()
+    machine = fleet.add_machine()
+    for service in machine.services:
+        service.characteristics = CountingCharacteristics(
+            service.characteristics, visits
+        )
+    return fleet, visits
+
+
+async def bench_walk(polls: int, reconnect_every: int) -> tuple[int, float]:
+    fleet, visits = counted_fleet()
+    machine = next(iter(fleet.machines.values()))
+    client = BLEClientWrapper(machine.device, DEFAULT_AUTH_CODE, fleet.client_factory)
+    start = time.perf_counter()
+    for poll in range(polls):
+        if reconnect_every and poll % reconnect_every == 0:
+            await client.disconnect()
+        for service in await client.services:
+            for characteristic in service.characteristics:
+                if characteristic.uuid in sensor_decoders:
+                    await client.read_gatt_char(characteristic)
+    elapsed = time.perf_counter() - start
+    await client.disconnect()
+    return visits[0], elapsed
+
+
+async def bench_handle_map(polls: int, reconnect_every: int) -> tuple[int, float]:
+    fleet, visits = counted_fleet()
+    client = NespressoClient(fleet.scanner(), DEFAULT_AUTH_CODE, fleet.client_factory)
+    await client.discover_nespresso_devices()
+    bundle = client.bundles[0]
+    start = time.perf_counter()
+    for poll in range(polls):
+        if reconnect_every and poll % reconnect_every == 0:
+            await client.disconnect(bundle.device)
+        # Every characteristic is due, as in the walk
+        bundle.read_at.clear()
+        await client.poll_bundle(bundle)
+    elapsed = time.perf_counter() - start
+    await client.disconnect(bundle.device)
+    return visits[0], elapsed
+
+
+async def main(args) -> None:
+    print(
+        "{:<12} {:>6} {:>10} {:>12} {:>10}".format(
+            "run", "polls", "visited", "visits/poll", "time/poll"
+        )
+    )
+    for name, bench in (("walk", bench_walk), ("handle map", bench_handle_map)):
+        visited, elapsed = await bench(args.polls, args.reconnect_every)
+        print(
+            "{:<12} {:>6} {:>10} {:>12.2f} {:>8.1f}us".format(
+                name,
+                args.polls,
+                visited,
+                visited / args.polls,
+                elapsed / args.polls * 1e6,
+            )
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--polls", type=int, default=100)
+    parser.add_argument(
+        "--reconnect-every", type=int, default=0, help="0 keeps one connection"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,150 @@
+"""Payload decoding, the table driven decoders against the original BaseDecode.
+
+Run from the repository root with the Home Assistant dev environment:
+
+    python -m benchmarks.decode_bench
+    python -m benchmarks.decode_bench --number 100000
+
+LegacyDecode below is BaseDecode as it was before the decoder tables: a
+format_type string comparison per call, four ctypes unions per status
+payload and binascii.hexlify for the slider. Both are checked to decode
+every payload alike before they are timed.
+"""
+import argparse
+import binascii
+import ctypes
+import timeit
+
+from custom_components.nespresso_prodigio.nespresso import (
+    CHAR_UUID_NBCAPS,
+    CHAR_UUID_SLIDER,
+    CHAR_UUID_STATUS,
+    CHAR_UUID_WATER_HARDNESS,
+    sensor_decoders,
+)
+
+c_uint8 = ctypes.c_uint8
+
+
+class FlagsBits(ctypes.LittleEndianStructure):
+    _fields_ = [("bit{}".format(bit), c_uint8, 1) for bit in range(8)]
+
+
+class Flags(ctypes.Union):
+    _anonymous_ = ("bit",)
+    _fields_ = [("bit", FlagsBits), ("asByte", c_uint8)]
+
+
+class LegacyDecode:
+    def __init__(self, name, format_type):
+        self.name = name
+        self.format_type = format_type
+
+    def decode_data(self, raw_data):
+        val = raw_data
+        if self.format_type == "caps_number":
+            res = int.from_bytes(val, byteorder="big")
+        elif self.format_type == "water_hardness":
+            res = int.from_bytes(val[2:3], byteorder="big")
+        elif self.format_type == "slider":
+            res = binascii.hexlify(val)
+            if res == b"00":
+                res = 0
+            elif res == b"02":
+                res = 1
+            else:
+                res = "N/A"
+        elif self.format_type == "state":
+            byte0 = Flags()
+            byte1 = Flags()
+            byte2 = Flags()
+            byte3 = Flags()
+
+            byte0.asByte = val[0]
+            byte1.asByte = val[1] if len(val) > 1 else 0
+            byte2.asByte = val[2] if len(val) > 2 else 0
+            byte3.asByte = val[3] if len(val) > 3 else 0
+            descaling_counter = int.from_bytes(val[6:9], byteorder="big")
+            return {
+                "water_is_empty": byte0.bit0,
+                "descaling_needed": byte0.bit2,
+                "capsule_mechanism_jammed": byte0.bit4,
+                "always_1": byte0.bit6,
+                "water_temp_low": byte1.bit0,
+                "awake": byte1.bit1,
+                "water_engadged": byte1.bit2,
+                "sleeping": byte1.bit3,
+                "tray_sensor_during_brewing": byte1.bit4,
+                "tray_open_tray_sensor_full": byte1.bit6,
+                "capsule_engaged": byte1.bit7,
+                "Fault": byte3.bit5,
+                "descaling_counter": descaling_counter,
+            }
+        else:
+            res = val
+        return {self.name: res}
+
+
+legacy_decoders = {
+    CHAR_UUID_STATUS: LegacyDecode("state", "state"),
+    CHAR_UUID_NBCAPS: LegacyDecode("caps_number", "caps_number"),
+    CHAR_UUID_SLIDER: LegacyDecode("slider", "slider"),
+    CHAR_UUID_WATER_HARDNESS: LegacyDecode("water_hardness", "water_hardness"),
+}
+
+PAYLOADS = {
+    CHAR_UUID_STATUS: bytes.fromhex("4106002000000000a0"),
+    CHAR_UUID_NBCAPS: (1234).to_bytes(4, "big"),
+    CHAR_UUID_SLIDER: b"\x02",
+    CHAR_UUID_WATER_HARDNESS: b"\x00\x00\x03\x00",
+}
+
+
+def check() -> None:
+    """Both decoders agree on every status byte and slider value."""
+    for value in range(256):
+        status = bytes([value, value, 0, value, 0, 0, value, 0, value])
+        for uuid_str, payload in (
+            (CHAR_UUID_STATUS, status),
+            (CHAR_UUID_STATUS, status[:1]),
+            (CHAR_UUID_SLIDER, bytes([value])),
+        ):
+            legacy = legacy_decoders[uuid_str].decode_data(payload)
+            decoded = dict(sensor_decoders[uuid_str].decode_data(payload).items())
+            assert decoded == legacy, (uuid_str, payload, decoded, legacy)
+    for uuid_str, payload in PAYLOADS.items():
+        legacy = legacy_decoders[uuid_str].decode_data(payload)
+        assert dict(sensor_decoders[uuid_str].decode_data(payload)) == legacy
+
+
+def best(function, number: int) -> float:
+    """Seconds per call, best of five runs."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def main(args) -> None:
+    check()
+    print("{:<16} {:>10} {:>10} {:>8}".format("payload", "legacy", "tables", "speedup"))
+    for uuid_str, payload in PAYLOADS.items():
+        legacy = legacy_decoders[uuid_str]
+        decoder = sensor_decoders[uuid_str]
+        legacy_time = best(lambda: legacy.decode_data(payload), args.number)
+        table_time = best(lambda: decoder.decode_data(payload), args.number)
+        print(
+            "{:<16} {:>8.2f}us {:>8.2f}us {:>7.1f}x".format(
+                decoder.name,
+                legacy_time * 1e6,
+                table_time * 1e6,
+                legacy_time / table_time,
+            )
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,200 @@
+"""End-to-end benchmarks of NespressoClient against simulated machines.
+
+Run from the repository root with the Home Assistant dev environment:
+
+    python -m benchmarks.prodigio_bench
+    python -m benchmarks.prodigio_bench --fleet 1,10,50,200 --connect-delay 0.5
+
+Every number goes through the same code path as the integration: the fleet
+scaling run polls each machine with poll_bundle(), which is what each
+per-device coordinator does on refresh.
+"""
+import argparse
+import asyncio
+import time
+
+from custom_components.nespresso_prodigio.nespresso import (
+    NespressoClient,
+    NespressoVolume,
+    RetryPolicy,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    LinkProfile,
+    ProdigioSimulator,
+)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(name: str, samples: list) -> None:
+    print(
+        "{:<28} n={:<5} p50={:8.1f}ms p95={:8.1f}ms max={:8.1f}ms".format(
+            name,
+            len(samples),
+            percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.95) * 1000,
+            max(samples) * 1000,
+        )
+    )
+
+
+def make_client(fleet: ProdigioSimulator, scan_delay: float = 0.0) -> NespressoClient:
+    return NespressoClient(
+        fleet.scanner(scan_delay),
+        DEFAULT_AUTH_CODE,
+        fleet.client_factory,
+        # Fail fast, a benchmark must not hide errors behind backoff
+        retry_policy=RetryPolicy(attempts=1),
+    )
+
+
+async def timed(operation) -> float:
+    start = time.perf_counter()
+    await operation
+    return time.perf_counter() - start
+
+
+async def bench_poll(link: LinkProfile, rounds: int) -> None:
+    fleet = ProdigioSimulator()
+    fleet.add_machine(link=link)
+    client = make_client(fleet)
+    await client.discover_nespresso_devices()
+    bundle = next(iter(client.bundles))
+    machine = next(iter(fleet.machines.values()))
+    cold = []
+    for _ in range(rounds):
+        machine.disconnect_all()
+        cold.append(await timed(client.poll_bundle(bundle)))
+    warm = [await timed(client.poll_bundle(bundle)) for _ in range(rounds)]
+    report("poll cold", cold)
+    report("poll warm", warm)
+    await client.stop_notifications()
+
+
+async def bench_brew(link: LinkProfile, rounds: int) -> None:
+    fleet = ProdigioSimulator()
+    machine = fleet.add_machine(link=link)
+    client = make_client(fleet)
+    await client.discover_nespresso_devices()
+    device = machine.device
+    cold = []
+    for _ in range(rounds):
+        machine.disconnect_all()
+        trace = await client.make_coffee(device, NespressoVolume.ESPRESSO)
+        cold.append(trace["total"])
+    client.keep_warm(device)
+    await client.poll_bundle(client.get_bundle(device.address))
+    warm = [
+        (await client.make_coffee(device, NespressoVolume.ESPRESSO))["total"]
+        for _ in range(rounds)
+    ]
+    report("brew cold", cold)
+    report("brew keep_warm", warm)
+    client.keep_warm(device, False)
+    await client.stop_notifications()
+
+
+async def bench_scheduled_brew(link: LinkProfile, rounds: int) -> None:
+    fleet = ProdigioSimulator()
+    machine = fleet.add_machine(link=link)
+    client = make_client(fleet)
+    await client.discover_nespresso_devices()
+    device = machine.device
+    # Lead time covers the connect, the target leaves room for the status check
+    lead_time = link.connect_delay + 0.5
+    jitter = []
+    for _ in range(rounds):
+        machine.disconnect_all()
+        when = time.time() + lead_time + 1.0
+        trace = await client.brew_at(device, when, NespressoVolume.ESPRESSO, lead_time)
+        jitter.append(abs(trace["jitter"]))
+    report("scheduled brew jitter", jitter)
+    await client.stop_notifications()
+
+
+async def bench_discovery(count: int, scan_delay: float, rounds: int) -> None:
+    fleet = ProdigioSimulator()
+    machines = fleet.add_fleet(count)
+    client = make_client(fleet, scan_delay)
+    scans = [await timed(client.discover_nespresso_devices()) for _ in range(rounds)]
+    report("discovery scan ({})".format(count), scans)
+
+    # What the advertisement callback does instead of scanning
+    advertisements = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for machine in machines:
+            client.track_device(machine.device)
+        advertisements.append(time.perf_counter() - start)
+    report("advertisements ({})".format(count), advertisements)
+
+
+async def bench_fleet(sizes: list, link: LinkProfile, sources: int) -> None:
+    print(
+        "{:>6} {:>8} {:>10} {:>10} {:>8} {:>12}".format(
+            "fleet", "sources", "refresh", "p95 poll", "errors", "peak slots"
+        )
+    )
+    for size in sizes:
+        fleet = ProdigioSimulator()
+        fleet.add_fleet(size, sources=sources, link=link)
+        client = make_client(fleet)
+        await client.discover_nespresso_devices()
+        polls = []
+
+        async def poll(bundle):
+            start = time.perf_counter()
+            await client.poll_bundle(bundle)
+            polls.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[poll(bundle) for bundle in client.bundles], return_exceptions=True
+        )
+        refresh = time.perf_counter() - start
+        errors = sum(isinstance(result, Exception) for result in results)
+        print(
+            "{:>6} {:>8} {:>9.2f}s {:>8.1f}ms {:>8} {:>12}".format(
+                size,
+                sources,
+                refresh,
+                percentile(polls, 0.95) * 1000 if polls else 0.0,
+                errors,
+                max(fleet.peak_slots.values()),
+            )
+        )
+        await client.stop_notifications()
+
+
+async def main(args) -> None:
+    link = LinkProfile(args.connect_delay, args.read_delay, args.write_delay)
+    await bench_poll(link, args.rounds)
+    await bench_brew(link, args.rounds)
+    await bench_scheduled_brew(link, args.scheduled_rounds)
+    await bench_discovery(max(args.fleet), args.scan_delay, args.rounds)
+    await bench_fleet(args.fleet, link, args.sources)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--scheduled-rounds", type=int, default=5)
+    parser.add_argument(
+        "--fleet",
+        type=lambda value: [int(size) for size in value.split(",")],
+        default=[1, 10, 50, 100, 200],
+    )
+    parser.add_argument("--sources", type=int, default=4)
+    parser.add_argument("--connect-delay", type=float, default=0.05)
+    parser.add_argument("--read-delay", type=float, default=0.01)
+    parser.add_argument("--write-delay", type=float, default=0.01)
+    parser.add_argument("--scan-delay", type=float, default=0.0)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
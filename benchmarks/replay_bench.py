@@ -0,0 +1,141 @@
+"""Decode and update pipeline on captured GATT traffic.
+
+Run from the repository root with the Home Assistant dev environment:
+
+    python -m benchmarks.replay_bench --log config/nespresso_prodigio.gattlog
+    python -m benchmarks.replay_bench --fleet 20 --events 500
+
+A log is written by the integration when the record_traffic option is on.
+Without one, a workload is first recorded from simulated machines. The
+decoders run times decode_payloads alone, the decode run feeds the log
+through the bundles in one batch per machine, the client run replays it on
+simulated machines subscribed to by NespressoClient.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from custom_components.nespresso_prodigio.nespresso import (
+    CHAR_UUID_NBCAPS,
+    NespressoClient,
+    NespressoDeviceBundle,
+    ble_device,
+    decode_payloads,
+    sensor_decoders,
+)
+from custom_components.nespresso_prodigio.recorder import (
+    GattRecorder,
+    read_log,
+    replay_decode,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    STATUS_BREWING,
+    STATUS_READY,
+    GattReplay,
+    ProdigioSimulator,
+)
+
+
+async def record_workload(path: str, count: int, events: int) -> None:
+    fleet = ProdigioSimulator(slots_per_source=count)
+    machines = fleet.add_fleet(count)
+    recorder = GattRecorder(path)
+    # Every machine stays subscribed, as if each had a proxy slot of its own
+    client = NespressoClient(
+        fleet.scanner(),
+        DEFAULT_AUTH_CODE,
+        fleet.client_factory,
+        max_connections=count,
+        recorder=recorder,
+    )
+    await client.discover_nespresso_devices()
+    await client.start_notifications(lambda bundle: None)
+    for _ in range(events):
+        machine = random.choice(machines)
+        machine.set_status(STATUS_BREWING)
+        caps = machine.caps_number + 1
+        machine.set_value(CHAR_UUID_NBCAPS, caps.to_bytes(4, "big"))
+        machine.set_status(STATUS_READY)
+    await client.stop_notifications()
+    recorder.close()
+
+
+def bench_decoders(records: list, rounds: int) -> None:
+    payloads = [
+        (record.uuid, record.payload)
+        for record in records
+        if record.uuid in sensor_decoders
+    ]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode_payloads(payloads)
+    elapsed = (time.perf_counter() - start) / rounds
+    print(
+        "decoders {:>8} payloads {:7.1f}ms {:>10.0f} payloads/s".format(
+            len(payloads), elapsed * 1000, len(payloads) / elapsed
+        )
+    )
+
+
+def bench_decode(records: list, rounds: int) -> None:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        replay_decode(
+            records, lambda address: NespressoDeviceBundle(ble_device(address, ""), {})
+        )
+    elapsed = (time.perf_counter() - start) / rounds
+    print(
+        "decode   {:>8} records {:8.1f}ms {:>10.0f} records/s".format(
+            len(records), elapsed * 1000, len(records) / elapsed
+        )
+    )
+
+
+async def bench_client(records: list) -> None:
+    replay = GattReplay(records)
+    client = NespressoClient(
+        replay.scanner(),
+        DEFAULT_AUTH_CODE,
+        replay.client_factory,
+        max_connections=len(replay.machines),
+    )
+    await client.discover_nespresso_devices()
+    updates = []
+    await client.start_notifications(updates.append)
+    start = time.perf_counter()
+    applied = await replay.play(speed=None)
+    elapsed = time.perf_counter() - start
+    print(
+        "client   {:>8} readings {:7.1f}ms {:>10.0f} readings/s {:>8} updates".format(
+            applied, elapsed * 1000, applied / elapsed, len(updates)
+        )
+    )
+    await client.stop_notifications()
+
+
+async def main(args) -> None:
+    path = args.log
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "workload.gattlog")
+        await record_workload(path, args.fleet, args.events)
+    records = list(read_log(path))
+    bench_decoders(records, args.rounds)
+    bench_decode(records, args.rounds)
+    await bench_client(records)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--log")
+    parser.add_argument("--fleet", type=int, default=10)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
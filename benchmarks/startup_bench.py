@@ -0,0 +1,108 @@
+"""Startup cost of the integration.
+
+Run from the repository root with the Home Assistant dev environment:
+
+    python -m benchmarks.startup_bench
+
+Import times are measured in a fresh interpreter per run, after the modules
+Home Assistant has already loaded when the integration is set up. The
+advertisement run times the client side of a new machine: tracking its
+advertisement, after which the integration signals its platforms, versus
+the first full GATT read the platforms used to wait for. Creating the
+entities from the signal needs a running Home Assistant and is not timed.
+"""
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+
+from custom_components.nespresso_prodigio.nespresso import NespressoClient
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    LinkProfile,
+    ProdigioSimulator,
+)
+
+# Loaded by Home Assistant before any custom integration
+PRELOADED = (
+    "homeassistant.core",
+    "homeassistant.components.bluetooth",
+    "homeassistant.helpers.update_coordinator",
+)
+
+MODULES = (
+    "custom_components.nespresso_prodigio",
+    "custom_components.nespresso_prodigio.nespresso",
+)
+
+
+def import_time(module: str) -> float:
+    code = (
+        "import importlib, time\n"
+        "for name in {preloaded!r}:\n"
+        "    importlib.import_module(name)\n"
+        "start = time.perf_counter()\n"
+        "importlib.import_module({module!r})\n"
+        "print(time.perf_counter() - start)\n"
+    ).format(preloaded=PRELOADED, module=module)
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    )
+    return float(output.stdout)
+
+
+def bench_imports(rounds: int) -> None:
+    for module in MODULES:
+        samples = [import_time(module) for _ in range(rounds)]
+        print(
+            "import {:<48} median={:7.1f}ms".format(
+                module, statistics.median(samples) * 1000
+            )
+        )
+
+
+async def bench_advertisement(link: LinkProfile, rounds: int) -> None:
+    tracked = []
+    first_read = []
+    for _ in range(rounds):
+        fleet = ProdigioSimulator()
+        machine = fleet.add_machine(link=link)
+        client = NespressoClient(
+            fleet.scanner(), DEFAULT_AUTH_CODE, fleet.client_factory
+        )
+        start = time.perf_counter()
+        client.track_device(machine.device)
+        tracked.append(time.perf_counter() - start)
+        await client.poll_bundle(client.get_bundle(machine.address))
+        first_read.append(time.perf_counter() - start)
+        await client.stop_notifications()
+    print(
+        "tracked after advertisement    median={:7.3f}ms".format(
+            statistics.median(tracked) * 1000
+        )
+    )
+    print(
+        "first full read                median={:7.1f}ms".format(
+            statistics.median(first_read) * 1000
+        )
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--connect-delay", type=float, default=1.0)
+    parser.add_argument("--read-delay", type=float, default=0.05)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    bench_imports(args.rounds)
+    asyncio.run(
+        bench_advertisement(
+            LinkProfile(args.connect_delay, args.read_delay), args.rounds
+        )
+    )
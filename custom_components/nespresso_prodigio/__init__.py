@@ -1,21 +1,49 @@
 """The Nespresso Bluetooth component."""
+from __future__ import annotations
+
 import asyncio
+import importlib
 import logging
 from datetime import timedelta
+from typing import TYPE_CHECKING, Callable
 
 from homeassistant.components.bluetooth import (
+    BluetoothCallbackMatcher,
+    BluetoothChange,
+    BluetoothScanningMode,
+    BluetoothServiceInfoBleak,
+    async_ble_device_from_address,
+    async_discovered_service_info,
     async_get_scanner,
+    async_register_callback,
 )
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
-from homeassistant.exceptions import ConfigEntryNotReady
+from homeassistant.const import CONF_ADDRESS
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
-from .const import CONF_ENTRY_AUTH_KEY
-from .const import DOMAIN, PLATFORMS
-from .nespresso import NespressoClient
+from .const import CONF_ENTRY_AUTH_KEY, CONF_INSTRUMENTATION, CONF_NOTIFICATIONS
+from .const import CONF_RECORD_TRAFFIC
+from .const import DOMAIN, LOCAL_NAME_PREFIX, PLATFORMS
+from .const import SIGNAL_DEVICE_ADDED, SIGNAL_DEVICE_REMOVED
+
+if TYPE_CHECKING:
+    # The protocol module is imported once the first machine is seen
+    from .nespresso import NespressoClient, NespressoDeviceBundle
+    from .recorder import GattRecorder
 
 SCAN_INTERVAL = timedelta(seconds=30)
+# Polling only backs up the GATT notifications when they are enabled
+FALLBACK_SCAN_INTERVAL = timedelta(minutes=5)
+EVICT_INTERVAL = timedelta(minutes=1)
+# How often the recorded GATT traffic is written out
+RECORDER_FLUSH_INTERVAL = timedelta(seconds=10)
+STORAGE_VERSION = 1
+# Seconds to batch state changes into a single write
+SAVE_DELAY = 10
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -23,80 +51,472 @@ _LOGGER = logging.getLogger(__name__)
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up nespresso_prodigio from a config entry."""
     _LOGGER.debug(f"integration async setup entry: {entry.as_dict()}")
-    hass.data.setdefault(DOMAIN, {})
-
-    # Find ble device here so that we can raise device not found on startup
-    auth_code = entry.data.get(CONF_ENTRY_AUTH_KEY)
-    _LOGGER.debug("Searching for Nespresso sensors...")
-
-    scanner = async_get_scanner(hass)
-    client = NespressoClient(scanner, auth_code)
-
-    coordinator = NespressoDataUpdateCoordinator(hass, client=client)
-    await coordinator.async_refresh()
+    connections = async_get_connection_manager(hass)
 
-    if not coordinator.last_update_success:
-        raise ConfigEntryNotReady
-
-    hass.data[DOMAIN][entry.entry_id] = coordinator
+    store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry.entry_id}")
+    manager = NespressoCoordinatorManager(
+        hass,
+        entry,
+        connections,
+        store,
+        notifications=entry.options.get(CONF_NOTIFICATIONS, True),
+    )
+    stored = await store.async_load() or {}
+    await connections.async_add_entry(manager, stored)
 
-    for platform in PLATFORMS:
-        if entry.options.get(platform, True):
-            coordinator.platforms.append(platform)
-            hass.async_create_task(
-                hass.config_entries.async_forward_entry_setup(entry, platform)
-            )
+    manager.platforms = [
+        platform for platform in PLATFORMS if entry.options.get(platform, True)
+    ]
+    await hass.config_entries.async_forward_entry_setups(entry, manager.platforms)
 
     entry.async_on_unload(entry.add_update_listener(async_reload_entry))
+    hass.async_create_task(manager.async_refresh())
     return True
 
 
+@callback
+def async_get_connection_manager(hass: HomeAssistant) -> NespressoConnectionManager:
+    """Return the connection manager shared by every entry, created once."""
+    connections = hass.data.get(DOMAIN)
+    if connections is None:
+        connections = hass.data[DOMAIN] = NespressoConnectionManager(hass)
+    return connections
+
+
 class NespressoDataUpdateCoordinator(DataUpdateCoordinator):
-    """Class to manage fetching data from the API."""
+    """Class to manage fetching data of a single machine."""
 
-    def __init__(self, hass: HomeAssistant, client: NespressoClient) -> None:
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        client: NespressoClient,
+        address: str,
+        notifications: bool = True,
+        on_update: Callable[[], None] | None = None,
+    ) -> None:
         """Initialize."""
         self.api = client
-        self.platforms = []
+        self.address = address
+        self.notifications = notifications
+        self._on_update = on_update
+        # Version of the bundle last handed to on_update
+        bundle = client.get_bundle(address)
+        self._version = bundle.version if bundle is not None else None
+        # Coordinators only exist once the manager has loaded the protocol
+        from .nespresso import AdaptivePollSchedule
+
+        self.schedule = AdaptivePollSchedule()
+
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN}_{address}",
+            update_interval=SCAN_INTERVAL,
+        )
 
-        super().__init__(hass, _LOGGER, name=DOMAIN, update_interval=SCAN_INTERVAL)
+    @property
+    def bundle(self) -> NespressoDeviceBundle | None:
+        return self.api.get_bundle(self.address)
 
     async def _async_update_data(self):
         """Update data via library."""
+        bundle = self.bundle
+        if bundle is None:
+            self._async_schedule_next(None)
+            raise UpdateFailed(f"{self.address} is no longer advertised")
         try:
-            await self.api.discover_nespresso_devices()
+            await self.api.poll_bundle(bundle)
+            if self.notifications:
+                await self.api.subscribe_bundle(bundle, self._handle_notification)
+        except Exception as exception:
+            self._async_schedule_next(None)
+            raise UpdateFailed(exception) from exception
+        self._async_schedule_next(bundle)
+        self._async_bundle_updated(bundle)
+        return bundle.attributes
+
+    @callback
+    def _async_schedule_next(self, bundle: NespressoDeviceBundle | None) -> None:
+        """Adapt the poll interval to what the machine is doing."""
+        seconds = self.schedule.next_interval(
+            bundle.attributes if bundle is not None else None
+        )
+        if bundle is not None and self.notifications:
+            if self.api.is_subscribed(bundle.device):
+                # Changes are pushed, polling is only a safety net
+                seconds = max(seconds, FALLBACK_SCAN_INTERVAL.total_seconds())
+        self.update_interval = timedelta(seconds=seconds)
 
-            if len(self.api.bundles) == 0:
-                raise ConfigEntryNotReady(
-                    "No bluetooth scanner detected. \
-                    Enable the bluetooth integration or ensure an esphome device \
-                    is running as a bluetooth proxy"
+    @callback
+    def _handle_notification(self, bundle: NespressoDeviceBundle) -> None:
+        """Push a freshly decoded bundle to the listeners."""
+        self.async_set_updated_data(bundle.attributes)
+        self._async_bundle_updated(bundle)
+
+    @callback
+    def _async_bundle_updated(self, bundle: NespressoDeviceBundle) -> None:
+        """Call on_update when a payload of the machine changed."""
+        if bundle.version != self._version:
+            self._version = bundle.version
+            if self._on_update is not None:
+                self._on_update()
+
+
+class NespressoConnectionManager:
+    """The client, connection pool and bluetooth callback of every entry.
+
+    One scheduler arbitrates the adapter and proxy slots for all machines.
+    A machine belongs to the entry configured with its address, otherwise
+    to an entry without an address, which covers every other machine.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self.api: NespressoClient | None = None
+        self.recorder: GattRecorder | None = None
+        self.entries: dict[str, NespressoCoordinatorManager] = {}
+        self._by_address: dict[str, NespressoCoordinatorManager] = {}
+        self._pending: dict[str, BluetoothServiceInfoBleak] = {}
+        self._load_task: asyncio.Task | None = None
+        self._unsubscribe: list[Callable[[], None]] = []
+        self._stop_flush: Callable[[], None] | None = None
+
+    async def async_load_api(self) -> NespressoClient:
+        """Import the protocol module off the event loop and create the client."""
+        if self.api is None:
+            nespresso = await self.hass.async_add_executor_job(
+                importlib.import_module, f"{__package__}.nespresso"
+            )
+            if self.api is None:
+                # Every machine authenticates with the code of its entry
+                self.api = nespresso.NespressoClient(
+                    async_get_scanner(self.hass),
+                    None,
+                    instrumentation=nespresso.Instrumentation(),
                 )
+        return self.api
 
-            _LOGGER.debug("Getting info about device(s)")
-            await self.api.get_device_data()
-        except Exception as exception:
-            raise UpdateFailed(exception) from exception
+    def owner_of(self, address: str) -> NespressoCoordinatorManager | None:
+        manager = self._by_address.get(address)
+        if manager is not None:
+            return manager
+        return next(
+            (other for other in self.entries.values() if other.address is None),
+            None,
+        )
 
+    def tracker_of(self, address: str) -> NespressoCoordinatorManager | None:
+        """Return the entry that has a coordinator for address."""
+        return next(
+            (other for other in self.entries.values() if address in other.coordinators),
+            None,
+        )
 
-async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
-    """Handle removal of an entry."""
-    coordinator = hass.data[DOMAIN][entry.entry_id]
-    unloaded = all(
+    async def async_add_entry(
+        self, manager: NespressoCoordinatorManager, stored: dict
+    ) -> None:
+        """Start tracking the machines of an entry."""
+        self.entries[manager.entry.entry_id] = manager
+        if manager.address is not None:
+            self._by_address[manager.address] = manager
+            # Taken over from an entry covering every machine
+            previous = self.tracker_of(manager.address)
+            if previous is not None and previous is not manager:
+                previous.async_drop(manager.address)
+        if len(self.entries) == 1:
+            self._async_start()
+        advertised = [
+            service_info
+            for service_info in async_discovered_service_info(self.hass)
+            if service_info.name.startswith(LOCAL_NAME_PREFIX)
+        ]
+        if stored.get("devices") or advertised or self.api is not None:
+            await self.async_load_api()
+            await self._async_apply_options()
+            # Entities start from the last known state, the radio is not waited on
+            manager.async_restore(stored)
+            # Seed from the advertisements HA has already seen
+            for service_info in advertised:
+                if self.owner_of(service_info.address) is manager:
+                    manager.async_track_device(service_info)
+
+    async def async_remove_entry(self, manager: NespressoCoordinatorManager) -> None:
+        """Release the machines of an entry, stop once no entry is left."""
+        self.entries.pop(manager.entry.entry_id, None)
+        if self._by_address.get(manager.address) is manager:
+            del self._by_address[manager.address]
+        if self.api is not None:
+            for address in list(manager.coordinators):
+                manager.coordinators.pop(address)
+                self.api.set_auth_code(address, None)
+                # Another entry picks it up from its next advertisement
+                await self.api.forget(address)
+        if not self.entries:
+            for unsubscribe in self._unsubscribe:
+                unsubscribe()
+            self._unsubscribe = []
+        await self._async_apply_options()
+
+    @callback
+    def _async_start(self) -> None:
+        self._unsubscribe = [
+            async_register_callback(
+                self.hass,
+                self.async_handle_advertisement,
+                BluetoothCallbackMatcher(
+                    local_name=f"{LOCAL_NAME_PREFIX}*", connectable=True
+                ),
+                BluetoothScanningMode.PASSIVE,
+            ),
+            async_track_time_interval(
+                self.hass, self.async_evict_stale, EVICT_INTERVAL
+            ),
+        ]
+
+    async def _async_apply_options(self) -> None:
+        """Instrument and record the machines when any entry asks for it."""
+        if self.api is None:
+            return
+        options = [manager.entry.options for manager in self.entries.values()]
+        self.api.instrumentation.enabled = any(
+            option.get(CONF_INSTRUMENTATION, False) for option in options
+        )
+        record = any(option.get(CONF_RECORD_TRAFFIC, False) for option in options)
+        if record and self.recorder is None:
+            # Already imported with the client
+            nespresso = importlib.import_module(f"{__package__}.nespresso")
+            self.recorder = await self.hass.async_add_executor_job(
+                nespresso.GattRecorder, self.hass.config.path(f"{DOMAIN}.gattlog")
+            )
+            self.api.set_recorder(self.recorder)
+            self._stop_flush = async_track_time_interval(
+                self.hass, self._async_flush_recorder, RECORDER_FLUSH_INTERVAL
+            )
+        elif not record and self.recorder is not None:
+            recorder, self.recorder = self.recorder, None
+            self.api.set_recorder(None)
+            self._stop_flush()
+            self._stop_flush = None
+            await self.hass.async_add_executor_job(recorder.close)
+
+    async def _async_flush_recorder(self, _now=None) -> None:
+        """Write and rotate the GATT log off the event loop."""
+        if self.recorder is not None:
+            await self.hass.async_add_executor_job(self.recorder.flush)
+
+    async def async_probe(
+        self, service_info: BluetoothServiceInfoBleak, auth_code: str
+    ) -> None:
+        """Authenticate to a machine with a candidate auth code.
+
+        The session is kept for the entry about to be created, the machine
+        is handed back to its current entry if the probe raises.
+        """
+        api = await self.async_load_api()
+        address = service_info.address
+        api.set_auth_code(address, auth_code)
+        try:
+            await api.probe(service_info.device)
+        except Exception:
+            owner = self.tracker_of(address)
+            if owner is not None:
+                api.set_auth_code(address, owner.auth_code)
+            else:
+                await api.forget(address)
+                api.set_auth_code(address, None)
+            raise
+
+    async def _async_track_pending(self) -> None:
+        await self.async_load_api()
+        await self._async_apply_options()
+        pending, self._pending = self._pending, {}
+        for service_info in pending.values():
+            self.async_handle_advertisement(service_info, BluetoothChange.ADVERTISEMENT)
+
+    @callback
+    def async_handle_advertisement(
+        self, service_info: BluetoothServiceInfoBleak, change: BluetoothChange
+    ) -> None:
+        """Hand a Prodigio advertisement to the entry of the machine."""
+        if self.api is None:
+            # First machine seen, it is tracked once the protocol is loaded
+            self._pending[service_info.address] = service_info
+            if self._load_task is None:
+                self._load_task = self.hass.async_create_task(
+                    self._async_track_pending()
+                )
+            return
+        manager = self.owner_of(service_info.address)
+        if manager is not None:
+            manager.async_handle_advertisement(service_info)
+
+    async def async_evict_stale(self, _now=None) -> None:
+        """Drop the coordinator and entities of machines that went quiet."""
+        if self.api is None:
+            return
+        for bundle in await self.api.evict_stale_devices():
+            manager = self.tracker_of(bundle.device.address)
+            if manager is not None:
+                manager.async_drop(bundle.device.address)
+
+
+class NespressoCoordinatorManager:
+    """Create and drop one coordinator per machine of an entry."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        connections: NespressoConnectionManager,
+        store: Store,
+        notifications: bool = True,
+    ) -> None:
+        self.hass = hass
+        self.entry = entry
+        self.connections = connections
+        # Entries created before per-device entries cover every machine
+        self.address: str | None = entry.data.get(CONF_ADDRESS)
+        self.auth_code: str = entry.data.get(CONF_ENTRY_AUTH_KEY)
+        self.store = store
+        self._save_scheduled = False
+        self.notifications = notifications
+        self.platforms = []
+        self.coordinators: dict[str, NespressoDataUpdateCoordinator] = {}
+
+    @property
+    def api(self) -> NespressoClient | None:
+        return self.connections.api
+
+    @property
+    def last_update_success(self) -> bool:
+        return any(
+            coordinator.last_update_success
+            for coordinator in self.coordinators.values()
+        )
+
+    @callback
+    def async_track_device(
+        self, service_info: BluetoothServiceInfoBleak
+    ) -> NespressoDataUpdateCoordinator | None:
+        """Track an advertisement, returns the coordinator of a new machine."""
+        created = self.api.track_device(service_info.device)
+        if not created and service_info.address in self.coordinators:
+            return None
+        # Also a machine probed by the config flow or given up by another entry
+        return self._async_add_coordinator(service_info.address)
+
+    @callback
+    def async_restore(self, stored: dict) -> None:
+        """Create the coordinators of the machines known at the last run."""
+        connections = self.connections
+        self.api.restore(
+            {
+                address: state
+                for address, state in stored.get("devices", {}).items()
+                if connections.owner_of(address) is self
+            },
+            lambda address: async_ble_device_from_address(
+                self.hass, address, connectable=True
+            ),
+        )
+        # Also picks up the machine read by the config flow
+        for bundle in self.api.bundles:
+            address = bundle.device.address
+            if connections.owner_of(address) is not self:
+                continue
+            if connections.tracker_of(address) is None:
+                coordinator = self._async_add_coordinator(address)
+                coordinator.data = bundle.attributes
+
+    @callback
+    def _async_add_coordinator(self, address: str) -> NespressoDataUpdateCoordinator:
+        self.api.set_auth_code(address, self.auth_code)
+        coordinator = NespressoDataUpdateCoordinator(
+            self.hass, self.api, address, self.notifications, self.async_schedule_save
+        )
+        self.coordinators[address] = coordinator
+        return coordinator
+
+    @callback
+    def async_drop(self, address: str) -> None:
+        """Remove the coordinator and entities of a machine."""
+        if self.coordinators.pop(address, None) is None:
+            return
+        if self.api is not None:
+            # Its notifications must not reach the dropped coordinator
+            self.api.unsubscribe_bundle(address)
+        async_dispatcher_send(
+            self.hass, SIGNAL_DEVICE_REMOVED.format(self.entry.entry_id), address
+        )
+        self.async_schedule_save()
+
+    @callback
+    def async_schedule_save(self) -> None:
+        """Persist the state of every machine at most once per SAVE_DELAY."""
+        # async_delay_save restarts its timer, steady changes would never be saved
+        if self._save_scheduled:
+            return
+        self._save_scheduled = True
+        self.store.async_delay_save(self._data_to_save, SAVE_DELAY)
+
+    @callback
+    def _data_to_save(self) -> dict:
+        self._save_scheduled = False
+        return {"devices": self.api.snapshot(self.coordinators)}
+
+    @callback
+    def async_handle_advertisement(
+        self, service_info: BluetoothServiceInfoBleak
+    ) -> None:
+        """Track a Prodigio advertisement without scanning."""
+        coordinator = self.async_track_device(service_info)
+        if coordinator is not None:
+            _LOGGER.debug("New machine {} advertised".format(service_info.address))
+            self.hass.async_create_task(self._async_start(coordinator))
+            return
+        coordinator = self.coordinators.get(service_info.address)
+        if coordinator is not None and coordinator.schedule.is_backing_off:
+            # The machine is back in range, no need to wait out the backoff
+            self.hass.async_create_task(coordinator.async_request_refresh())
+
+    async def _async_start(self, coordinator: NespressoDataUpdateCoordinator) -> None:
+        # Entities are added from the advertisement, the first read fills them in
+        async_dispatcher_send(
+            self.hass, SIGNAL_DEVICE_ADDED.format(self.entry.entry_id), coordinator
+        )
+        await coordinator.async_refresh()
+
+    async def async_refresh(self) -> None:
+        """Refresh every machine concurrently."""
         await asyncio.gather(
             *[
-                hass.config_entries.async_forward_entry_unload(entry, platform)
-                for platform in PLATFORMS
-                if platform in coordinator.platforms
+                coordinator.async_refresh()
+                for coordinator in self.coordinators.values()
             ]
         )
+
+
+async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
+    """Handle removal of an entry."""
+    connections = hass.data[DOMAIN]
+    manager = connections.entries[entry.entry_id]
+    unloaded = await hass.config_entries.async_unload_platforms(
+        entry, manager.platforms
     )
     if unloaded:
-        hass.data[DOMAIN].pop(entry.entry_id)
+        if manager.api is not None and manager.coordinators:
+            # Written now, the machines are forgotten by the shared client
+            await manager.store.async_save(manager._data_to_save())
+        await connections.async_remove_entry(manager)
 
     return unloaded
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Delete the stored machine state with the entry."""
+    await Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry.entry_id}").async_remove()
+
+
 async def async_reload_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Reload config entry."""
     await async_unload_entry(hass, entry)
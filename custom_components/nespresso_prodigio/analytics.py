@@ -0,0 +1,231 @@
+"""Capsule consumption history and rolling aggregates per machine.
+
+Samples of (timestamp, caps_number, descaling_counter) are kept in
+fixed-size arrays used as a ring buffer, so memory stays bounded however
+long the install runs. Rolling windows are updated incrementally, each
+sample is added and expired once.
+"""
+import base64
+import sys
+import time
+from array import array
+from typing import Callable, Union
+
+# Samples kept per machine, one is recorded per change of the counters
+HISTORY_SIZE = 512
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+
+
+class RollingWindow:
+    """Capsules, brews and descaling counter growth of the last span seconds."""
+
+    __slots__ = ("span", "start", "base_caps", "base_descaling", "brews")
+
+    def __init__(self, span: float):
+        self.span = span
+        # Sequence number of the oldest sample inside the window
+        self.start = 0
+        # Counters of the sample just before the window
+        self.base_caps = 0
+        self.base_descaling = 0
+        self.brews = 0
+
+
+class ConsumptionHistory:
+    """Ring buffer of counter samples with O(1) amortised rolling aggregates."""
+
+    def __init__(
+        self,
+        size: int = HISTORY_SIZE,
+        clock: Callable[[], float] = None,
+    ):
+        self.size = size
+        self.clock = clock or time.time
+        self.timestamps = array("d", bytes(8 * size))
+        self.caps = array("q", bytes(8 * size))
+        self.descaling = array("q", bytes(8 * size))
+        # Sequence number of the next sample, the slot is seq % size
+        self.seq = 0
+        self.first_timestamp: Union[float, None] = None
+        # Counters of the last sample pushed out of the ring
+        self.dropped: Union[tuple[int, int], None] = None
+        # Counter value at which the machine last asked for descaling
+        self.descaling_threshold: Union[int, None] = None
+        self.day = RollingWindow(DAY)
+        self.week = RollingWindow(WEEK)
+        self._windows = (self.day, self.week)
+
+    def __len__(self) -> int:
+        return min(self.seq, self.size)
+
+    @property
+    def latest(self) -> Union[tuple[float, int, int], None]:
+        if not self.seq:
+            return None
+        slot = (self.seq - 1) % self.size
+        return self.timestamps[slot], self.caps[slot], self.descaling[slot]
+
+    def record(self, attributes: dict, timestamp: float = None) -> bool:
+        """Add a sample when the counters in attributes changed."""
+        caps = attributes.get("caps_number")
+        descaling = attributes.get("descaling_counter")
+        if caps is None or descaling is None:
+            return False
+        if attributes.get("descaling_needed"):
+            self.descaling_threshold = descaling
+        latest = self.latest
+        if latest is not None and latest[1:] == (caps, descaling):
+            return False
+        self.append(self.clock() if timestamp is None else timestamp, caps, descaling)
+        return True
+
+    def append(self, timestamp: float, caps: int, descaling: int) -> None:
+        if not self.seq:
+            self.first_timestamp = timestamp
+            for window in self._windows:
+                window.base_caps = caps
+                window.base_descaling = descaling
+        elif self.seq >= self.size:
+            # The oldest sample is overwritten, windows can't span past it
+            oldest = self.seq - self.size
+            for window in self._windows:
+                if window.start == oldest:
+                    self._expire_one(window)
+            slot = oldest % self.size
+            self.dropped = (self.caps[slot], self.descaling[slot])
+        previous = self.latest
+        slot = self.seq % self.size
+        self.timestamps[slot] = timestamp
+        self.caps[slot] = caps
+        self.descaling[slot] = descaling
+        self.seq += 1
+        if previous is not None and caps > previous[1]:
+            for window in self._windows:
+                window.brews += 1
+        self.expire(timestamp)
+
+    def _expire_one(self, window: RollingWindow) -> None:
+        slot = window.start % self.size
+        caps = self.caps[slot]
+        if caps > window.base_caps:
+            window.brews -= 1
+        window.base_caps = caps
+        window.base_descaling = self.descaling[slot]
+        window.start += 1
+
+    def expire(self, now: float = None) -> None:
+        """Drop the samples that fell out of each window."""
+        now = self.clock() if now is None else now
+        for window in self._windows:
+            limit = now - window.span
+            while window.start < self.seq and (
+                self.timestamps[window.start % self.size] < limit
+            ):
+                self._expire_one(window)
+
+    def _covered(self, window: RollingWindow, now: float) -> float:
+        """Seconds of the window for which there is history."""
+        if self.first_timestamp is None:
+            return 0.0
+        return min(window.span, now - self.first_timestamp)
+
+    def capsules(self, window: RollingWindow) -> int:
+        latest = self.latest
+        return max(0, latest[1] - window.base_caps) if latest else 0
+
+    def capsules_per_day(self, now: float = None) -> Union[float, None]:
+        now = self.clock() if now is None else now
+        self.expire(now)
+        if not self.seq:
+            return None
+        days = max(self._covered(self.week, now), DAY) / DAY
+        return self.capsules(self.week) / days
+
+    def brews_per_hour(self, now: float = None) -> Union[float, None]:
+        now = self.clock() if now is None else now
+        self.expire(now)
+        if not self.seq:
+            return None
+        hours = max(self._covered(self.day, now), 3600) / 3600
+        return self.day.brews / hours
+
+    def days_until_descaling(self, now: float = None) -> Union[float, None]:
+        """Forecast from the counter growth of the last week.
+
+        Unknown until the machine has asked for descaling once, which teaches
+        the counter value it does so at.
+        """
+        now = self.clock() if now is None else now
+        self.expire(now)
+        latest = self.latest
+        if latest is None or self.descaling_threshold is None:
+            return None
+        remaining = self.descaling_threshold - latest[2]
+        if remaining <= 0:
+            return 0.0
+        # The counter restarts after a descaling, only count the growth since
+        growth = latest[2] - self.week.base_descaling
+        if growth < 0:
+            growth = latest[2]
+        days = max(self._covered(self.week, now), DAY) / DAY
+        if growth <= 0:
+            return None
+        return remaining / (growth / days)
+
+    def as_dict(self) -> dict:
+        """Return the samples in chronological order, packed for storage."""
+        count = len(self)
+        order = [(self.seq - count + i) % self.size for i in range(count)]
+        return {
+            "timestamps": _pack(array("d", (self.timestamps[i] for i in order))),
+            "caps": _pack(array("q", (self.caps[i] for i in order))),
+            "descaling": _pack(array("q", (self.descaling[i] for i in order))),
+            "first_timestamp": self.first_timestamp,
+            "dropped": self.dropped,
+            "descaling_threshold": self.descaling_threshold,
+        }
+
+    @classmethod
+    def from_dict(
+        cls,
+        data: dict,
+        size: int = HISTORY_SIZE,
+        clock: Callable[[], float] = None,
+    ) -> "ConsumptionHistory":
+        history = cls(size, clock)
+        samples = zip(
+            _unpack("d", data.get("timestamps", "")),
+            _unpack("q", data.get("caps", "")),
+            _unpack("q", data.get("descaling", "")),
+        )
+        for timestamp, caps, descaling in samples:
+            history.append(timestamp, caps, descaling)
+        dropped = data.get("dropped")
+        if dropped is not None and history.dropped is None and history.seq:
+            # Windows still holding the oldest sample start from before it
+            history.dropped = caps, descaling = tuple(dropped)
+            for window in history._windows:
+                if window.start == 0:
+                    if history.caps[0] > caps:
+                        window.brews += 1
+                    window.base_caps = caps
+                    window.base_descaling = descaling
+        if data.get("first_timestamp") is not None:
+            history.first_timestamp = data["first_timestamp"]
+        history.descaling_threshold = data.get("descaling_threshold")
+        return history
+
+
+def _pack(values: array) -> str:
+    # Stored little endian whatever the platform
+    if sys.byteorder == "big":
+        values.byteswap()
+    return base64.b64encode(values.tobytes()).decode()
+
+
+def _unpack(typecode: str, data: str) -> array:
+    values = array(typecode, base64.b64decode(data))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
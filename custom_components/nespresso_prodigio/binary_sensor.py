@@ -0,0 +1,74 @@
+"""Binary sensors of the Nespresso Prodigio status flags."""
+from __future__ import annotations
+
+import logging
+
+from homeassistant.components.binary_sensor import (
+    BinarySensorDeviceClass,
+    BinarySensorEntity,
+)
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.entity import EntityCategory
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+
+from .entity import NespressoFieldEntity, async_setup_device_entities
+
+_LOGGER = logging.getLogger(__name__)
+
+# Decoded status flag, name, device class, entity category
+FIELD_BINARY_SENSORS = (
+    ("water_is_empty", "Water empty", BinarySensorDeviceClass.PROBLEM, None),
+    ("descaling_needed", "Descaling needed", BinarySensorDeviceClass.PROBLEM, None),
+    ("capsule_mechanism_jammed", "Capsule mechanism jammed",
+     BinarySensorDeviceClass.PROBLEM, None),
+    ("tray_open_tray_sensor_full", "Tray open or full",
+     BinarySensorDeviceClass.PROBLEM, None),
+    ("Fault", "Fault", BinarySensorDeviceClass.PROBLEM, None),
+    ("water_engadged", "Brewing", BinarySensorDeviceClass.RUNNING, None),
+    ("capsule_engaged", "Capsule engaged", None, None),
+    ("water_temp_low", "Water temperature low", BinarySensorDeviceClass.COLD,
+     EntityCategory.DIAGNOSTIC),
+    ("awake", "Awake", None, EntityCategory.DIAGNOSTIC),
+    ("sleeping", "Sleeping", None, EntityCategory.DIAGNOSTIC),
+    ("tray_sensor_during_brewing", "Tray sensor during brewing", None,
+     EntityCategory.DIAGNOSTIC),
+)
+
+
+async def async_setup_entry(
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        async_add_devices: AddEntitiesCallback,
+):
+    """Set up the Nespresso binary sensors."""
+    async_setup_device_entities(
+        hass,
+        entry,
+        async_add_devices,
+        lambda manager, coordinator: [
+            NespressoBinarySensor(coordinator, *description)
+            for description in FIELD_BINARY_SENSORS
+        ],
+    )
+
+
+class NespressoBinarySensor(NespressoFieldEntity, BinarySensorEntity):
+    """A status flag decoded from the machine."""
+
+    def __init__(
+            self,
+            coordinator,
+            attribute: str,
+            name: str,
+            device_class: BinarySensorDeviceClass | None,
+            entity_category: EntityCategory | None,
+    ):
+        super().__init__(coordinator, attribute, name)
+        self._attr_device_class = device_class
+        self._attr_entity_category = entity_category
+
+    @property
+    def is_on(self) -> bool | None:
+        value = self._value
+        return bool(value) if value is not None else None
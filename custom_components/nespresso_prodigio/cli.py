@@ -0,0 +1,230 @@
+"""Fleet monitor for Prodigio machines, without Home Assistant.
+
+Run from the repository root:
+
+    python -m custom_components.nespresso_prodigio.cli --auth-code 0011... monitor
+    python -m custom_components.nespresso_prodigio.cli --auth-file codes.txt monitor
+    python -m custom_components.nespresso_prodigio.cli --auth-code 0011... bench
+    python -m custom_components.nespresso_prodigio.cli --simulate 50 bench --rounds 20
+
+Options shared by the commands go before the command name, --interval,
+--no-notifications and --rounds after it. monitor prints one JSON object per
+line each time the decoded state of a machine changes. bench reconnects to
+every machine rounds times and reports connect, auth and read latency
+percentiles. The auth file holds one "address auth_code" pair per line,
+machines not listed use --auth-code. --simulate N runs against N simulated
+machines instead of the radio.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import Union
+
+from bleak import BleakScanner
+
+from .nespresso import Instrumentation, NespressoClient, NespressoDeviceBundle
+
+_LOGGER = logging.getLogger(__name__)
+
+BENCH_OPERATIONS = ("connect", "auth", "read")
+
+
+class SampleInstrumentation(Instrumentation):
+    """Keeps every latency sample as well, for exact percentiles."""
+
+    def __init__(self):
+        super().__init__(True)
+        self.samples: dict[str, list[float]] = {}
+
+    def observe(self, address: str, operation: str, seconds: float) -> None:
+        super().observe(address, operation, seconds)
+        self.samples.setdefault(operation, []).append(seconds)
+
+
+def read_auth_codes(path: str) -> dict[str, str]:
+    codes = {}
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            try:
+                address, auth_code = line.split()
+            except ValueError:
+                raise ValueError(
+                    "{}:{}: expected an address and an auth code".format(path, number)
+                ) from None
+            codes[address.upper()] = auth_code
+    return codes
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def state_line(bundle: NespressoDeviceBundle) -> str:
+    return json.dumps(
+        {
+            "time": round(time.time(), 3),
+            "address": bundle.device.address,
+            "name": bundle.device.name,
+            "attributes": bundle.attributes,
+        },
+        default=str,
+    )
+
+
+class Backend:
+    """Scanner and client factory of the radio or of simulated machines."""
+
+    def __init__(self, args):
+        self._simulator = None
+        self._scanner = None
+        self._auth_code = args.auth_code
+        if args.simulate:
+            from .simulator import DEFAULT_AUTH_CODE, LinkProfile, ProdigioSimulator
+
+            self._simulator = ProdigioSimulator(slots_per_source=args.simulate)
+            self._simulator.add_fleet(
+                args.simulate,
+                sources=args.sources,
+                link=LinkProfile(args.connect_delay, args.read_delay),
+            )
+            self._auth_code = self._auth_code or DEFAULT_AUTH_CODE
+
+    async def __aenter__(self) -> "Backend":
+        if self._simulator is None:
+            self._scanner = BleakScanner()
+            await self._scanner.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        if self._scanner is not None:
+            await self._scanner.__aexit__(*exc_info)
+
+    def client(self, args, **kwargs) -> NespressoClient:
+        auth_codes = read_auth_codes(args.auth_file) if args.auth_file else {}
+        if self._simulator is not None:
+            kwargs["client_factory"] = self._simulator.client_factory
+            scanner = self._simulator.scanner()
+        else:
+            scanner = self._scanner
+        return NespressoClient(
+            scanner, self._auth_code, auth_codes=auth_codes, **kwargs
+        )
+
+
+async def monitor(args) -> None:
+    async with Backend(args) as backend:
+        client = backend.client(args)
+        known = set()
+
+        def emit(bundle: NespressoDeviceBundle) -> None:
+            print(state_line(bundle), flush=True)
+
+        try:
+            while True:
+                await client.discover_nespresso_devices()
+                new = [bundle for bundle in client.bundles if bundle not in known]
+                known.update(new)
+                try:
+                    await client.get_device_data(emit)
+                except Exception as e:
+                    _LOGGER.warning("No machine could be read: {}".format(e))
+                if args.notifications:
+                    for bundle in new:
+                        await client.subscribe_bundle(bundle, emit)
+                await asyncio.sleep(args.interval)
+        finally:
+            await client.stop_notifications()
+
+
+async def bench(args) -> None:
+    async with Backend(args) as backend:
+        instrumentation = SampleInstrumentation()
+        client = backend.client(args, instrumentation=instrumentation)
+        await client.discover_nespresso_devices()
+        bundles = client.bundles
+        if not bundles:
+            print("No Prodigio machine found", file=sys.stderr)
+            return
+        errors = 0
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            # Cold sessions, every round connects and authenticates again
+            await asyncio.gather(
+                *[client.disconnect(bundle.device) for bundle in bundles]
+            )
+            for bundle in bundles:
+                bundle.read_at.clear()
+            results = await asyncio.gather(
+                *[client.poll_bundle(bundle) for bundle in bundles],
+                return_exceptions=True,
+            )
+            errors += sum(isinstance(result, Exception) for result in results)
+        elapsed = time.perf_counter() - start
+        await asyncio.gather(*[client.disconnect(bundle.device) for bundle in bundles])
+    print(
+        "{} machines, {} rounds in {:.1f}s, {} failed polls".format(
+            len(bundles), args.rounds, elapsed, errors
+        )
+    )
+    for operation in BENCH_OPERATIONS:
+        report(operation, instrumentation.samples.get(operation, []))
+
+
+def report(operation: str, samples: list) -> None:
+    if not samples:
+        print("{:<8} no samples".format(operation))
+        return
+    print(
+        "{:<8} n={:<5} p50={:8.1f}ms p90={:8.1f}ms p99={:8.1f}ms max={:8.1f}ms".format(
+            operation,
+            len(samples),
+            percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.9) * 1000,
+            percentile(samples, 0.99) * 1000,
+            max(samples) * 1000,
+        )
+    )
+
+
+def parse_args(argv: Union[list, None] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--auth-code", help="auth code of the machines not listed")
+    parser.add_argument("--auth-file", help="file of address auth_code lines")
+    parser.add_argument("--simulate", type=int, default=0, metavar="N")
+    parser.add_argument("--sources", type=int, default=1, help="simulated proxies")
+    parser.add_argument("--connect-delay", type=float, default=0.05)
+    parser.add_argument("--read-delay", type=float, default=0.01)
+    parser.add_argument("--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+    monitor_parser = commands.add_parser("monitor", help="stream state as JSON Lines")
+    monitor_parser.add_argument("--interval", type=float, default=30.0)
+    monitor_parser.add_argument(
+        "--no-notifications", dest="notifications", action="store_false"
+    )
+    bench_parser = commands.add_parser("bench", help="connect, auth, read latency")
+    bench_parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args(argv)
+    if not args.simulate and not args.auth_code and not args.auth_file:
+        parser.error("--auth-code or --auth-file is required")
+    return args
+
+
+def main(argv: Union[list, None] = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+    command = monitor if args.command == "monitor" else bench
+    try:
+        asyncio.run(command(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
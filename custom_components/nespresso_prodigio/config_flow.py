@@ -1,6 +1,7 @@
 """Config flow for yeelight_bt"""
 from __future__ import annotations
 
+import asyncio
 import logging
 
 import voluptuous as vol
@@ -8,17 +9,28 @@ from bleak import BleakError
 from homeassistant import config_entries
 from homeassistant.core import callback
 from homeassistant.components.bluetooth import (
-    async_get_scanner,
+    BluetoothServiceInfoBleak,
+    async_discovered_service_info,
+)
+from homeassistant.const import CONF_ADDRESS
+
+from . import async_get_connection_manager
+from .const import (
+    CONF_ENTRY_AUTH_KEY,
+    CONF_INSTRUMENTATION,
+    CONF_KEEP_CONNECTED,
+    CONF_NOTIFICATIONS,
+    CONF_RECORD_TRAFFIC,
+    DOMAIN,
+    LOCAL_NAME_PREFIX,
+    PLATFORMS,
 )
-
-from .const import CONF_ENTRY_AUTH_KEY, DOMAIN, PLATFORMS
-from .nespresso import NespressoClient
 
 _LOGGER = logging.getLogger(__name__)
 
 
 class NespressoFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
-    """Config flow for Blueprint."""
+    """Config flow of one machine with its own auth key."""
 
     VERSION = 1
     CONNECTION_CLASS = config_entries.CONN_CLASS_CLOUD_POLL
@@ -26,29 +38,64 @@ class NespressoFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     def __init__(self):
         """Initialize."""
         self._errors = {}
+        self._discovery_info: BluetoothServiceInfoBleak | None = None
+        self._discovered: dict[str, BluetoothServiceInfoBleak] = {}
+
+    async def async_step_bluetooth(self, discovery_info: BluetoothServiceInfoBleak):
+        """Handle a machine found by the bluetooth integration."""
+        await self.async_set_unique_id(discovery_info.address)
+        self._abort_if_unique_id_configured()
+        self._discovery_info = discovery_info
+        self.context["title_placeholders"] = {"name": discovery_info.name}
+        return await self.async_step_bluetooth_confirm()
+
+    async def async_step_bluetooth_confirm(self, user_input=None):
+        """Ask for the auth key of a discovered machine."""
+        self._errors = {}
+        if user_input is not None:
+            auth_code = user_input[CONF_ENTRY_AUTH_KEY]
+            if await self._test_connection(self._discovery_info, auth_code):
+                return self._create_entry(self._discovery_info, auth_code)
+
+        return self.async_show_form(
+            step_id="bluetooth_confirm",
+            data_schema=vol.Schema({vol.Required(CONF_ENTRY_AUTH_KEY): str}),
+            description_placeholders={"name": self._discovery_info.name},
+            errors=self._errors,
+        )
 
     async def async_step_user(self, user_input=None):
         """Handle a flow initialized by the user."""
         self._errors = {}
 
-        if self._async_current_entries():
-            return self.async_abort(reason="single_instance_allowed")
-
         if user_input is not None:
-            valid = await self._test_connection(
-                user_input[CONF_ENTRY_AUTH_KEY]
-            )
-            if valid:
-                return self.async_create_entry(
-                    title=user_input[CONF_ENTRY_AUTH_KEY], data=user_input
-                )
-            else:
-                self._errors["base"] = "auth"
+            address = user_input[CONF_ADDRESS]
+            await self.async_set_unique_id(address, raise_on_progress=False)
+            self._abort_if_unique_id_configured()
+            service_info = self._discovered[address]
+            auth_code = user_input[CONF_ENTRY_AUTH_KEY]
+            if await self._test_connection(service_info, auth_code):
+                return self._create_entry(service_info, auth_code)
 
             return await self._show_config_form(user_input)
 
+        configured = self._async_current_ids()
+        self._discovered = {
+            service_info.address: service_info
+            for service_info in async_discovered_service_info(self.hass)
+            if service_info.name.startswith(LOCAL_NAME_PREFIX)
+            and service_info.address not in configured
+        }
+        if not self._discovered:
+            _LOGGER.error(
+                "No Prodigio advertisement seen. Enable the bluetooth integration "
+                "or ensure an esphome device is running as a bluetooth proxy"
+            )
+            return self.async_abort(reason="no_devices")
+
         user_input = {}
         # Provide defaults for form
+        user_input[CONF_ADDRESS] = next(iter(self._discovered))
         user_input[CONF_ENTRY_AUTH_KEY] = ""
 
         return await self._show_config_form(user_input)
@@ -64,36 +111,53 @@ class NespressoFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
             step_id="user",
             data_schema=vol.Schema(
                 {
-                    vol.Required(CONF_ENTRY_AUTH_KEY, default=user_input[CONF_ENTRY_AUTH_KEY]): str,
+                    vol.Required(
+                        CONF_ADDRESS, default=user_input[CONF_ADDRESS]
+                    ): vol.In(
+                        {
+                            address: "{} ({})".format(service_info.name, address)
+                            for address, service_info in self._discovered.items()
+                        }
+                    ),
+                    vol.Required(
+                        CONF_ENTRY_AUTH_KEY, default=user_input[CONF_ENTRY_AUTH_KEY]
+                    ): str,
                 }
             ),
             errors=self._errors,
         )
 
-    async def _test_connection(self, auth_code):
-        """Return true if credentials is valid."""
+    @callback
+    def _create_entry(self, service_info: BluetoothServiceInfoBleak, auth_code: str):
+        return self.async_create_entry(
+            title=service_info.name,
+            data={CONF_ADDRESS: service_info.address, CONF_ENTRY_AUTH_KEY: auth_code},
+        )
+
+    async def _test_connection(self, service_info, auth_code):
+        """Return true if the machine accepts the auth key.
+
+        The probe goes through the connection manager shared by the entries,
+        the authenticated session is kept for async_setup_entry.
+        """
+        connections = async_get_connection_manager(self.hass)
         try:
-            scanner = async_get_scanner(self.hass)
-            _LOGGER.debug("Preparing for a scan")
-            if len(scanner.discovered_devices) == 0:
-                message = "No bluetooth scanner detected. \
-                            Enable the bluetooth integration or ensure an esphome device \
-                            is running as a bluetooth proxy"
-                _LOGGER.error(message)
-                self._errors["base"] = message
-                return False
-            try:
-                _LOGGER.debug("Starting a scan for Nespresso BT devices")
-                client = NespressoClient(scanner, auth_code)
-                await client.get_device_data()
-            except BleakError as err:
-                _LOGGER.exception(err)
-                self._errors["base"] = "BleakError"
-                return False
-            return True
-        except Exception as e:  # pylint: disable=broad-except
-            self._errors["base"] = str(e)
+            await connections.async_probe(service_info, auth_code)
+        except (BleakError, asyncio.TimeoutError) as err:
+            _LOGGER.debug("Probe of {} failed: {}".format(service_info.address, err))
+            if str(err).endswith("Insufficient authentication"):
+                self._errors["base"] = "auth"
+            else:
+                self._errors["base"] = "cannot_connect"
+            return False
+        except Exception as err:  # pylint: disable=broad-except
+            # e.g. the link dropping right after the connect
+            _LOGGER.warning(
+                "Unexpected error probing {}: {}".format(service_info.address, err)
+            )
+            self._errors["base"] = "cannot_connect"
             return False
+        return True
 
 
 class NespressoOptionsFlowHandler(config_entries.OptionsFlow):
@@ -118,8 +182,14 @@ class NespressoOptionsFlowHandler(config_entries.OptionsFlow):
             step_id="user",
             data_schema=vol.Schema(
                 {
-                    vol.Required(x, default=self.options.get(x, True)): bool
-                    for x in sorted(PLATFORMS)
+                    vol.Required(x, default=self.options.get(x, default)): bool
+                    for x, default in [(x, True) for x in sorted(PLATFORMS)]
+                    + [
+                        (CONF_NOTIFICATIONS, True),
+                        (CONF_KEEP_CONNECTED, False),
+                        (CONF_INSTRUMENTATION, False),
+                        (CONF_RECORD_TRAFFIC, False),
+                    ]
                 }
             ),
         )
@@ -1,6 +1,28 @@
+from enum import Enum
+
 DOMAIN = "nespresso_prodigio"
 CONF_ENTRY_AUTH_KEY = "auth_key"
+CONF_NOTIFICATIONS = "notifications"
+CONF_KEEP_CONNECTED = "keep_connected"
+CONF_INSTRUMENTATION = "instrumentation"
+CONF_RECORD_TRAFFIC = "record_traffic"
+BINARY_SENSOR = "binary_sensor"
 SELECT = "select"
+SENSOR = "sensor"
 SWITCH = "switch"
-PLATFORMS = [SELECT, SWITCH]
+PLATFORMS = [BINARY_SENSOR, SELECT, SENSOR, SWITCH]
 DEFAULT_NAME = DOMAIN
+# Machines advertise a local name starting with this
+LOCAL_NAME_PREFIX = "Prodigio"
+# Seconds a scheduled brew connects and authenticates ahead of its time
+BREW_LEAD_TIME = 60
+SERVICE_SCHEDULE_BREW = "schedule_brew"
+# Dispatcher signals, formatted with the entry id
+SIGNAL_DEVICE_ADDED = f"{DOMAIN}_device_added_{{}}"
+SIGNAL_DEVICE_REMOVED = f"{DOMAIN}_device_removed_{{}}"
+
+
+class NespressoVolume(Enum):
+    RISTRETTO = "Ristretto"
+    ESPRESSO = "Espresso"
+    LUNGO = "Lungo"
@@ -0,0 +1,45 @@
+"""Diagnostics support for Nespresso Prodigio."""
+from __future__ import annotations
+
+from typing import Any
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import CONF_ENTRY_AUTH_KEY, DOMAIN
+
+# The entry title is the auth key as well
+TO_REDACT = {CONF_ENTRY_AUTH_KEY, "title"}
+
+
+async def async_get_config_entry_diagnostics(
+        hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    manager = hass.data[DOMAIN].entries[entry.entry_id]
+    recorder = manager.connections.recorder
+    api = manager.api
+    if api is None:
+        # No machine has been seen since the integration was loaded
+        return {"entry": async_redact_data(entry.as_dict(), TO_REDACT), "devices": {}}
+    return {
+        "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+        "connections": api.connection_metrics,
+        "instrumentation_enabled": api.instrumentation.enabled,
+        "recorder": None
+        if recorder is None
+        else {"path": recorder.path, "records": recorder.records},
+        "devices": {
+            address: {
+                "name": coordinator.bundle.device.name if coordinator.bundle else None,
+                "attributes": coordinator.data,
+                "last_update_success": coordinator.last_update_success,
+                "update_interval": coordinator.update_interval.total_seconds(),
+                "last_brew": api.last_brew_trace.get(address),
+                "queue": api.queue_metrics(address),
+                "instrumentation": api.instrumentation.device_snapshot(address),
+            }
+            for address, coordinator in manager.coordinators.items()
+        },
+    }
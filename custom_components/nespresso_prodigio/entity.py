@@ -0,0 +1,98 @@
+"""Helpers shared by the Nespresso entity platforms."""
+from __future__ import annotations
+
+import logging
+from typing import Callable
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.device_registry import format_mac
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.entity import DeviceInfo, Entity
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .const import DOMAIN, SIGNAL_DEVICE_ADDED, SIGNAL_DEVICE_REMOVED
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def async_setup_device_entities(
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        async_add_devices: AddEntitiesCallback,
+        entity_factory: Callable[..., list[Entity]],
+) -> None:
+    """Add entities per machine and remove them when the machine goes away.
+
+    entity_factory is called with the manager and the machine's coordinator.
+    """
+    manager = hass.data[DOMAIN].entries[entry.entry_id]
+    entities: dict[str, list[Entity]] = {}
+
+    @callback
+    def _async_add_device(coordinator) -> None:
+        bundle = coordinator.bundle
+        if coordinator.address in entities or bundle is None:
+            return
+        entities[coordinator.address] = entity_factory(manager, coordinator)
+        async_add_devices(entities[coordinator.address])
+
+    @callback
+    def _async_remove_device(address: str) -> None:
+        for entity in entities.pop(address, []):
+            hass.async_create_task(entity.async_remove())
+
+    for coordinator in list(manager.coordinators.values()):
+        _async_add_device(coordinator)
+    entry.async_on_unload(
+        async_dispatcher_connect(
+            hass, SIGNAL_DEVICE_ADDED.format(entry.entry_id), _async_add_device
+        )
+    )
+    entry.async_on_unload(
+        async_dispatcher_connect(
+            hass, SIGNAL_DEVICE_REMOVED.format(entry.entry_id), _async_remove_device
+        )
+    )
+
+
+class NespressoFieldEntity(CoordinatorEntity):
+    """One decoded field of a machine, written only when that field changes."""
+
+    def __init__(self, coordinator, attribute: str, name: str):
+        super().__init__(coordinator)
+        bundle = coordinator.bundle
+        self._attribute = attribute
+        self._address = bundle.device.address
+        self._device_name = bundle.device.name
+        self._attr_name = f"nespresso_{bundle.device.name} {name}"
+        self._attr_unique_id = f"{format_mac(self._address)}_{attribute.lower()}"
+        self._written = None
+
+    @property
+    def _value(self):
+        bundle = self.coordinator.bundle
+        return bundle.attributes.get(self._attribute) if bundle is not None else None
+
+    @property
+    def available(self) -> bool:
+        return super().available and self._value is not None
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return the device info."""
+        return DeviceInfo(
+            name=self._device_name,
+            identifiers={(DOMAIN, self._address)},
+            manufacturer="Nespresso",
+            model="Prodigio",
+        )
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        written = (self.available, self._value)
+        if written == self._written:
+            return
+        self._written = written
+        self.async_write_ha_state()
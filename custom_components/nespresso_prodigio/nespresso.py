@@ -1,16 +1,38 @@
 import asyncio
-import ctypes
+import bisect
+import collections
+import collections.abc
+import heapq
+import itertools
 import logging
+import random
+import time
 import uuid
-from enum import Enum
-from typing import Union
+from typing import Awaitable, Callable, Union
 
 import binascii
-from bleak import BleakClient, BLEDevice, BleakScanner, BleakGATTCharacteristic
+from bleak import (
+    BleakClient,
+    BLEDevice,
+    BleakError,
+    BleakScanner,
+    BleakGATTCharacteristic,
+)
 
-_LOGGER = logging.getLogger(__name__)
+from .analytics import ConsumptionHistory
+from .const import BREW_LEAD_TIME, NespressoVolume
+from .recorder import (
+    AUTH,
+    CONNECT,
+    DISCONNECT,
+    ERROR,
+    NOTIFY,
+    READ,
+    WRITE,
+    GattRecorder,
+)
 
-c_uint8 = ctypes.c_uint8
+_LOGGER = logging.getLogger(__name__)
 
 CHAR_UUID_MANUFACTURER_NAME = "06aa3a41-f22a-11e3-9daa-0002a5d5c51b"
 CHAR_UUID_STATUS = "06aa3a12-f22a-11e3-9daa-0002a5d5c51b"
@@ -21,35 +43,68 @@ CHAR_UUID_AUTH = "06aa3a41-f22a-11e3-9daa-0002a5d5c51b"
 CHAR_UUID_COMMAND = "06aa3a42-f22a-11e3-9daa-0002a5d5c51b"
 CHAR_UUID_SERVICE = "06aa1910-f22a-11e3-9daa-0002a5d5c51b"
 
+NOTIFY_CHARACTERISTICS = (CHAR_UUID_STATUS, CHAR_UUID_NBCAPS, CHAR_UUID_SLIDER)
+
 RETRIES_NUMBER = 5
+# Backoff doubles from RETRY_BASE_DELAY up to SLEEP_TIME within RETRY_DEADLINE
 SLEEP_TIME = 5
+RETRY_BASE_DELAY = 0.5
+RETRY_DEADLINE = 60
+# Consecutive failed operations before a device is failed fast
+BREAKER_FAILURES = 3
+BREAKER_RESET_TIMEOUT = 60
+# ESPHome bluetooth proxies have 3 connection slots by default, a link holds
+# its slot until it is closed and the least recently used one is dropped first
+MAX_CONNECTIONS_PER_ADAPTER = 3
+# Seconds a connect waits for a slot held by busy or pinned links
+SLOT_TIMEOUT = 30
+# Seconds without GATT traffic before an unpinned connection is closed
+IDLE_DISCONNECT_TIMEOUT = 60
+# Seconds the config flow waits for a connect, auth and status read
+PROBE_TIMEOUT = 15
+# Machines neither advertised nor read for this many seconds are forgotten
+DEVICE_TTL = 15 * 60
+# Poll intervals in seconds picked by AdaptivePollSchedule
+POLL_INTERVAL_BREWING = 1
+POLL_INTERVAL_AWAKE = 30
+POLL_INTERVAL_SLEEPING = 5 * 60
+POLL_INTERVAL_UNREACHABLE_MAX = 30 * 60
+# Seconds between reads of each characteristic, 0 reads it on every poll
+REFRESH_INTERVALS = {
+    CHAR_UUID_STATUS: 0,
+    CHAR_UUID_SLIDER: 0,
+    # Only changes after a brew, see REFRESH_TRIGGERS
+    CHAR_UUID_NBCAPS: 60 * 60,
+    # Machine configuration
+    CHAR_UUID_WATER_HARDNESS: 24 * 60 * 60,
+}
+# (attribute, old value, new value, characteristic) read again on that transition
+REFRESH_TRIGGERS = (
+    # The brew finished, one more capsule
+    ("water_engadged", 1, 0, CHAR_UUID_NBCAPS),
+)
+# Priorities of queued GATT operations, lower runs first
+PRIORITY_BREW = 0
+PRIORITY_DEFAULT = 1
+PRIORITY_BACKGROUND = 2
 
 
-class NespressoVolume(Enum):
-    RISTRETTO = "Ristretto"
-    ESPRESSO = "Espresso"
-    LUNGO = "Lungo"
-
-
-class FlagsBits(ctypes.LittleEndianStructure):
-    _fields_ = [
-        ("bit0", c_uint8, 1),  # asByte & 1
-        ("bit1", c_uint8, 1),  # asByte & 2
-        ("bit2", c_uint8, 1),  # asByte & 4
-        ("bit3", c_uint8, 1),  # asByte & 8
-        ("bit4", c_uint8, 1),  # asByte & 16
-        ("bit5", c_uint8, 1),  # asByte & 32
-        ("bit6", c_uint8, 1),  # asByte & 64
-        ("bit7", c_uint8, 1),  # asByte & 128
-    ]
-
-
-class Flags(ctypes.Union):
-    _anonymous_ = ("bit",)
-    _fields_ = [("bit", FlagsBits), ("asByte", c_uint8)]
+# Brew command per volume, the last byte selects the recipe
+BREW_COMMANDS = {
+    NespressoVolume.RISTRETTO: bytes.fromhex("030507040000000000" + "00"),
+    NespressoVolume.ESPRESSO: bytes.fromhex("030507040000000000" + "01"),
+    NespressoVolume.LUNGO: bytes.fromhex("030507040000000000" + "02"),
+}
 
 
-BYTE = Flags()
+def ble_device(address: str, name: str, source: Union[str, None] = None) -> BLEDevice:
+    """Build a BLEDevice for a machine that has not been advertised yet."""
+    details = {"source": source} if source else {}
+    try:
+        return BLEDevice(address, name, details, -127)
+    except TypeError:
+        # bleak dropped the rssi argument
+        return BLEDevice(address, name, details)
 
 
 class NespressoDeviceInfo:
@@ -65,62 +120,173 @@ class NespressoDeviceInfo:
         )
 
 
+# Status flags a scheduled brew is not fired with
+BREW_BLOCKING_FLAGS = (
+    "water_is_empty",
+    "tray_open_tray_sensor_full",
+    "capsule_mechanism_jammed",
+    "Fault",
+)
+# Seconds before a scheduled brew the status is read and checked
+BREW_CHECK_AHEAD = 1.0
+
+# (attribute, byte index, bit) of the flags in the status characteristic
+STATUS_FLAGS = (
+    ("water_is_empty", 0, 0),
+    ("descaling_needed", 0, 2),
+    ("capsule_mechanism_jammed", 0, 4),
+    ("always_1", 0, 6),
+    ("water_temp_low", 1, 0),
+    ("awake", 1, 1),
+    ("water_engadged", 1, 2),
+    ("sleeping", 1, 3),
+    ("tray_sensor_during_brewing", 1, 4),
+    ("tray_open_tray_sensor_full", 1, 6),
+    ("capsule_engaged", 1, 7),
+    ("Fault", 3, 5),
+)
+# Bytes of the status characteristic that carry flags, in STATUS_FIELDS order
+STATUS_FLAG_BYTES = (0, 1, 3)
+STATUS_FIELDS = tuple(
+    attribute
+    for byte in STATUS_FLAG_BYTES
+    for attribute, index, _ in STATUS_FLAGS
+    if index == byte
+) + ("descaling_counter",)
+
+
+def _flag_table(index):
+    # The flag values carried by each possible value of status byte index
+    bits = [bit for _, i, bit in STATUS_FLAGS if i == index]
+    return tuple(tuple((value >> bit) & 1 for bit in bits) for value in range(256))
+
+
+STATUS_FLAG_0, STATUS_FLAG_1, STATUS_FLAG_3 = (
+    _flag_table(i) for i in STATUS_FLAG_BYTES
+)
+
+SLIDER_TABLE = tuple({0: 0, 2: 1}.get(value, "N/A") for value in range(256))
+
+
+class Reading(collections.abc.Mapping):
+    """Attributes decoded from one payload, read like a read-only dict.
+
+    fields is shared by every reading of a characteristic, only the values
+    are built per payload. Attributes can also be read as reading.awake.
+    """
+
+    __slots__ = ("fields", "_values")
+
+    def __init__(self, fields: tuple, values: tuple):
+        self.fields = fields
+        self._values = values
+
+    def __getitem__(self, name: str):
+        try:
+            return self._values[self.fields.index(name)]
+        except ValueError:
+            raise KeyError(name) from None
+
+    def __getattr__(self, name: str):
+        # Only called for names that are not slots
+        if name in Reading.__slots__:
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+    def items(self):
+        return zip(self.fields, self._values)
+
+    def __repr__(self) -> str:
+        return "Reading({})".format(dict(self.items()))
+
+
+# Each decoder factory takes the fields of its readings and returns the
+# function decoding a payload into a Reading
+def _decode_state(fields):
+    def decode(val):
+        size = len(val)
+        # Missing trailing bytes read as zero
+        return Reading(
+            fields,
+            STATUS_FLAG_0[val[0]]
+            + STATUS_FLAG_1[val[1] if size > 1 else 0]
+            + STATUS_FLAG_3[val[3] if size > 3 else 0]
+            + (int.from_bytes(val[6:9], byteorder="big"),),
+        )
+
+    return decode
+
+
+def _decode_caps_number(fields):
+    def decode(val):
+        return Reading(fields, (int.from_bytes(val, byteorder="big"),))
+
+    return decode
+
+
+def _decode_water_hardness(fields):
+    # Only byte 2 counts, so every possible reading is built up front
+    readings = tuple(Reading(fields, (value,)) for value in range(256))
+    missing = Reading(fields, (0,))
+
+    def decode(val):
+        return readings[val[2]] if len(val) > 2 else missing
+
+    return decode
+
+
+def _decode_slider(fields):
+    readings = tuple(Reading(fields, (value,)) for value in SLIDER_TABLE)
+    unknown = Reading(fields, ("N/A",))
+
+    def decode(val):
+        return readings[val[0]] if len(val) == 1 else unknown
+
+    return decode
+
+
+def _decode_raw(fields):
+    def decode(val):
+        _LOGGER.debug("state_decoder else")
+        return Reading(fields, (val,))
+
+    return decode
+
+
+DECODERS = {
+    "state": _decode_state,
+    "caps_number": _decode_caps_number,
+    "water_hardness": _decode_water_hardness,
+    "slider": _decode_slider,
+}
+# Formats with several attributes, the others decode into one named after the decoder
+DECODER_FIELDS = {"state": STATUS_FIELDS}
+
+
 class BaseDecode:
+    __slots__ = ("name", "format_type", "fields", "decode_data")
+
     def __init__(self, name, format_type):
         self.name = name
         self.format_type = format_type
+        self.fields = DECODER_FIELDS.get(format_type, (name,))
+        # Resolved once instead of comparing format_type on every payload,
+        # decode_data(raw_data) returns a Reading
+        self.decode_data = DECODERS.get(format_type, _decode_raw)(self.fields)
 
-    def decode_data(self, raw_data):
-        # val = struct.unpack(self.format_type,raw_data)
-        val = raw_data
-        if self.format_type == "caps_number":
-            res = int.from_bytes(val, byteorder="big")
-        elif self.format_type == "water_hardness":
-            res = int.from_bytes(val[2:3], byteorder="big")
-        elif self.format_type == "slider":
-            res = binascii.hexlify(val)
-            if res == b"00":
-                res = 0
-                # res = 'on'
-            elif res == b"02":
-                res = 1
-                # res = 'off'
-            else:
-                res = "N/A"
-        elif self.format_type == "state":
-            byte0 = Flags()
-            byte1 = Flags()
-            byte2 = Flags()
-            byte3 = Flags()
-
-            byte0.asByte = val[0]
-            byte1.asByte = val[1] if len(val) > 1 else 0
-            byte2.asByte = val[2] if len(val) > 2 else 0
-            byte3.asByte = val[3] if len(val) > 3 else 0
-            try:
-                descaling_counter = int.from_bytes(val[6:9], byteorder="big")
-            except Exception as e:
-                _LOGGER.debug("can't get descaling counter", e)
-                descaling_counter = 0
-            return {
-                "water_is_empty": byte0.bit0,
-                "descaling_needed": byte0.bit2,
-                "capsule_mechanism_jammed": byte0.bit4,
-                "always_1": byte0.bit6,
-                "water_temp_low": byte1.bit0,
-                "awake": byte1.bit1,
-                "water_engadged": byte1.bit2,
-                "sleeping": byte1.bit3,
-                "tray_sensor_during_brewing": byte1.bit4,
-                "tray_open_tray_sensor_full": byte1.bit6,
-                "capsule_engaged": byte1.bit7,
-                "Fault": byte3.bit5,
-                "descaling_counter": descaling_counter,
-            }
-        else:
-            _LOGGER.debug("state_decoder else")
-            res = val
-        return {self.name: res}
+    def decode_many(self, payloads) -> list[Reading]:
+        """Decode a batch of payloads, e.g. a notification backlog."""
+        decode = self.decode_data
+        return [decode(raw_data) for raw_data in payloads]
 
 
 sensor_decoders = {
@@ -133,173 +299,1452 @@ sensor_decoders = {
 }
 
 
+def decode_payloads(payloads) -> list[Reading]:
+    """Decode (uuid, raw bytes) pairs, one batch per characteristic.
+
+    Each decoder is looked up once for all the payloads of its
+    characteristic. Readings are returned in the order of payloads.
+    """
+    batches: dict[str, list[int]] = {}
+    for index, (uuid_str, _) in enumerate(payloads):
+        batches.setdefault(uuid_str, []).append(index)
+    readings = [None] * len(payloads)
+    for uuid_str, indexes in batches.items():
+        decoded = sensor_decoders[uuid_str].decode_many(
+            [payloads[index][1] for index in indexes]
+        )
+        for index, reading in zip(indexes, decoded):
+            readings[index] = reading
+    return readings
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of connecting while a device is known to be unreachable."""
+
+
+class BrewNotReadyError(Exception):
+    """A scheduled brew was not fired, the machine status blocks it."""
+
+
+class CircuitBreaker:
+    """Fail fast after repeated failures until reset_timeout has passed.
+
+    Once the timeout expired a single operation is let through, its outcome
+    closes or re-opens the circuit.
+    """
+
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURES,
+        reset_timeout: float = BREAKER_RESET_TIMEOUT,
+        clock: Callable[[], float] = None,
+    ):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock or time.monotonic
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+
+    def check(self, name: str) -> None:
+        if self._opened_at is None:
+            return
+        remaining = self._opened_at + self._reset_timeout - self._clock()
+        if remaining > 0:
+            raise CircuitOpenError(
+                "{} is unreachable, next attempt in {:.0f}s".format(name, remaining)
+            )
+        # Half open, only this operation goes through until it succeeds. Its
+        # failure re-opens the circuit, the timer restarts if it never ends.
+        self._failures = self._failure_threshold - 1
+        self._opened_at = self._clock()
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._failures >= self._failure_threshold:
+            self._opened_at = self._clock()
+
+
+class RetryPolicy:
+    """Capped exponential backoff with full jitter and an overall deadline.
+
+    sleep, clock and rand can be swapped for a virtual clock.
+    """
+
+    def __init__(
+        self,
+        attempts: int = RETRIES_NUMBER,
+        base_delay: float = RETRY_BASE_DELAY,
+        max_delay: float = SLEEP_TIME,
+        deadline: float = RETRY_DEADLINE,
+        sleep: Callable[[float], Awaitable] = None,
+        clock: Callable[[], float] = None,
+        rand: Callable[[], float] = None,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.sleep = sleep or asyncio.sleep
+        self.clock = clock or time.monotonic
+        self.rand = rand or random.random
+
+    def backoff(self, attempt: int) -> float:
+        return self.rand() * min(self.max_delay, self.base_delay * 2**attempt)
+
+    async def run(
+        self,
+        operation: Callable[[], Awaitable],
+        on_error: Callable[[Exception], None] = None,
+        description: str = "Operation",
+    ):
+        """Await operation until it succeeds, attempts or the deadline run out."""
+        deadline = self.clock() + self.deadline
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(
+                    operation(), max(deadline - self.clock(), 0)
+                )
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    e = asyncio.TimeoutError(
+                        "{} exceeded {}s deadline".format(description, self.deadline)
+                    )
+                if on_error is not None:
+                    on_error(e)
+                attempt += 1
+                remaining = deadline - self.clock()
+                if attempt > self.attempts or remaining <= 0:
+                    raise e
+                delay = min(self.backoff(attempt - 1), remaining)
+                _LOGGER.warning(
+                    "{} error. Attempts left {}, retrying in {:.1f}s\n{}".format(
+                        description, self.attempts - attempt + 1, delay, str(e)
+                    )
+                )
+                await self.sleep(delay)
+
+
+def is_brewing(attributes: dict) -> bool:
+    return bool(attributes.get("water_engadged"))
+
+
+class LatencyHistogram:
+    """Fixed bucket latency histogram, seconds."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    __slots__ = ("counts", "count", "total", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction: float) -> float:
+        """Upper bound of the bucket holding the given fraction of samples."""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index < len(self.BUCKETS):
+                    return min(self.BUCKETS[index], self.max)
+                return self.max
+        return 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "max": self.max,
+        }
+
+
+class Instrumentation:
+    """Per device latency histograms and counters of the BLE hot path.
+
+    Callers check enabled before taking timestamps, so a disabled instance
+    costs one attribute lookup per operation.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.histograms: dict[str, dict[str, LatencyHistogram]] = {}
+        self.counters: dict[str, dict[str, int]] = {}
+
+    def observe(self, address: str, operation: str, seconds: float) -> None:
+        histograms = self.histograms.setdefault(address, {})
+        histogram = histograms.get(operation)
+        if histogram is None:
+            histogram = histograms[operation] = LatencyHistogram()
+        histogram.observe(seconds)
+
+    def count(self, address: str, counter: str, value: int = 1) -> None:
+        counters = self.counters.setdefault(address, {})
+        counters[counter] = counters.get(counter, 0) + value
+
+    def forget(self, address: str) -> None:
+        self.histograms.pop(address, None)
+        self.counters.pop(address, None)
+
+    def device_snapshot(self, address: str) -> dict:
+        return {
+            "latency": {
+                operation: histogram.as_dict()
+                for operation, histogram in self.histograms.get(address, {}).items()
+            },
+            "counters": dict(self.counters.get(address, {})),
+        }
+
+    def snapshot(self) -> dict:
+        addresses = set(self.histograms) | set(self.counters)
+        return {address: self.device_snapshot(address) for address in addresses}
+
+
+class AdaptivePollSchedule:
+    """Pick the next poll interval of a machine from its decoded status.
+
+    Poll fast while brewing or a capsule is engaged, slowly while the machine
+    sleeps, and back off exponentially while it can't be seen or read.
+    """
+
+    def __init__(
+        self,
+        brewing: float = POLL_INTERVAL_BREWING,
+        awake: float = POLL_INTERVAL_AWAKE,
+        sleeping: float = POLL_INTERVAL_SLEEPING,
+        unreachable_max: float = POLL_INTERVAL_UNREACHABLE_MAX,
+    ):
+        self.brewing = brewing
+        self.awake = awake
+        self.sleeping = sleeping
+        self.unreachable_max = unreachable_max
+        self._misses = 0
+
+    @property
+    def is_backing_off(self) -> bool:
+        return self._misses > 0
+
+    def next_interval(self, attributes: Union[dict, None]) -> float:
+        """Return seconds until the next poll, attributes is None on a miss."""
+        if attributes is None:
+            self._misses += 1
+            return min(self.unreachable_max, self.awake * 2 ** self._misses)
+        self._misses = 0
+        if is_brewing(attributes) or attributes.get("capsule_engaged"):
+            return self.brewing
+        if attributes.get("sleeping"):
+            return self.sleeping
+        return self.awake
+
+
+class GattOperationQueue:
+    """Run the GATT operations of one device one at a time.
+
+    Waiting operations run in priority order, first come first served within
+    a priority. An operation submitted with the key of one that is queued or
+    running shares its outcome instead of running again. While held, only
+    operations of the held priority or a more urgent one are started.
+    """
+
+    def __init__(self):
+        self._waiting: list = []
+        self._sequence = itertools.count()
+        self._running = False
+        self._held: Union[int, None] = None
+        self._inflight: dict[object, asyncio.Future] = {}
+        self.operations = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        """Operations running or waiting for their turn."""
+        waiting = sum(1 for _, _, turn in self._waiting if not turn.done())
+        return waiting + self._running
+
+    @property
+    def metrics(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "operations": self.operations,
+            "coalesced": self.coalesced,
+        }
+
+    async def run(
+        self,
+        operation: Callable[[], Awaitable],
+        key=None,
+        priority: int = PRIORITY_DEFAULT,
+    ):
+        if key is not None:
+            shared = self._inflight.get(key)
+            if shared is not None:
+                self.coalesced += 1
+                # A joiner giving up must not cancel the operation of the others
+                return await asyncio.shield(shared)
+            shared = asyncio.get_running_loop().create_future()
+            # Nobody may have joined, don't warn about an unretrieved exception
+            shared.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[key] = shared
+        try:
+            await self._acquire(priority)
+            try:
+                self.operations += 1
+                result = await operation()
+            finally:
+                self._release()
+        except BaseException as e:
+            if key is not None:
+                del self._inflight[key]
+                if not isinstance(e, Exception):
+                    e = BleakError("Shared operation was cancelled")
+                shared.set_exception(e)
+            raise
+        if key is not None:
+            del self._inflight[key]
+            shared.set_result(result)
+        return result
+
+    def hold(self, priority: int) -> None:
+        """Keep less urgent operations waiting until resume().
+
+        A running operation can't be pre-empted, holding keeps the link free
+        for the urgent ones to come.
+        """
+        self._held = priority
+
+    def resume(self) -> None:
+        self._held = None
+        if not self._running:
+            self._running = True
+            self._release()
+
+    async def _acquire(self, priority: int) -> None:
+        if not self._running and not self._waiting and self._admits(priority):
+            self._running = True
+            return
+        turn = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (priority, next(self._sequence), turn))
+        self.max_depth = max(self.max_depth, self.depth)
+        if not self._running:
+            # Only held operations were waiting, this one may go first
+            self._running = True
+            self._release()
+        try:
+            await turn
+        except asyncio.CancelledError:
+            if turn.done() and not turn.cancelled():
+                # Cancelled right after being handed the turn, pass it on
+                self._release()
+            raise
+
+    def _admits(self, priority: int) -> bool:
+        return self._held is None or priority <= self._held
+
+    def _release(self) -> None:
+        while self._waiting:
+            priority, _, turn = self._waiting[0]
+            if turn.done():
+                heapq.heappop(self._waiting)
+                continue
+            if not self._admits(priority):
+                break
+            heapq.heappop(self._waiting)
+            turn.set_result(None)
+            return
+        self._running = False
+
+
 class BLEClientWrapper:
-    def __init__(self, device: BLEDevice, auth_code: str):
+    def __init__(
+        self,
+        device: BLEDevice,
+        auth_code: str,
+        client_factory=BleakClient,
+        retry_policy: RetryPolicy = None,
+        idle_timeout: Union[float, None] = None,
+        on_connect: Callable[["BLEClientWrapper"], Awaitable] = None,
+        instrumentation: Instrumentation = None,
+        recorder: GattRecorder = None,
+        slots: "BLEConnectionScheduler" = None,
+    ):
         self._device = device
-        self._client = BleakClient(self._device)
+        self._slots = slots
+        self._instrumentation = instrumentation or Instrumentation()
+        self._recorder = recorder
+        self._client_factory = client_factory
+        self._client = client_factory(
+            self._device, disconnected_callback=self._on_disconnected
+        )
+        # Device the bleak client was made for, see set_device
+        self._client_device = self._device
         self._auth_code = auth_code
         self._authenticated = False
         self._connected = False
+        self._notify_callbacks: dict[str, Callable] = {}
+        # Characteristics notifying on the current link, with a callback or not
+        self._notifying: set[str] = set()
+        # Characteristics the current link refused to notify, retried on reconnect
+        self._notify_failed: set[str] = set()
+        self._handles: Union[dict[str, BleakGATTCharacteristic], None] = None
+        # Service collection the handles were resolved from
+        self._services = None
+        # Handle per uuid from an earlier connection, checked before reuse
+        self.known_handles: dict[str, int] = {}
+        self._retry = retry_policy or RetryPolicy()
+        self._breaker = CircuitBreaker(clock=self._retry.clock)
+        self._idle_timeout = idle_timeout
+        self._idle_handle: Union[asyncio.TimerHandle, None] = None
+        self._idle_task: Union[asyncio.Task, None] = None
+        self._on_connect = on_connect
+        # Concurrent callers would race each other connecting and authenticating
+        self.queue = GattOperationQueue()
+        self._busy = 0
+        # A pinned session is kept warm, e.g. while a brew is in progress
+        self.pinned = False
+        self._keep_warm = False
+        self._warm_task: Union[asyncio.Task, None] = None
+        self.last_used = 0.0
+        self.connected_since: Union[float, None] = None
+        self.connected_time = 0.0
+
+    @property
+    def address(self) -> str:
+        return self._device.address
+
+    @property
+    def device(self) -> BLEDevice:
+        return self._device
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected and self._client.is_connected
+
+    @property
+    def is_busy(self) -> bool:
+        return self._busy > 0
+
+    @property
+    def is_subscribed(self) -> bool:
+        return bool(self._notify_callbacks)
+
+    @property
+    def is_pinned(self) -> bool:
+        return self.pinned or self._keep_warm
+
+    @property
+    def keep_warm(self) -> bool:
+        return self._keep_warm
+
+    @keep_warm.setter
+    def keep_warm(self, value: bool) -> None:
+        """Hold an authenticated session open, reconnecting when it drops."""
+        self._keep_warm = value
+        if value and not self.is_connected:
+            self._schedule_warm_up()
+        elif not value and self._slots is not None:
+            self._slots.wake(self)
+
+    def _schedule_warm_up(self):
+        if self._warm_task is not None and not self._warm_task.done():
+            return
+        self._warm_task = asyncio.get_running_loop().create_task(self.warm_up())
+
+    async def warm_up(self) -> bool:
+        """Connect and authenticate ahead of the next operation."""
+        try:
+            await self._run("Connect", self._connected_client, key="connect")
+        except Exception as e:
+            _LOGGER.debug("Could not warm up {}: {}".format(self.address, e))
+            return False
+        return True
 
     @property
     async def services(self):
-        client = await self._get_client()
+        client = await self._run("Connect", self._connected_client, key="connect")
         return client.services
 
-    async def _authenticate(self, retries=RETRIES_NUMBER):
-        if not self._authenticated:
-            client = self._client
-            try:
-                await client.write_gatt_char(
-                    CHAR_UUID_AUTH, binascii.unhexlify(self._auth_code), True
+    @property
+    async def characteristics(self) -> dict[str, BleakGATTCharacteristic]:
+        """Return the characteristics of the device keyed by uuid.
+
+        The service walk only happens once per connection, later calls reuse
+        the resolved handles until the link drops or the client's service
+        collection is replaced by a new service discovery.
+        Known handles are looked up directly when they still match.
+        """
+        client = await self._run("Connect", self._connected_client, key="connect")
+        return self._resolve_handles(client)
+
+    def _resolve_handles(self, client) -> dict[str, BleakGATTCharacteristic]:
+        if self._handles is None or client.services is not self._services:
+            instrumentation = self._instrumentation
+            start = time.perf_counter() if instrumentation.enabled else 0.0
+            handles = self._lookup_known_handles(client.services)
+            if handles is None:
+                handles = {}
+                for service in client.services or []:
+                    for characteristic in service.characteristics or []:
+                        handles[characteristic.uuid] = characteristic
+                self.known_handles = {
+                    uuid_str: characteristic.handle
+                    for uuid_str, characteristic in handles.items()
+                }
+            if instrumentation.enabled:
+                instrumentation.observe(
+                    self.address, "service_walk", time.perf_counter() - start
                 )
-            except Exception as e:
-                if retries > 0:
-                    self.validate_connection(e)
-                    _LOGGER.warning(
-                        "Authentication failed. Attempts left {}\n{}".format(
-                            retries, str(e)
-                        )
-                    )
-                    await asyncio.sleep(SLEEP_TIME)
-                    return await self._authenticate(retries - 1)
-                else:
-                    raise e
-            self._authenticated = True
             _LOGGER.debug(
-                "Successfully authenticated to bluetooth client {}".format(
-                    self._authenticated
-                )
+                "Resolved %s characteristics of %s", len(handles), self.address
+            )
+            self._handles = handles
+            self._services = client.services
+        return self._handles
+
+    async def probe(self, uuid_str: str, deadline: float) -> bytearray:
+        """Connect, authenticate and read a characteristic in one attempt.
+
+        Unlike the other operations nothing is retried and deadline bounds
+        the whole sequence. The circuit breaker is left out, a candidate auth
+        code failing must not lock the machine out of polling and a machine
+        failing its polls can still be probed. The session and handle map are
+        kept for later.
+        """
+
+        async def read(client):
+            characteristic = self._resolve_handles(client).get(uuid_str, uuid_str)
+            return await client.read_gatt_char(characteristic)
+
+        data = await self._run(
+            "Probe",
+            read,
+            phase="read",
+            retry_policy=self._single_attempt(deadline),
+            breaker=False,
+        )
+        if self._recorder is not None:
+            self._recorder.record(READ, self.address, uuid_str, data)
+        return data
+
+    def _single_attempt(self, deadline: float = RETRY_DEADLINE) -> RetryPolicy:
+        return RetryPolicy(
+            attempts=0,
+            deadline=deadline,
+            sleep=self._retry.sleep,
+            clock=self._retry.clock,
+        )
+
+    def _lookup_known_handles(
+        self, services
+    ) -> Union[dict[str, BleakGATTCharacteristic], None]:
+        if not self.known_handles or not hasattr(services, "get_characteristic"):
+            return None
+        handles = {}
+        for uuid_str, handle in self.known_handles.items():
+            characteristic = services.get_characteristic(handle)
+            if characteristic is None or characteristic.uuid != uuid_str:
+                _LOGGER.debug("Known handles of {} are stale".format(self.address))
+                return None
+            handles[uuid_str] = characteristic
+        return handles
+
+    def _on_disconnected(self, _client):
+        _LOGGER.debug("Disconnected from {}".format(self._device.address))
+        if self._recorder is not None:
+            self._recorder.record(DISCONNECT, self.address)
+        self._mark_disconnected()
+        self._release_slot()
+        if self._keep_warm:
+            self._schedule_warm_up()
+
+    def _mark_disconnected(self):
+        self._connected = False
+        self._notifying.clear()
+        self._notify_failed.clear()
+        self._handles = None
+        self._services = None
+        if self.connected_since is not None:
+            self.connected_time += self._retry.clock() - self.connected_since
+            self.connected_since = None
+
+    def _release_slot(self):
+        if self._slots is not None:
+            self._slots.release(self)
+
+    async def _authenticate(self):
+        await self._client.write_gatt_char(
+            CHAR_UUID_AUTH, binascii.unhexlify(self._auth_code), True
+        )
+        self._authenticated = True
+        if self._recorder is not None:
+            # Never the auth code itself
+            self._recorder.record(AUTH, self.address, CHAR_UUID_AUTH)
+        _LOGGER.debug(
+            "Successfully authenticated to bluetooth client {}".format(
+                self._authenticated
             )
+        )
+
+    def set_device(self, device: BLEDevice) -> None:
+        """Connect through device, e.g. seen by another proxy, from now on.
+
+        An open link stays on the adapter or proxy it was made through, the
+        next connection goes through device.
+        """
+        self._device = device
+
+    def set_auth_code(self, auth_code: str) -> None:
+        """Authenticate with another code from the next operation on."""
+        if auth_code != self._auth_code:
+            self._auth_code = auth_code
+            self._authenticated = False
 
     def validate_connection(self, e: Exception):
         if str(e) == "Disconnected" or str(e) == "Not connected":
-            self._connected = False
+            self._mark_disconnected()
         if str(e).endswith("Insufficient authentication"):
             self._authenticated = False
 
-    async def _get_client(self, retries=RETRIES_NUMBER):
+    async def _get_client(self, trace: dict = None):
+        instrumentation = self._instrumentation
+        timed = trace is not None or instrumentation.enabled
         if not self._client.is_connected or not self._connected:
+            self._authenticated = False
+            self._handles = None
+            _LOGGER.debug("Connecting to bluetooth device")
+            if (
+                self._client_device is not self._device
+                and not self._client.is_connected
+            ):
+                # Made for an older advertisement, connect through the latest
+                self._client = self._client_factory(
+                    self._device, disconnected_callback=self._on_disconnected
+                )
+                self._client_device = self._device
+            start = time.perf_counter() if timed else 0.0
+            if self._slots is not None:
+                await self._slots.acquire(self)
             try:
-                self._authenticated = False
-                _LOGGER.debug("Connecting to bluetooth device")
                 await self._client.connect()
-                if not self._client.is_connected:
-                    raise Exception("Bluetooth connection failed")
-                self._connected = True
-                _LOGGER.debug(
-                    "Successfully connected to bluetooth client {}".format(
-                        self._client.is_connected
-                    )
+            except BaseException:
+                self._release_slot()
+                raise
+            if timed:
+                elapsed = time.perf_counter() - start
+                if trace is not None:
+                    trace["connect"] += elapsed
+                if instrumentation.enabled:
+                    instrumentation.observe(self.address, "connect", elapsed)
+                    instrumentation.count(self.address, "connects")
+            if not self._client.is_connected:
+                self._release_slot()
+                raise Exception("Bluetooth connection failed")
+            self._connected = True
+            self.connected_since = self._retry.clock()
+            _LOGGER.debug(
+                "Successfully connected to bluetooth client {}".format(
+                    self._client.is_connected
                 )
-            except Exception as e:
-                if retries > 0:
-                    self.validate_connection(e)
-                    _LOGGER.warning(
-                        "Connection reset, attempting reconnect. Attempts left {}\n{}".format(
-                            retries, str(e)
-                        )
-                    )
-                    await asyncio.sleep(SLEEP_TIME)
-                    return await self._get_client(retries - 1)
-                else:
-                    raise e
+            )
+            if self._recorder is not None:
+                self._recorder.record(
+                    CONNECT, self.address, payload=str(self._device.name).encode()
+                )
+            if self._on_connect is not None:
+                await self._on_connect(self)
         if not self._authenticated:
+            start = time.perf_counter() if timed else 0.0
             await self._authenticate()
+            if timed:
+                elapsed = time.perf_counter() - start
+                if trace is not None:
+                    trace["auth"] += elapsed
+                if instrumentation.enabled:
+                    instrumentation.observe(self.address, "auth", elapsed)
+            await self._resubscribe()
 
         return self._client
 
-    async def read_gatt_char(
+    @staticmethod
+    async def _connected_client(client):
+        return client
+
+    async def _run(
         self,
-        char_specifier: Union[BleakGATTCharacteristic, int, str, uuid.UUID],
-        retries=RETRIES_NUMBER,
-        **kwargs,
-    ) -> bytearray:
-        client = await self._get_client()
+        description: str,
+        action: Callable[..., Awaitable],
+        trace: dict = None,
+        phase: Union[str, None] = None,
+        key=None,
+        priority: int = PRIORITY_DEFAULT,
+        retry_policy: RetryPolicy = None,
+        breaker: bool = True,
+    ):
+        """Run action(client) under the retry policy and circuit breaker.
+
+        Every attempt waits for its turn in the operation queue, then connects
+        and authenticates if needed, so retries never nest and concurrent
+        callers never race on the link. Attempts with the same key as a queued
+        or running one share its outcome. When a trace dict is given the time
+        spent queued, connecting, authenticating and in the action (under
+        phase, if any) is added to it. With breaker False the circuit breaker
+        neither blocks the operation nor counts its outcome.
+        """
+        if breaker:
+            self._breaker.check(self._device.address)
+        if trace is not None:
+            for name in ("queue", "connect", "auth", phase):
+                if name is not None:
+                    trace.setdefault(name, 0.0)
+        instrumentation = self._instrumentation
+        timed = trace is not None or instrumentation.enabled
+
+        async def attempt():
+            queued = time.perf_counter() if timed else 0.0
+            return await self.queue.run(lambda: operation(queued), key, priority)
+
+        async def operation(queued: float):
+            if timed:
+                waited = time.perf_counter() - queued
+                if trace is not None:
+                    trace["queue"] += waited
+                if instrumentation.enabled:
+                    instrumentation.observe(self.address, "queue_wait", waited)
+            client = await self._get_client(trace)
+            if phase is None or (trace is None and not instrumentation.enabled):
+                return await action(client)
+            start = time.perf_counter()
+            try:
+                return await action(client)
+            finally:
+                elapsed = time.perf_counter() - start
+                if trace is not None:
+                    trace[phase] += elapsed
+                if instrumentation.enabled:
+                    instrumentation.observe(self.address, phase, elapsed)
+
+        def on_error(e: Exception):
+            if instrumentation.enabled:
+                instrumentation.count(self.address, "errors")
+            if self._recorder is not None:
+                message = "{}: {}".format(description, e)
+                self._recorder.record(ERROR, self.address, payload=message.encode())
+            self.validate_connection(e)
+
+        self._busy += 1
         try:
-            return await client.read_gatt_char(char_specifier, **kwargs)
-        except Exception as e:
-            if retries > 0:
-                self.validate_connection(e)
+            retry = retry_policy or self._retry
+            result = await retry.run(attempt, on_error, description)
+        except Exception:
+            if breaker:
+                self._breaker.record_failure()
+            raise
+        finally:
+            self._busy -= 1
+            self.last_used = self._retry.clock()
+            self._arm_idle_timer()
+            if not self._busy and self._slots is not None:
+                self._slots.wake(self)
+        if breaker:
+            self._breaker.record_success()
+        return result
+
+    def _arm_idle_timer(self):
+        if self._idle_timeout is None:
+            return
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        self._idle_handle = asyncio.get_running_loop().call_later(
+            self._idle_timeout, self._on_idle
+        )
+
+    def _on_idle(self):
+        self._idle_handle = None
+        # Notifications need the link, it is only dropped for a slot on its source
+        if (
+            self.is_busy
+            or self.is_pinned
+            or self.is_subscribed
+            or not self.is_connected
+        ):
+            return
+        _LOGGER.debug("Closing idle connection to {}".format(self.address))
+        self._idle_task = asyncio.get_running_loop().create_task(
+            self.disconnect(keep_subscriptions=True)
+        )
+
+    async def _resubscribe(self):
+        # Subscriptions do not survive a reconnect, restore them once authenticated
+        for uuid_str in list(self._notify_callbacks):
+            if uuid_str in self._notifying:
+                continue
+            try:
+                await self._subscribe(self._client, uuid_str)
+            except Exception as e:
+                if not self._client.is_connected:
+                    raise
+                # Polling covers it, the operation that reconnected goes on
+                self._notify_callbacks.pop(uuid_str, None)
                 _LOGGER.warning(
-                    "Read gatt char error. Attempts left {}\n{}".format(retries, str(e))
+                    "Failed to restore notifications of {} on {}: {}".format(
+                        uuid_str, self.address, e
+                    )
                 )
-                await asyncio.sleep(SLEEP_TIME)
-                return await self.read_gatt_char(char_specifier, retries - 1, **kwargs)
-            else:
-                raise e
+                continue
+            _LOGGER.debug("Subscribed to notifications of {}".format(uuid_str))
 
-    async def read_gatt_descriptor(
-        self, handle: int, retries=RETRIES_NUMBER, **kwargs
-    ) -> bytearray:
-        client = await self._get_client()
+    async def _subscribe(self, client, char_specifier: str) -> None:
         try:
-            return await client.read_gatt_descriptor(handle, **kwargs)
-        except Exception as e:
-            if retries > 0:
-                self.validate_connection(e)
-                _LOGGER.warning(
-                    "Read gatt descriptor error. Attempts left {}\n{}".format(
-                        retries, str(e)
+            await client.start_notify(char_specifier, self._dispatcher(char_specifier))
+        except Exception:
+            if client.is_connected:
+                self._notify_failed.add(char_specifier)
+            raise
+        self._notifying.add(char_specifier)
+
+    async def start_notify(self, char_specifier: str, callback: Callable) -> None:
+        """Hand the notifications of a characteristic to callback.
+
+        A characteristic already notifying only gets its callback replaced,
+        the link is not subscribed again. Subscribing is tried once, outside
+        the circuit breaker. A characteristic the link refused is skipped
+        until the next connection.
+        """
+        if char_specifier in self._notify_failed:
+            return
+        if char_specifier not in self._notifying:
+
+            async def subscribe(client):
+                if char_specifier in self._notifying:
+                    # Restored by the reconnect of this very operation
+                    return
+                if char_specifier in self._notify_failed:
+                    raise BleakError(
+                        "Notifications of {} refused".format(char_specifier)
                     )
-                )
-                await asyncio.sleep(SLEEP_TIME)
-                return await self.read_gatt_descriptor(handle, retries - 1, **kwargs)
-            else:
-                raise e
+                await self._subscribe(client, char_specifier)
+
+            await self._run(
+                "Start notify",
+                subscribe,
+                phase="notify",
+                retry_policy=self._single_attempt(),
+                breaker=False,
+            )
+        self._notify_callbacks[char_specifier] = callback
+
+    def forget_notify(self, char_specifier: str) -> None:
+        """Stop handing notifications to the callback, the link stays subscribed."""
+        self._notify_callbacks.pop(char_specifier, None)
+
+    def set_recorder(self, recorder: Union[GattRecorder, None]) -> None:
+        self._recorder = recorder
+
+    def _dispatcher(self, char_specifier: str) -> Callable:
+        def dispatch(sender, data: bytearray):
+            # Recording can be switched on or off while subscribed
+            recorder = self._recorder
+            if recorder is not None:
+                recorder.record(NOTIFY, self.address, char_specifier, data)
+            # Looked up on arrival, the subscription may have changed hands
+            callback = self._notify_callbacks.get(char_specifier)
+            if callback is not None:
+                return callback(sender, data)
+
+        return dispatch
+
+    async def disconnect(self, keep_subscriptions: bool = False) -> None:
+        """Close the link, subscriptions are kept to be restored on reconnect."""
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if not keep_subscriptions:
+            self._notify_callbacks.clear()
+        self._authenticated = False
+        self._mark_disconnected()
+        try:
+            if self._client.is_connected:
+                await self._client.disconnect()
+        finally:
+            self._release_slot()
+
+    async def stop_notify(self, char_specifier: str) -> None:
+        self._notify_callbacks.pop(char_specifier, None)
+        if char_specifier not in self._notifying:
+            return
+        self._notifying.discard(char_specifier)
+        if self._client.is_connected:
+            await self._client.stop_notify(char_specifier)
+
+    async def read_gatt_char(
+        self,
+        char_specifier: Union[BleakGATTCharacteristic, int, str, uuid.UUID],
+        priority: int = PRIORITY_BACKGROUND,
+        **kwargs,
+    ) -> bytearray:
+        # A brew read would lose its priority joining a queued background read
+        if priority == PRIORITY_BREW:
+            key = None
+        else:
+            key = ("read", str(getattr(char_specifier, "uuid", char_specifier)))
+        data = await self._run(
+            "Read gatt char",
+            lambda client: client.read_gatt_char(char_specifier, **kwargs),
+            phase="read",
+            key=key,
+            priority=priority,
+        )
+        if self._instrumentation.enabled:
+            self._instrumentation.count(self.address, "bytes_read", len(data))
+        if self._recorder is not None:
+            self._recorder.record(READ, self.address, char_specifier, data)
+        return data
+
+    async def read_gatt_descriptor(self, handle: int, **kwargs) -> bytearray:
+        return await self._run(
+            "Read gatt descriptor",
+            lambda client: client.read_gatt_descriptor(handle, **kwargs),
+            phase="read_descriptor",
+            key=("read_descriptor", handle),
+            priority=PRIORITY_BACKGROUND,
+        )
 
     async def write_gatt_char(
         self,
         char_specifier: Union[BleakGATTCharacteristic, int, str, uuid.UUID],
         data: Union[bytes, bytearray, memoryview],
         response: bool = False,
-        retries=RETRIES_NUMBER,
+        trace: dict = None,
+        priority: int = PRIORITY_DEFAULT,
     ) -> None:
-        client = await self._get_client()
-        try:
-            return await client.write_gatt_char(char_specifier, data, response)
-        except Exception as e:
-            if retries > 0:
-                self.validate_connection(e)
-                _LOGGER.warning(
-                    "Write gatt char error. Attempts left {}\n{}\n{}".format(
-                        retries, str(e), self._client.is_connected
-                    )
-                )
-                await asyncio.sleep(SLEEP_TIME)
-                return await self.write_gatt_char(
-                    char_specifier, data, response, retries - 1
-                )
-            else:
-                raise e
+        result = await self._run(
+            "Write gatt char",
+            lambda client: client.write_gatt_char(char_specifier, data, response),
+            trace,
+            "write",
+            priority=priority,
+        )
+        if self._instrumentation.enabled:
+            self._instrumentation.count(self.address, "bytes_written", len(data))
+        if self._recorder is not None:
+            self._recorder.record(WRITE, self.address, char_specifier, data)
+        return result
 
 
 class BLEClientPool:
-    def __init__(self, auth_code: str):
+    """Wrappers per address, connected on demand and closed when idle.
+
+    At most max_connections links are open per adapter or proxy, see
+    BLEConnectionScheduler. auth_codes overrides auth_code per address.
+    """
+
+    def __init__(
+        self,
+        auth_code: str,
+        client_factory=BleakClient,
+        retry_policy: RetryPolicy = None,
+        idle_timeout: Union[float, None] = IDLE_DISCONNECT_TIMEOUT,
+        max_connections: int = MAX_CONNECTIONS_PER_ADAPTER,
+        instrumentation: Instrumentation = None,
+        recorder: GattRecorder = None,
+        auth_codes: dict[str, str] = None,
+    ):
         self._auth_code = auth_code
-        self._clients = {}
+        self.auth_codes: dict[str, str] = dict(auth_codes or {})
+        self._instrumentation = instrumentation or Instrumentation()
+        self._recorder = recorder
+        self._client_factory = client_factory
+        self._retry_policy = retry_policy
+        self._clock = retry_policy.clock if retry_policy else time.monotonic
+        self._idle_timeout = idle_timeout
+        self._slots = BLEConnectionScheduler(max_connections)
+        self._clients: dict[str, BLEClientWrapper] = {}
+        self._connects: collections.deque[float] = collections.deque()
+        self._released_time = 0.0
 
     def get_client(self, device: BLEDevice) -> BLEClientWrapper:
         client = self._clients.get(device.address)
         if client is None:
-            client = BLEClientWrapper(device, self._auth_code)
+            client = BLEClientWrapper(
+                device,
+                self.auth_codes.get(device.address, self._auth_code),
+                self._client_factory,
+                self._retry_policy,
+                self._idle_timeout,
+                self._handle_connect,
+                self._instrumentation,
+                self._recorder,
+                self._slots,
+            )
             self._clients[device.address] = client
+        elif client.device is not device:
+            # Slots are counted on the source of the latest advertisement
+            client.set_device(device)
         return client
 
+    def lookup(self, address: str) -> Union[BLEClientWrapper, None]:
+        """Return the wrapper of address without creating one."""
+        return self._clients.get(address)
+
+    def queue_metrics(self, address: str) -> Union[dict, None]:
+        client = self._clients.get(address)
+        return client.queue.metrics if client is not None else None
+
+    def set_auth_code(self, address: str, auth_code: Union[str, None]) -> None:
+        """Use auth_code for address, None falls back to the default one."""
+        if auth_code is None:
+            self.auth_codes.pop(address, None)
+        else:
+            self.auth_codes[address] = auth_code
+        client = self._clients.get(address)
+        if client is not None:
+            client.set_auth_code(self.auth_codes.get(address, self._auth_code))
+
+    def set_recorder(self, recorder: Union[GattRecorder, None]) -> None:
+        self._recorder = recorder
+        for client in self._clients.values():
+            client.set_recorder(recorder)
+
+    async def release(self, address: str) -> None:
+        client = self._clients.pop(address, None)
+        if client is not None:
+            client.keep_warm = False
+            await client.disconnect()
+            self._released_time += client.connected_time
+
+    async def _handle_connect(self, client: BLEClientWrapper) -> None:
+        now = self._clock()
+        self._connects.append(now)
+        # Also trimmed here, metrics may never be read
+        self._trim_connects(now)
+
+    def _trim_connects(self, now: float) -> None:
+        while self._connects and self._connects[0] < now - 3600:
+            self._connects.popleft()
+
+    @property
+    def metrics(self) -> dict:
+        now = self._clock()
+        self._trim_connects(now)
+        connected_time = self._released_time
+        for client in self._clients.values():
+            connected_time += client.connected_time
+            if client.connected_since is not None:
+                connected_time += now - client.connected_since
+        return {
+            "live_connections": sum(
+                1 for client in self._clients.values() if client.is_connected
+            ),
+            "connects_last_hour": len(self._connects),
+            "connected_seconds": round(connected_time, 1),
+            "slots": self._slots.held,
+        }
+
+
+class BLEConnectionScheduler:
+    """Connection slots per adapter or proxy, shared by every wrapper.
+
+    A link holds its slot from its connect until it is closed, idle and
+    subscribed ones included. On a full source the least recently used link
+    that is neither busy nor pinned is closed, otherwise the connect waits
+    up to timeout for one to become idle.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS_PER_ADAPTER,
+        timeout: float = SLOT_TIMEOUT,
+    ):
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._holders: dict[str, set[BLEClientWrapper]] = {}
+        # Source each holder took its slot on, its device may have moved since
+        self._held_on: dict[BLEClientWrapper, str] = {}
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+
+    @staticmethod
+    def source_of(device: BLEDevice) -> str:
+        # Home Assistant puts the adapter or proxy a device was seen by in details
+        details = device.details
+        if isinstance(details, dict) and details.get("source"):
+            return str(details["source"])
+        return "default"
+
+    @property
+    def held(self) -> dict[str, int]:
+        return {
+            source: len(holders) for source, holders in self._holders.items() if holders
+        }
+
+    async def acquire(self, client: BLEClientWrapper) -> None:
+        source = self.source_of(client.device)
+        holders = self._holders.setdefault(source, set())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._timeout
+        while client not in holders:
+            if len(holders) < self._max_connections:
+                holders.add(client)
+                self._held_on[client] = source
+                return
+            evictable = [
+                other for other in holders if not other.is_busy and not other.is_pinned
+            ]
+            if evictable:
+                other = min(evictable, key=lambda other: other.last_used)
+                _LOGGER.debug(
+                    "Closing least recently used connection to {} on {}".format(
+                        other.address, source
+                    )
+                )
+                await other.disconnect(keep_subscriptions=True)
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise BleakError("No connection slot available on {}".format(source))
+            waiter = loop.create_future()
+            waiters = self._waiters.setdefault(source, [])
+            waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                if waiter in waiters:
+                    waiters.remove(waiter)
+
+    def release(self, client: BLEClientWrapper) -> None:
+        source = self._held_on.pop(client, None)
+        if source is not None:
+            self._holders[source].discard(client)
+            self._wake(source)
+
+    def wake(self, client: BLEClientWrapper) -> None:
+        """Let connects waiting on the source of client look again."""
+        source = self._held_on.get(client)
+        self._wake(self.source_of(client.device) if source is None else source)
+
+    def _wake(self, source: str) -> None:
+        for waiter in self._waiters.pop(source, []):
+            if not waiter.done():
+                waiter.set_result(None)
+
 
 class NespressoDeviceBundle:
     def __init__(self, device: BLEDevice, attributes: dict):
         self.device = device
         self.attributes = attributes
         self.selected_volume: NespressoVolume = None
+        self.last_seen = 0.0
+        # Last payload per characteristic uuid, bumped version on every change
+        self.raw: dict[str, bytes] = {}
+        self.version = 0
+        # When each characteristic was last received, see REFRESH_INTERVALS
+        self.read_at: dict[str, float] = {}
+        self.history = ConsumptionHistory()
+
+    def is_due(self, uuid_str: str, now: float) -> bool:
+        read_at = self.read_at.get(uuid_str)
+        return read_at is None or now - read_at >= REFRESH_INTERVALS.get(uuid_str, 0)
+
+    def update_raw(self, uuid_str: str, data: Union[bytes, bytearray]) -> bool:
+        """Decode a payload into the attributes, see update_many."""
+        return self.update_many(((uuid_str, data),))
+
+    def update_many(self, payloads) -> bool:
+        """Decode (uuid, payload) pairs into the attributes in one pass.
+
+        Payloads are applied in order. One identical to the last payload of
+        its characteristic is not decoded again, one of a characteristic
+        without a decoder is ignored. Returns True when at least one
+        attribute changed.
+        """
+        raw = self.raw
+        fresh = []
+        for uuid_str, data in payloads:
+            data = bytes(data)
+            if uuid_str in sensor_decoders and raw.get(uuid_str) != data:
+                raw[uuid_str] = data
+                fresh.append((uuid_str, data))
+        if not fresh:
+            return False
+        attributes = self.attributes
+        updated = None
+        for reading in decode_payloads(fresh):
+            changed = {
+                name: value
+                for name, value in reading.items()
+                if name not in attributes or attributes[name] != value
+            }
+            if not changed:
+                continue
+            _LOGGER.debug("%s Got sensordata %s", self.device.address, changed)
+            for attribute, old, new, trigger in REFRESH_TRIGGERS:
+                if changed.get(attribute) == new and attributes.get(attribute) == old:
+                    self.read_at.pop(trigger, None)
+            if updated is None:
+                # Copied once per batch, listeners may hold the previous dict
+                attributes = updated = dict(attributes)
+            updated.update(changed)
+            self.history.record(updated)
+        if updated is None:
+            return False
+        self.attributes = updated
+        self.version += 1
+        return True
+
+
+class NespressoDeviceRegistry:
+    """Bundles keyed by address, forgetting machines not seen within ttl."""
+
+    def __init__(self, ttl: float = DEVICE_TTL, clock: Callable[[], float] = None):
+        self._ttl = ttl
+        self.clock = clock or time.monotonic
+        self._bundles: dict[str, NespressoDeviceBundle] = {}
+
+    def __len__(self) -> int:
+        return len(self._bundles)
+
+    def __iter__(self):
+        return iter(self._bundles.values())
+
+    def __contains__(self, address: str) -> bool:
+        return address in self._bundles
+
+    def get(self, address: str) -> Union[NespressoDeviceBundle, None]:
+        return self._bundles.get(address)
+
+    def update(self, device: BLEDevice) -> bool:
+        """Insert a device or swap in its latest handle.
+
+        Returns True when the device was not known before.
+        """
+        bundle = self._bundles.get(device.address)
+        created = bundle is None
+        if created:
+            bundle = NespressoDeviceBundle(device, {})
+            self._bundles[device.address] = bundle
+        else:
+            bundle.device = device
+        bundle.last_seen = self.clock()
+        return created
+
+    def restore(
+        self, device: BLEDevice, attributes: dict, raw: dict[str, bytes]
+    ) -> NespressoDeviceBundle:
+        """Insert a device with its last known state, counts as seen now."""
+        bundle = NespressoDeviceBundle(device, attributes)
+        bundle.raw = raw
+        bundle.version = 1
+        bundle.last_seen = self.clock()
+        self._bundles[device.address] = bundle
+        return bundle
+
+    def remove(self, address: str) -> Union[NespressoDeviceBundle, None]:
+        return self._bundles.pop(address, None)
+
+    def touch(self, address: str) -> None:
+        bundle = self._bundles.get(address)
+        if bundle is not None:
+            bundle.last_seen = self.clock()
+
+    def evict_stale(self) -> list[NespressoDeviceBundle]:
+        deadline = self.clock() - self._ttl
+        stale = [b for b in self._bundles.values() if b.last_seen < deadline]
+        for bundle in stale:
+            del self._bundles[bundle.device.address]
+        return stale
 
 
 class NespressoClient:
-    def __init__(self, scanner: BleakScanner, auth_code: str) -> None:
+    def __init__(
+        self,
+        scanner: BleakScanner,
+        auth_code: str,
+        client_factory=BleakClient,
+        device_ttl: float = DEVICE_TTL,
+        retry_policy: RetryPolicy = None,
+        idle_timeout: Union[float, None] = IDLE_DISCONNECT_TIMEOUT,
+        max_connections: int = MAX_CONNECTIONS_PER_ADAPTER,
+        instrumentation: Instrumentation = None,
+        recorder: GattRecorder = None,
+        auth_codes: dict[str, str] = None,
+    ) -> None:
         """Sample API Client."""
         self._scanner = scanner
-        self.bundles: list[NespressoDeviceBundle] = []
-        self._client_pool = BLEClientPool(auth_code)
+        self.registry = NespressoDeviceRegistry(device_ttl)
+        self.last_brew_trace: dict[str, dict] = {}
+        self.instrumentation = instrumentation or Instrumentation()
+        self._client_pool = BLEClientPool(
+            auth_code,
+            client_factory,
+            retry_policy,
+            idle_timeout,
+            max_connections,
+            self.instrumentation,
+            recorder,
+            auth_codes,
+        )
+
+    @property
+    def bundles(self) -> list[NespressoDeviceBundle]:
+        return list(self.registry)
+
+    @property
+    def connection_metrics(self) -> dict:
+        return self._client_pool.metrics
+
+    def queue_metrics(self, address: str) -> Union[dict, None]:
+        return self._client_pool.queue_metrics(address)
+
+    def is_subscribed(self, device: BLEDevice) -> bool:
+        """Return True while notifications of device can be received."""
+        client = self._client_pool.get_client(device)
+        return client.is_subscribed and client.is_connected
+
+    def get_bundle(self, address: str) -> Union[NespressoDeviceBundle, None]:
+        return self.registry.get(address)
+
+    @staticmethod
+    def is_nespresso_device(device: BLEDevice) -> bool:
+        return str(device.name).startswith("Prodigio")
+
+    def track_device(self, device: BLEDevice) -> bool:
+        """Add or refresh a device from an advertisement.
+
+        Returns True when the device was not known before.
+        """
+        created = self.registry.update(device)
+        if created:
+            _LOGGER.debug(
+                "Found nespresso_prodigio device {}".format(device.address)
+            )
+        return created
+
+    def set_auth_code(self, address: str, auth_code: Union[str, None]) -> None:
+        """Authenticate to address with its own code, e.g. from its entry."""
+        self._client_pool.set_auth_code(address, auth_code)
+
+    def set_recorder(self, recorder: Union[GattRecorder, None]) -> None:
+        """Start or stop recording the GATT traffic of every machine."""
+        self._client_pool.set_recorder(recorder)
+
+    def snapshot(self, addresses=None) -> dict:
+        """Return the last known state of the machines, JSON serialisable.
+
+        Every machine is included unless addresses is given.
+        """
+        # Bundles keep a monotonic last_seen, store it as wall clock time
+        offset = time.time() - self.registry.clock()
+        return {
+            bundle.device.address: {
+                "name": bundle.device.name,
+                "source": BLEConnectionScheduler.source_of(bundle.device),
+                "attributes": bundle.attributes,
+                "raw": {
+                    uuid_str: data.hex() for uuid_str, data in bundle.raw.items()
+                },
+                "handles": self._client_pool.get_client(bundle.device).known_handles,
+                "last_seen": bundle.last_seen + offset,
+                "history": bundle.history.as_dict(),
+            }
+            for bundle in self.registry
+            if addresses is None or bundle.device.address in addresses
+        }
+
+    def restore(
+        self,
+        snapshot: dict,
+        device_lookup: Callable[[str], Union[BLEDevice, None]] = None,
+    ) -> list[NespressoDeviceBundle]:
+        """Recreate the bundles of a snapshot before any machine is read.
+
+        device_lookup may return the current BLEDevice of an address, machines
+        it doesn't know get a placeholder until they are advertised.
+        """
+        restored = []
+        for address, state in snapshot.items():
+            if address in self.registry:
+                continue
+            device = device_lookup(address) if device_lookup else None
+            if device is None:
+                device = ble_device(address, state.get("name"), state.get("source"))
+            bundle = self.registry.restore(
+                device,
+                state.get("attributes", {}),
+                {
+                    uuid_str: bytes.fromhex(data)
+                    for uuid_str, data in state.get("raw", {}).items()
+                },
+            )
+            self._client_pool.get_client(device).known_handles = dict(
+                state.get("handles", {})
+            )
+            if "history" in state:
+                bundle.history = ConsumptionHistory.from_dict(state["history"])
+            restored.append(bundle)
+        _LOGGER.debug("Restored {} Nespresso devices".format(len(restored)))
+        return restored
+
+    async def probe(
+        self, device: BLEDevice, timeout: float = PROBE_TIMEOUT
+    ) -> NespressoDeviceBundle:
+        """Check that device can be connected and authenticated with.
+
+        Reads the status under a strict deadline. The device is tracked and
+        its authenticated session kept, so the next poll only has to read.
+        """
+        self.track_device(device)
+        bundle = self.registry.get(device.address)
+        client = self._client_pool.get_client(device)
+        data = await client.probe(CHAR_UUID_STATUS, timeout)
+        self._update_bundle(bundle, CHAR_UUID_STATUS, data)
+        return bundle
+
+    async def disconnect(self, device: BLEDevice) -> None:
+        await self._client_pool.release(device.address)
+
+    async def forget(self, address: str) -> Union[NespressoDeviceBundle, None]:
+        """Stop tracking a machine and release its connection."""
+        _LOGGER.debug("Forgetting {}".format(address))
+        bundle = self.registry.remove(address)
+        await self._release(address)
+        return bundle
+
+    async def _release(self, address: str) -> None:
+        await self._client_pool.release(address)
+        self.last_brew_trace.pop(address, None)
+        self.instrumentation.forget(address)
+
+    async def evict_stale_devices(self) -> list[NespressoDeviceBundle]:
+        """Forget machines that went quiet and release their connections."""
+        stale = self.registry.evict_stale()
+        for bundle in stale:
+            _LOGGER.debug("Forgetting {}".format(bundle.device.address))
+            await self._release(bundle.device.address)
+        return stale
 
     async def discover_nespresso_devices(self):
         # Scan for devices and try to figure out if it is a Nespresso device.
@@ -308,83 +1753,273 @@ class NespressoClient:
 
         if discovered_devices is not None:
             for device in discovered_devices:
-                if str(device.name).startswith("Prodigio"):
-                    _LOGGER.debug(
-                        "Found nespresso_prodigio device {}".format(device.address)
+                if self.is_nespresso_device(device):
+                    self.track_device(device)
+            _LOGGER.debug("Found {} Nespresso devices".format(len(self.registry)))
+
+    async def get_device_data(
+        self, callback: Callable[[NespressoDeviceBundle], None] = None
+    ):
+        """Poll every bundle concurrently.
+
+        Failures are isolated per device, callback is invoked as soon as a
+        bundle has been read with changes so a slow machine does not hold back
+        the others.
+        An error is only raised when no bundle could be read at all.
+        """
+        results = await asyncio.gather(
+            *[self.poll_bundle(bundle, callback) for bundle in self.bundles],
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+
+    async def poll_bundle(
+        self,
+        bundle: NespressoDeviceBundle,
+        callback: Callable[[NespressoDeviceBundle], None] = None,
+    ):
+        device = bundle.device
+        instrumentation = self.instrumentation
+        start = time.perf_counter() if instrumentation.enabled else 0.0
+        try:
+            changed = await self._read_bundle(bundle)
+        except Exception as e:
+            _LOGGER.warning("Failed to poll {}: {}".format(device.address, e))
+            raise
+        finally:
+            if instrumentation.enabled:
+                instrumentation.observe(
+                    device.address, "poll", time.perf_counter() - start
+                )
+        # A connected machine stops advertising, a good read proves it is there
+        self.registry.touch(device.address)
+        if changed and callback is not None:
+            callback(bundle)
+
+    async def _read_bundle(self, bundle: NespressoDeviceBundle) -> bool:
+        client = self._client_pool.get_client(bundle.device)
+        characteristics = await client.characteristics
+        now = self.registry.clock()
+        due = []
+        skipped = []
+        for uuid_str in sensor_decoders:
+            if uuid_str in characteristics:
+                (due if bundle.is_due(uuid_str, now) else skipped).append(uuid_str)
+        changed = self._update_bundle_many(
+            bundle, await self._read_characteristics(client, characteristics, due)
+        )
+        # A transition just decoded may make another one due, see REFRESH_TRIGGERS
+        now = self.registry.clock()
+        triggered = [uuid_str for uuid_str in skipped if bundle.is_due(uuid_str, now)]
+        if triggered:
+            changed |= self._update_bundle_many(
+                bundle,
+                await self._read_characteristics(client, characteristics, triggered),
+            )
+        if self.instrumentation.enabled and len(skipped) > len(triggered):
+            self.instrumentation.count(
+                bundle.device.address, "reads_skipped", len(skipped) - len(triggered)
+            )
+        client.pinned = is_brewing(bundle.attributes)
+        return changed
+
+    @staticmethod
+    async def _read_characteristics(
+        client: BLEClientWrapper, characteristics: dict, uuids: list[str]
+    ) -> list[tuple[str, bytearray]]:
+        payloads = []
+        for uuid_str in uuids:
+            characteristic_data = await client.read_gatt_char(characteristics[uuid_str])
+            _LOGGER.debug("%s data %s", uuid_str, characteristic_data)
+            payloads.append((uuid_str, characteristic_data))
+        return payloads
+
+    def _update_bundle(
+        self, bundle: NespressoDeviceBundle, uuid_str: str, data: bytearray
+    ) -> bool:
+        return self._update_bundle_many(bundle, ((uuid_str, data),))
+
+    def _update_bundle_many(self, bundle: NespressoDeviceBundle, payloads) -> bool:
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            changed = bundle.update_many(payloads)
+        else:
+            start = time.perf_counter()
+            changed = bundle.update_many(payloads)
+            instrumentation.observe(
+                bundle.device.address, "decode", time.perf_counter() - start
+            )
+        # After decoding, a trigger must not undo the read of this batch
+        now = self.registry.clock()
+        for uuid_str, _ in payloads:
+            bundle.read_at[uuid_str] = now
+        return changed
+
+    async def start_notifications(
+        self, callback: Callable[[NespressoDeviceBundle], None]
+    ):
+        """Subscribe to the status characteristics of every bundle.
+
+        Each payload is decoded with the matching sensor decoder and merged into
+        the bundle attributes, callback is invoked with the bundle when an
+        attribute changed.
+        """
+        await asyncio.gather(
+            *[self.subscribe_bundle(bundle, callback) for bundle in self.bundles]
+        )
+
+    async def subscribe_bundle(
+        self,
+        bundle: NespressoDeviceBundle,
+        callback: Callable[[NespressoDeviceBundle], None],
+    ):
+        client = self._client_pool.get_client(bundle.device)
+        for uuid_str in NOTIFY_CHARACTERISTICS:
+            try:
+                await client.start_notify(
+                    uuid_str, self._notification_handler(bundle, uuid_str, callback)
+                )
+            except Exception as e:
+                # Polling keeps covering it until the next attempt
+                _LOGGER.warning(
+                    "Failed to subscribe to {} of {}: {}".format(
+                        uuid_str, bundle.device.address, e
                     )
-                    self.bundles.append(NespressoDeviceBundle(device, {}))
-            _LOGGER.debug("Found {} Nespresso devices".format(len(self.bundles)))
+                )
+
+    def unsubscribe_bundle(self, address: str) -> None:
+        """Drop the notification callbacks of a machine.
 
-    async def get_device_data(self):
+        The link stays subscribed until it closes, the next subscribe_bundle
+        only hands its notifications to the new callback.
+        """
+        client = self._client_pool.lookup(address)
+        if client is not None:
+            for uuid_str in NOTIFY_CHARACTERISTICS:
+                client.forget_notify(uuid_str)
+
+    async def stop_notifications(self):
         for bundle in self.bundles:
-            device = bundle.device
-            client = self._client_pool.get_client(device)
-            services = await client.services
-            if services is not None:
-                for service in services:
-                    characteristics = service.characteristics
-                    if characteristics is None:
-                        continue
-                    for characteristic in service.characteristics:
-                        _LOGGER.debug("characteristic {}".format(characteristic))
-                        if characteristic.uuid in sensor_decoders:
-                            characteristic_data = await client.read_gatt_char(
-                                characteristic.uuid
-                            )
-                            _LOGGER.debug(
-                                "{} data {}".format(
-                                    characteristic.uuid, characteristic_data
-                                )
-                            )
-                            decoded_data = sensor_decoders[
-                                characteristic.uuid
-                            ].decode_data(characteristic_data)
-                            _LOGGER.debug(
-                                "{} Got sensordata {}".format(
-                                    device.address, decoded_data
-                                )
-                            )
-                            bundle.attributes = {**bundle.attributes, **decoded_data}
+            client = self._client_pool.get_client(bundle.device)
+            for uuid_str in NOTIFY_CHARACTERISTICS:
+                await client.stop_notify(uuid_str)
+
+    def _notification_handler(
+        self,
+        bundle: NespressoDeviceBundle,
+        uuid_str: str,
+        callback: Callable[[NespressoDeviceBundle], None],
+    ):
+        client = self._client_pool.get_client(bundle.device)
+
+        def handler(_sender, data: bytearray):
+            self.registry.touch(bundle.device.address)
+            if self.instrumentation.enabled:
+                self.instrumentation.count(bundle.device.address, "notifications")
+            if self._update_bundle(bundle, uuid_str, data):
+                client.pinned = is_brewing(bundle.attributes)
+                callback(bundle)
+
+        return handler
 
     async def cancel_coffee(self, device: BLEDevice):
         pass
 
+    def keep_warm(self, device: BLEDevice, enabled: bool = True) -> None:
+        """Keep an authenticated session open so a brew only needs the write."""
+        self._client_pool.get_client(device).keep_warm = enabled
+
     async def make_coffee(
-        self, device: BLEDevice, volume: NespressoVolume = NespressoVolume.LUNGO
-    ):
+        self,
+        device: BLEDevice,
+        volume: Union[NespressoVolume, str] = NespressoVolume.LUNGO,
+    ) -> dict:
+        """Send the brew command and return the time spent per phase."""
         _LOGGER.debug("make flow a coffee")
+        # The select entity stores the option value
+        command = BREW_COMMANDS.get(
+            NespressoVolume(volume) if volume else NespressoVolume.LUNGO
+        )
         client = self._client_pool.get_client(device)
-        command = "0305070400000000"
-        command += "00"
-        if volume == NespressoVolume.ESPRESSO:
-            command += "01"
-        elif volume == NespressoVolume.LUNGO:
-            command += "02"
-        elif volume == NespressoVolume.RISTRETTO:
-            command += "00"
-        else:
-            command += "00"
+        trace = {}
+        start = time.perf_counter()
+        # Jump ahead of queued background reads
         await client.write_gatt_char(
-            CHAR_UUID_COMMAND, binascii.unhexlify(command), True
+            CHAR_UUID_COMMAND, command, True, trace, PRIORITY_BREW
         )
+        trace["total"] = time.perf_counter() - start
+        # Stay connected until the status reports the brew has finished
+        client.pinned = True
+        _LOGGER.debug(
+            "{} brew command sent in {}".format(
+                device.address,
+                ", ".join(
+                    "{} {:.3f}s".format(phase, value) for phase, value in trace.items()
+                ),
+            )
+        )
+        self.last_brew_trace[device.address] = trace
+        return trace
 
+    async def brew_at(
+        self,
+        device: BLEDevice,
+        when: float,
+        volume: Union[NespressoVolume, str] = NespressoVolume.LUNGO,
+        lead_time: float = BREW_LEAD_TIME,
+    ) -> dict:
+        """Brew at the wall clock time when and return the brew trace.
 
-async def main():
-    logging.basicConfig()
-    _LOGGER.setLevel(logging.INFO)
-    async with BleakScanner() as scanner:
-        client = NespressoClient(scanner, "87302f3c2b62e4f0")
-        await client.discover_nespresso_devices()
-        for bundle in client.bundles:
-            device = bundle.device
-            _LOGGER.info("{}".format(device))
-
-        await client.get_device_data()
-        for bundle in client.bundles:
-            device = bundle.device
-            for name, val in bundle.attributes.items():
-                _LOGGER.info("{}: {}: {}".format(device.address, name, val))
-
-
-if __name__ == "__main__":
-    asyncio.run(main())
+        The session is opened and authenticated lead_time seconds ahead and
+        held until the brew, so only the command write is left at the target
+        time. From BREW_CHECK_AHEAD on no background read or poll is started,
+        the status is read and BrewNotReadyError raised if a flag of
+        BREW_BLOCKING_FLAGS is set. The trace has the firing jitter in
+        seconds, from the target to the command write being sent, positive
+        when it was sent late.
+        """
+        loop = asyncio.get_running_loop()
+        # Sleep on the monotonic loop clock, wall clock steps don't move it
+        deadline = loop.time() + when - time.time()
+        await asyncio.sleep(max(0.0, deadline - lead_time - loop.time()))
+        client = self._client_pool.get_client(device)
+        bundle = self.registry.get(device.address)
+        # The machine may be kept connected already, it stays so afterwards
+        keep_warm = client.keep_warm
+        client.keep_warm = True
+        try:
+            await client.warm_up()
+            await asyncio.sleep(max(0.0, deadline - BREW_CHECK_AHEAD - loop.time()))
+            # A read already running can't be pre-empted, don't start new ones
+            client.queue.hold(PRIORITY_BREW)
+            status = await client.read_gatt_char(CHAR_UUID_STATUS, PRIORITY_BREW)
+            if bundle is not None:
+                self._update_bundle(bundle, CHAR_UUID_STATUS, status)
+                attributes = bundle.attributes
+            else:
+                attributes = sensor_decoders[CHAR_UUID_STATUS].decode_data(status)
+            blocking = [flag for flag in BREW_BLOCKING_FLAGS if attributes.get(flag)]
+            if blocking:
+                raise BrewNotReadyError(
+                    "{} not brewing: {}".format(device.address, ", ".join(blocking))
+                )
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            fired = loop.time()
+            trace = await self.make_coffee(device, volume)
+        finally:
+            client.queue.resume()
+            client.keep_warm = keep_warm
+        # The command was sent once it had its turn and the link, the write
+        # phase is the machine acknowledging it
+        jitter = fired - deadline + trace["total"] - trace["write"]
+        trace["jitter"] = jitter
+        if self.instrumentation.enabled:
+            self.instrumentation.observe(device.address, "brew_jitter", abs(jitter))
+        _LOGGER.debug(
+            "{} scheduled brew fired {:+.1f}ms from its target".format(
+                device.address, jitter * 1000
+            )
+        )
+        return trace
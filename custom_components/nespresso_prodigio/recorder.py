@@ -0,0 +1,263 @@
+"""Binary log of the raw GATT traffic with the machines.
+
+Each record is length prefixed:
+
+    u16 body length | f64 timestamp | u8 kind | u8 address length | address
+    | 16 bytes characteristic uuid (zero when none) | payload
+
+Integers are little endian. Files start with MAGIC and are rotated once
+they reach max_bytes, path.1 being the most recent backup. The auth code
+is never written, authentication is only logged as an AUTH event.
+"""
+import collections
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, NamedTuple, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"NPGATT1\n"
+
+READ = 1
+WRITE = 2
+NOTIFY = 3
+ERROR = 4
+CONNECT = 5
+DISCONNECT = 6
+AUTH = 7
+
+KIND_NAMES = {
+    READ: "read",
+    WRITE: "write",
+    NOTIFY: "notify",
+    ERROR: "error",
+    CONNECT: "connect",
+    DISCONNECT: "disconnect",
+    AUTH: "auth",
+}
+
+RECORDER_MAX_BYTES = 1024 * 1024
+RECORDER_BACKUPS = 3
+
+_LENGTH = struct.Struct("<H")
+_HEADER = struct.Struct("<dBB")
+_NO_UUID = bytes(16)
+
+
+class Record(NamedTuple):
+    timestamp: float
+    kind: int
+    address: str
+    uuid: Union[str, None]
+    payload: bytes
+
+
+def _uuid_bytes(char_specifier) -> bytes:
+    try:
+        return uuid.UUID(str(getattr(char_specifier, "uuid", char_specifier))).bytes
+    except ValueError:
+        # A bare handle
+        return _NO_UUID
+
+
+class GattRecorder:
+    """Append GATT events to a rotated binary log.
+
+    record() only queues the event in memory, so it is safe on the event
+    loop. Opening, flush(), which writes and rotates, and close() touch the
+    file and belong in an executor, flush() is meant to be called
+    periodically.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = RECORDER_MAX_BYTES,
+        backups: int = RECORDER_BACKUPS,
+        clock: Callable[[], float] = None,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.clock = clock or time.time
+        self.records = 0
+        self._file = None
+        self._size = 0
+        self._pending: collections.deque[bytes] = collections.deque()
+        self._lock = threading.Lock()
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(MAGIC)
+            self._size = len(MAGIC)
+            return
+        # A crash can leave a torn record, the ones appended after it would
+        # be unreadable
+        complete = _complete_length(self.path)
+        if complete is None:
+            # Kept out of the backups, read_log would fail on it
+            _LOGGER.warning(
+                "{} is not a GATT log, moving it to {}.invalid".format(
+                    self.path, self.path
+                )
+            )
+            self._file.close()
+            os.replace(self.path, self.path + ".invalid")
+            self._open()
+        elif complete < self._size:
+            _LOGGER.warning(
+                "Dropping {} bytes of a torn record at the end of {}".format(
+                    self._size - complete, self.path
+                )
+            )
+            self._file.truncate(complete)
+            self._size = complete
+            if complete == 0:
+                self._file.write(MAGIC)
+                self._size = len(MAGIC)
+
+    def _rotate(self) -> None:
+        self._file.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = "{}.{}".format(self.path, index)
+            if os.path.exists(source):
+                os.replace(source, "{}.{}".format(self.path, index + 1))
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def record(
+        self,
+        kind: int,
+        address: str,
+        char_specifier=None,
+        payload: Union[bytes, bytearray] = b"",
+    ) -> None:
+        address_bytes = address.encode()
+        body = b"".join(
+            (
+                _HEADER.pack(self.clock(), kind, len(address_bytes)),
+                address_bytes,
+                _NO_UUID if char_specifier is None else _uuid_bytes(char_specifier),
+                bytes(payload),
+            )
+        )
+        self._pending.append(_LENGTH.pack(len(body)) + body)
+        self.records += 1
+
+    def flush(self) -> None:
+        """Write the queued records, rotating the file when it is full."""
+        with self._lock:
+            if self._file is None:
+                return
+            while self._pending:
+                record = self._pending.popleft()
+                if self._size + len(record) > self.max_bytes:
+                    self._rotate()
+                self._file.write(record)
+                self._size += len(record)
+            self._file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def _record_spans(view) -> Iterator[tuple[int, int]]:
+    """Yield the offset and length of each complete record body."""
+    offset = len(MAGIC)
+    end = len(view)
+    while offset + _LENGTH.size <= end:
+        (length,) = _LENGTH.unpack_from(view, offset)
+        offset += _LENGTH.size
+        if offset + length > end:
+            return
+        yield offset, length
+        offset += length
+
+
+def _complete_length(path: str) -> Union[int, None]:
+    """Return the size of a log up to its last complete record.
+
+    None when the file is not a GATT log, 0 when even MAGIC is torn.
+    """
+    with open(path, "rb") as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < len(MAGIC):
+            return 0 if MAGIC.startswith(file.read()) else None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[: len(MAGIC)] != MAGIC:
+                return None
+            complete = len(MAGIC)
+            for offset, length in _record_spans(view):
+                complete = offset + length
+            return complete
+
+
+def read_records(path: str) -> Iterator[Record]:
+    """Yield the records of one log file, a torn last record is skipped."""
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[: len(MAGIC)] != MAGIC:
+                raise ValueError("{} is not a GATT log".format(path))
+            for offset, length in _record_spans(view):
+                timestamp, kind, address_length = _HEADER.unpack_from(view, offset)
+                start = offset + _HEADER.size
+                address = view[start:start + address_length].decode()
+                start += address_length
+                uuid_bytes = view[start:start + 16]
+                char_uuid = None
+                if uuid_bytes != _NO_UUID:
+                    char_uuid = str(uuid.UUID(bytes=uuid_bytes))
+                yield Record(
+                    timestamp,
+                    kind,
+                    address,
+                    char_uuid,
+                    view[start + 16:offset + length],
+                )
+
+
+def read_log(path: str, backups: int = RECORDER_BACKUPS) -> Iterator[Record]:
+    """Yield the records of a log and its backups, oldest first."""
+    for index in range(backups, 0, -1):
+        backup = "{}.{}".format(path, index)
+        if os.path.exists(backup):
+            yield from read_records(backup)
+    if os.path.exists(path):
+        yield from read_records(path)
+
+
+def replay_decode(records, bundle_factory) -> dict:
+    """Feed recorded reads and notifications through the decoders.
+
+    bundle_factory(address) returns the bundle to update, the payloads of
+    each machine are decoded in one batch by its update_many(). Returns the
+    bundles keyed by address, deterministic for a given log.
+    """
+    payloads: dict[str, list] = {}
+    for record in records:
+        if record.kind in (READ, NOTIFY) and record.uuid is not None:
+            payloads.setdefault(record.address, []).append(
+                (record.uuid, record.payload)
+            )
+    bundles = {}
+    for address, batch in payloads.items():
+        bundle = bundles[address] = bundle_factory(address)
+        bundle.update_many(batch)
+    return bundles
@@ -1,13 +1,20 @@
+from __future__ import annotations
+
 import logging
+from typing import TYPE_CHECKING
 
 from homeassistant.components.select import SelectEntity
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.core import HomeAssistant
+from homeassistant.helpers.device_registry import format_mac
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 
-from .const import DOMAIN
-from .nespresso import NespressoVolume, NespressoDeviceBundle
+from .const import CONF_KEEP_CONNECTED, DOMAIN, NespressoVolume
+from .entity import async_setup_device_entities
+
+if TYPE_CHECKING:
+    from .nespresso import NespressoClient, NespressoDeviceBundle
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,38 +25,72 @@ async def async_setup_entry(
         async_add_devices: AddEntitiesCallback,
 ):
     """Set up the Nespresso sensor."""
-    coordinator = hass.data[DOMAIN][entry.entry_id]
-    async_add_devices(
-        [
+    async_setup_device_entities(
+        hass,
+        entry,
+        async_add_devices,
+        lambda manager, coordinator: [
             NespressoSelect(
-                bundle
+                manager.api,
+                coordinator.bundle,
+                entry.options.get(CONF_KEEP_CONNECTED, False),
             )
-            for bundle in coordinator.api.bundles
-        ]
+        ],
     )
 
 
 class NespressoSelect(SelectEntity):
 
-    def __init__(self, bundle: NespressoDeviceBundle):
-        self._bundle = bundle
+    def __init__(
+        self,
+        client: NespressoClient,
+        bundle: NespressoDeviceBundle,
+        keep_connected: bool = False,
+    ):
+        self._client = client
+        self._keep_connected = keep_connected
+        self._address = bundle.device.address
+        self._device_name = bundle.device.name
         self._attr_options = [str(e.value) for e in NespressoVolume]
         self._attr_current_option = str(NespressoVolume.LUNGO.value)
         self.select_option(self._attr_current_option)
 
+    async def async_added_to_hass(self) -> None:
+        """Pre-connect so a brew only costs the command write."""
+        bundle = self._bundle
+        if self._keep_connected and bundle is not None:
+            self._client.keep_warm(bundle.device)
+
+    async def async_will_remove_from_hass(self) -> None:
+        bundle = self._bundle
+        if self._keep_connected and bundle is not None:
+            self._client.keep_warm(bundle.device, False)
+
+    @property
+    def _bundle(self) -> NespressoDeviceBundle | None:
+        return self._client.get_bundle(self._address)
+
+    @property
+    def available(self) -> bool:
+        return self._bundle is not None
+
     def select_option(self, option: str) -> None:
-        self._bundle.selected_volume = option
+        self._attr_current_option = option
+        bundle = self._bundle
+        if bundle is not None:
+            bundle.selected_volume = option
 
     @property
     def device_info(self) -> DeviceInfo:
         """Return the device info."""
         return DeviceInfo(
-            name=self._bundle.device.name,
-            identifiers={(DOMAIN, self._bundle.device.address)},
+            name=self._device_name,
+            identifiers={(DOMAIN, self._address)},
             manufacturer="Nespresso",
             model="Prodigio",
         )
 
     @property
     def unique_id(self) -> str:
-        return "coffee_picker"
+        # A fixed id would clash as soon as a second machine is added
+        return f"{format_mac(self._address)}_coffee_picker"
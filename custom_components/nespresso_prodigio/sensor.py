@@ -0,0 +1,223 @@
+"""Sensors of the Nespresso Prodigio machines."""
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING, Any, Callable
+
+from homeassistant.components.sensor import SensorEntity, SensorStateClass
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import UnitOfInformation, UnitOfTime
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.device_registry import format_mac
+from homeassistant.helpers.entity import DeviceInfo, EntityCategory
+from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+from .const import CONF_INSTRUMENTATION, DOMAIN
+from .entity import NespressoFieldEntity, async_setup_device_entities
+
+if TYPE_CHECKING:
+    from .nespresso import Instrumentation
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _latency_ms(operation: str) -> Callable[[dict], Any]:
+    def value(snapshot: dict):
+        histogram = snapshot["latency"].get(operation)
+        return round(histogram["mean"] * 1000, 1) if histogram else None
+
+    return value
+
+
+def _counter(name: str) -> Callable[[dict], Any]:
+    return lambda snapshot: snapshot["counters"].get(name, 0)
+
+
+# Decoded attribute, name, state class, entity category
+FIELD_SENSORS = (
+    ("caps_number", "Capsules", SensorStateClass.TOTAL_INCREASING, None),
+    # Counts up to the next descaling and restarts at 0 after one
+    ("descaling_counter", "Descaling counter",
+     SensorStateClass.TOTAL_INCREASING, None),
+    ("water_hardness", "Water hardness", None, EntityCategory.DIAGNOSTIC),
+    ("slider", "Slider", None, None),
+)
+
+
+def _rounded(method: str) -> Callable[[Any], Any]:
+    def value(history):
+        result = getattr(history, method)()
+        return round(result, 2) if result is not None else None
+
+    return value
+
+
+# key, name, unit, value from the machine's consumption history
+ANALYTICS_SENSORS = (
+    ("capsules_per_day", "Capsules per day", "capsules/d",
+     _rounded("capsules_per_day")),
+    ("brews_per_hour", "Brews per hour", "brews/h", _rounded("brews_per_hour")),
+    ("days_until_descaling", "Days until descaling", UnitOfTime.DAYS,
+     _rounded("days_until_descaling")),
+)
+
+# key, name, unit, state class, value from the device instrumentation snapshot
+INSTRUMENTATION_SENSORS = (
+    ("poll_duration", "Poll duration", UnitOfTime.MILLISECONDS,
+     SensorStateClass.MEASUREMENT, _latency_ms("poll")),
+    ("connect_duration", "Connect duration", UnitOfTime.MILLISECONDS,
+     SensorStateClass.MEASUREMENT, _latency_ms("connect")),
+    ("queue_wait", "GATT queue wait", UnitOfTime.MILLISECONDS,
+     SensorStateClass.MEASUREMENT, _latency_ms("queue_wait")),
+    ("brew_jitter", "Scheduled brew jitter", UnitOfTime.MILLISECONDS,
+     SensorStateClass.MEASUREMENT, _latency_ms("brew_jitter")),
+    ("connects", "Connects", None,
+     SensorStateClass.TOTAL_INCREASING, _counter("connects")),
+    ("gatt_errors", "GATT errors", None,
+     SensorStateClass.TOTAL_INCREASING, _counter("errors")),
+    ("bytes_read", "Bytes read", UnitOfInformation.BYTES,
+     SensorStateClass.TOTAL_INCREASING, _counter("bytes_read")),
+    ("bytes_written", "Bytes written", UnitOfInformation.BYTES,
+     SensorStateClass.TOTAL_INCREASING, _counter("bytes_written")),
+)
+
+
+async def async_setup_entry(
+        hass: HomeAssistant,
+        entry: ConfigEntry,
+        async_add_devices: AddEntitiesCallback,
+):
+    """Set up the Nespresso sensors."""
+
+    def _entities(manager, coordinator):
+        entities = [
+            NespressoFieldSensor(coordinator, *description)
+            for description in FIELD_SENSORS
+        ] + [
+            NespressoAnalyticsSensor(coordinator, *description)
+            for description in ANALYTICS_SENSORS
+        ]
+        if manager.entry.options.get(CONF_INSTRUMENTATION, False):
+            entities += [
+                NespressoInstrumentationSensor(
+                    coordinator, manager.api.instrumentation, *description
+                )
+                for description in INSTRUMENTATION_SENSORS
+            ]
+        return entities
+
+    async_setup_device_entities(hass, entry, async_add_devices, _entities)
+
+
+class NespressoFieldSensor(NespressoFieldEntity, SensorEntity):
+    """A counter or setting decoded from the machine."""
+
+    def __init__(
+            self,
+            coordinator,
+            attribute: str,
+            name: str,
+            state_class: SensorStateClass | None,
+            entity_category: EntityCategory | None,
+    ):
+        super().__init__(coordinator, attribute, name)
+        self._attr_state_class = state_class
+        self._attr_entity_category = entity_category
+
+    @property
+    def native_value(self):
+        return self._value
+
+
+class NespressoAnalyticsSensor(CoordinatorEntity, SensorEntity):
+    """Rolling consumption figure of a machine."""
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(
+            self,
+            coordinator,
+            key: str,
+            name: str,
+            unit: str,
+            value: Callable[[Any], Any],
+    ):
+        super().__init__(coordinator)
+        bundle = coordinator.bundle
+        self._address = bundle.device.address
+        self._device_name = bundle.device.name
+        self._value = value
+        self._attr_name = f"nespresso_{bundle.device.name} {name}"
+        self._attr_unique_id = f"{format_mac(self._address)}_{key}"
+        self._attr_native_unit_of_measurement = unit
+        self._written = None
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return the device info."""
+        return DeviceInfo(
+            name=self._device_name,
+            identifiers={(DOMAIN, self._address)},
+            manufacturer="Nespresso",
+            model="Prodigio",
+        )
+
+    @property
+    def available(self) -> bool:
+        return super().available and self.coordinator.bundle is not None
+
+    @property
+    def native_value(self):
+        bundle = self.coordinator.bundle
+        return self._value(bundle.history) if bundle is not None else None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """The windows move with time, write whenever the figure changed."""
+        written = (self.available, self.native_value)
+        if written == self._written:
+            return
+        self._written = written
+        self.async_write_ha_state()
+
+
+class NespressoInstrumentationSensor(CoordinatorEntity, SensorEntity):
+    """Timing or counter of the BLE traffic with a machine."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(
+            self,
+            coordinator,
+            instrumentation: Instrumentation,
+            key: str,
+            name: str,
+            unit: str | None,
+            state_class: SensorStateClass,
+            value: Callable[[dict], Any],
+    ):
+        super().__init__(coordinator)
+        bundle = coordinator.bundle
+        self._instrumentation = instrumentation
+        self._address = bundle.device.address
+        self._device_name = bundle.device.name
+        self._value = value
+        self._attr_name = f"nespresso_{bundle.device.name} {name}"
+        self._attr_unique_id = f"{format_mac(self._address)}_{key}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_state_class = state_class
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """Return the device info."""
+        return DeviceInfo(
+            name=self._device_name,
+            identifiers={(DOMAIN, self._address)},
+            manufacturer="Nespresso",
+            model="Prodigio",
+        )
+
+    @property
+    def native_value(self):
+        return self._value(self._instrumentation.device_snapshot(self._address))
@@ -0,0 +1,405 @@
+"""Simulated Prodigio machines behind a fake BleakClient and BleakScanner.
+
+The simulator exposes the real service and characteristic UUIDs so
+NespressoClient can be driven without a coffee machine:
+
+    fleet = ProdigioSimulator()
+    fleet.add_machine(link=LinkProfile(connect_delay=0.5))
+    client = NespressoClient(fleet.scanner(), auth_code, fleet.client_factory)
+
+Status bytes, link latency, disconnects and authentication errors can be
+scripted per machine. GattReplay plays a traffic log captured by
+GattRecorder back through the same fake machines.
+"""
+import asyncio
+import binascii
+import logging
+from typing import Callable, Union
+
+from bleak import BLEDevice, BleakError
+
+from .nespresso import (
+    CHAR_UUID_AUTH,
+    CHAR_UUID_COMMAND,
+    CHAR_UUID_NBCAPS,
+    CHAR_UUID_SERVICE,
+    CHAR_UUID_SLIDER,
+    CHAR_UUID_STATUS,
+    CHAR_UUID_WATER_HARDNESS,
+    ble_device,
+)
+from .recorder import CONNECT, NOTIFY, READ, Record
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_AUTH_CODE = "0011223344556677"
+
+# Status payloads as sent by a machine, see STATUS_FLAGS in nespresso.py
+STATUS_SLEEPING = bytes.fromhex("4008000000000000a0")
+STATUS_READY = bytes.fromhex("4002000000000000a0")
+STATUS_BREWING = bytes.fromhex("4006000000000000a0")
+STATUS_WATER_EMPTY = bytes.fromhex("4102000000000000a0")
+
+# Connection slots of an ESPHome bluetooth proxy
+PROXY_SLOTS = 3
+
+
+class LinkProfile:
+    """Latency in seconds of each GATT operation on a simulated link."""
+
+    def __init__(
+        self,
+        connect_delay: float = 0.0,
+        read_delay: float = 0.0,
+        write_delay: float = 0.0,
+    ):
+        self.connect_delay = connect_delay
+        self.read_delay = read_delay
+        self.write_delay = write_delay
+
+
+class SimulatedCharacteristic:
+    def __init__(self, uuid: str, handle: int, properties: list[str]):
+        self.uuid = uuid
+        self.handle = handle
+        self.properties = properties
+
+    def __str__(self):
+        return "{} (Handle: {})".format(self.uuid, self.handle)
+
+
+class SimulatedService:
+    def __init__(self, uuid: str, characteristics: list[SimulatedCharacteristic]):
+        self.uuid = uuid
+        self.characteristics = characteristics
+
+
+def _build_services() -> list[SimulatedService]:
+    handle = iter(range(1, 1000))
+    generic = SimulatedService(
+        "00001800-0000-1000-8000-00805f9b34fb",
+        [
+            SimulatedCharacteristic(
+                "00002a00-0000-1000-8000-00805f9b34fb", next(handle), ["read"]
+            ),
+            SimulatedCharacteristic(
+                "00002a01-0000-1000-8000-00805f9b34fb", next(handle), ["read"]
+            ),
+        ],
+    )
+    nespresso = SimulatedService(
+        CHAR_UUID_SERVICE,
+        [
+            SimulatedCharacteristic(CHAR_UUID_STATUS, next(handle), ["read", "notify"]),
+            SimulatedCharacteristic(CHAR_UUID_NBCAPS, next(handle), ["read", "notify"]),
+            SimulatedCharacteristic(CHAR_UUID_SLIDER, next(handle), ["read", "notify"]),
+            SimulatedCharacteristic(CHAR_UUID_WATER_HARDNESS, next(handle), ["read"]),
+            SimulatedCharacteristic(CHAR_UUID_AUTH, next(handle), ["write"]),
+            SimulatedCharacteristic(CHAR_UUID_COMMAND, next(handle), ["write"]),
+        ],
+    )
+    return [generic, nespresso]
+
+
+class SimulatedProdigio:
+    """State of one simulated machine.
+
+    Readings are stored as the raw payloads the real machine sends. A brew
+    command switches the status to brewing for brew_time seconds and then
+    increments the capsule counter.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        name: str,
+        auth_code: str = DEFAULT_AUTH_CODE,
+        source: str = "simulator",
+        link: LinkProfile = None,
+        brew_time: float = 0.0,
+    ):
+        self.address = address
+        self.name = name
+        self.auth_code = auth_code
+        self.source = source
+        self.link = link or LinkProfile()
+        self.brew_time = brew_time
+        self.services = _build_services()
+        self.values: dict[str, bytes] = {
+            CHAR_UUID_STATUS: STATUS_READY,
+            CHAR_UUID_NBCAPS: (0).to_bytes(4, "big"),
+            CHAR_UUID_SLIDER: b"\x00",
+            CHAR_UUID_WATER_HARDNESS: b"\x00\x00\x03\x00",
+        }
+        self.commands: list[bytes] = []
+        self.reads = 0
+        self.connects = 0
+        self.reachable = True
+        self._scripted_errors: list[Exception] = []
+        self._clients: list["SimulatedBleakClient"] = []
+
+    @property
+    def device(self) -> BLEDevice:
+        return ble_device(self.address, self.name, self.source)
+
+    @property
+    def caps_number(self) -> int:
+        return int.from_bytes(self.values[CHAR_UUID_NBCAPS], "big")
+
+    def set_value(self, uuid: str, value: Union[bytes, bytearray]) -> None:
+        """Change a reading and notify the subscribed clients."""
+        self.values[uuid] = bytes(value)
+        for client in list(self._clients):
+            client.notify(uuid, self.values[uuid])
+
+    def set_status(self, status: bytes) -> None:
+        self.set_value(CHAR_UUID_STATUS, status)
+
+    def fail_next(self, *errors: Union[Exception, str]) -> None:
+        """Make the next GATT operations raise these errors, in order.
+
+        Common messages are "Disconnected", "Not connected" and
+        "Insufficient authentication".
+        """
+        self._scripted_errors.extend(
+            BleakError(error) if isinstance(error, str) else error for error in errors
+        )
+
+    def disconnect_all(self) -> None:
+        """Drop every link, like the machine going out of range."""
+        for client in list(self._clients):
+            client.drop()
+
+    def _raise_scripted(self) -> None:
+        if self._scripted_errors:
+            raise self._scripted_errors.pop(0)
+
+    async def _brew(self) -> None:
+        self.set_status(STATUS_BREWING)
+        await asyncio.sleep(self.brew_time)
+        self.set_value(CHAR_UUID_NBCAPS, (self.caps_number + 1).to_bytes(4, "big"))
+        self.set_status(STATUS_READY)
+
+
+class SimulatedBleakClient:
+    """The subset of BleakClient used by BLEClientWrapper."""
+
+    def __init__(
+        self,
+        machine: SimulatedProdigio,
+        fleet: "ProdigioSimulator",
+        disconnected_callback: Callable = None,
+        **kwargs,
+    ):
+        self._machine = machine
+        self._fleet = fleet
+        self._disconnected_callback = disconnected_callback
+        self._connected = False
+        self._authenticated = False
+        self._notify: dict[str, Callable] = {}
+        self._brew_task: Union[asyncio.Task, None] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._connected
+
+    @property
+    def services(self):
+        return self._machine.services if self._connected else None
+
+    async def connect(self, **kwargs) -> bool:
+        machine = self._machine
+        await asyncio.sleep(machine.link.connect_delay)
+        machine._raise_scripted()
+        if not machine.reachable:
+            raise BleakError(
+                "Device with address {} was not found".format(machine.address)
+            )
+        self._fleet.acquire_slot(machine.source)
+        self._connected = True
+        self._authenticated = False
+        machine.connects += 1
+        machine._clients.append(self)
+        return True
+
+    async def disconnect(self) -> bool:
+        if self._connected:
+            self.drop()
+        return True
+
+    def drop(self) -> None:
+        """Lose the link and tell the owner like bleak does."""
+        if not self._connected:
+            return
+        self._connected = False
+        self._notify.clear()
+        self._machine._clients.remove(self)
+        self._fleet.release_slot(self._machine.source)
+        if self._disconnected_callback is not None:
+            self._disconnected_callback(self)
+
+    def _check(self, needs_auth: bool = True) -> None:
+        if not self._connected:
+            raise BleakError("Not connected")
+        self._machine._raise_scripted()
+        if needs_auth and not self._authenticated:
+            raise BleakError("Insufficient authentication")
+
+    async def read_gatt_char(self, char_specifier, **kwargs) -> bytearray:
+        await asyncio.sleep(self._machine.link.read_delay)
+        self._check()
+        self._machine.reads += 1
+        return bytearray(self._machine.values[_uuid_of(char_specifier)])
+
+    async def read_gatt_descriptor(self, handle: int, **kwargs) -> bytearray:
+        await asyncio.sleep(self._machine.link.read_delay)
+        self._check()
+        return bytearray(b"\x01\x00")
+
+    async def write_gatt_char(self, char_specifier, data, response: bool = False):
+        await asyncio.sleep(self._machine.link.write_delay)
+        uuid = _uuid_of(char_specifier)
+        if uuid == CHAR_UUID_AUTH:
+            self._check(needs_auth=False)
+            if binascii.hexlify(bytes(data)).decode() != self._machine.auth_code:
+                raise BleakError("Insufficient authentication")
+            self._authenticated = True
+            return
+        self._check()
+        if uuid == CHAR_UUID_COMMAND:
+            self._machine.commands.append(bytes(data))
+            self._brew_task = asyncio.get_running_loop().create_task(
+                self._machine._brew()
+            )
+
+    async def start_notify(self, char_specifier, callback: Callable, **kwargs):
+        self._check()
+        self._notify[_uuid_of(char_specifier)] = callback
+
+    async def stop_notify(self, char_specifier):
+        self._notify.pop(_uuid_of(char_specifier), None)
+
+    def notify(self, uuid: str, value: bytes) -> None:
+        callback = self._notify.get(uuid)
+        if callback is not None:
+            callback(uuid, bytearray(value))
+
+
+def _uuid_of(char_specifier) -> str:
+    return str(getattr(char_specifier, "uuid", char_specifier))
+
+
+class SimulatedBleakScanner:
+    """Returns the simulated machines from discover() like BleakScanner."""
+
+    def __init__(self, fleet: "ProdigioSimulator", delay: float = 0.0):
+        self._fleet = fleet
+        self._delay = delay
+        self.discovered_devices: list[BLEDevice] = []
+        self.scans = 0
+
+    async def discover(self, **kwargs) -> list[BLEDevice]:
+        await asyncio.sleep(self._delay)
+        self.scans += 1
+        self.discovered_devices = [
+            machine.device
+            for machine in self._fleet.machines.values()
+            if machine.reachable
+        ]
+        return self.discovered_devices
+
+
+class ProdigioSimulator:
+    """A fleet of simulated machines spread over adapters or proxies."""
+
+    def __init__(self, slots_per_source: int = PROXY_SLOTS):
+        self.machines: dict[str, SimulatedProdigio] = {}
+        self._slots_per_source = slots_per_source
+        self._slots_in_use: dict[str, int] = {}
+        self.peak_slots: dict[str, int] = {}
+
+    def add_machine(self, address: str = None, **kwargs) -> SimulatedProdigio:
+        index = len(self.machines)
+        if address is None:
+            address = "00:00:00:00:{:02X}:{:02X}".format(index // 256, index % 256)
+        kwargs.setdefault("name", "Prodigio_{}".format(address[-5:].replace(":", "")))
+        machine = SimulatedProdigio(address, **kwargs)
+        self.machines[address] = machine
+        return machine
+
+    def add_fleet(self, count: int, sources: int = 1, **kwargs) -> list:
+        return [
+            self.add_machine(source="proxy_{}".format(index % sources), **kwargs)
+            for index in range(count)
+        ]
+
+    def client_factory(self, device: BLEDevice, **kwargs) -> SimulatedBleakClient:
+        return SimulatedBleakClient(self.machines[device.address], self, **kwargs)
+
+    def scanner(self, delay: float = 0.0) -> SimulatedBleakScanner:
+        return SimulatedBleakScanner(self, delay)
+
+    def acquire_slot(self, source: str) -> None:
+        in_use = self._slots_in_use.get(source, 0)
+        if in_use >= self._slots_per_source:
+            # The error Home Assistant raises when a proxy is saturated
+            raise BleakError(
+                "No backend with an available connection slot that can reach "
+                "address was found"
+            )
+        self._slots_in_use[source] = in_use + 1
+        self.peak_slots[source] = max(self.peak_slots.get(source, 0), in_use + 1)
+
+    def release_slot(self, source: str) -> None:
+        self._slots_in_use[source] -= 1
+
+
+class GattReplay(ProdigioSimulator):
+    """Machines whose readings follow a recorded GATT log.
+
+    One machine is created per recorded address. play() applies the
+    recorded reads and notifications in order, so a client polling or
+    subscribed to the machines sees the captured values.
+    """
+
+    def __init__(self, records: list[Record], auth_code: str = DEFAULT_AUTH_CODE):
+        # A replay is not about proxy saturation
+        super().__init__(slots_per_source=1 << 16)
+        self.records = [
+            record
+            for record in records
+            if record.kind == CONNECT
+            or (record.kind in (READ, NOTIFY) and record.uuid in _REPLAYED_UUIDS)
+        ]
+        for record in self.records:
+            if record.address in self.machines:
+                continue
+            kwargs = {"auth_code": auth_code}
+            if record.kind == CONNECT and record.payload:
+                kwargs["name"] = bytes(record.payload).decode()
+            self.add_machine(record.address, **kwargs)
+
+    async def play(self, speed: Union[float, None] = 1.0) -> int:
+        """Apply the log, speed None plays it as fast as possible.
+
+        Returns the number of readings applied.
+        """
+        applied = 0
+        previous = None
+        for record in self.records:
+            if previous is not None:
+                gap = record.timestamp - previous
+                await asyncio.sleep(0 if speed is None else max(0.0, gap) / speed)
+            previous = record.timestamp
+            if record.kind in (READ, NOTIFY):
+                self.machines[record.address].set_value(record.uuid, record.payload)
+                applied += 1
+        return applied
+
+
+_REPLAYED_UUIDS = {
+    CHAR_UUID_STATUS,
+    CHAR_UUID_NBCAPS,
+    CHAR_UUID_SLIDER,
+    CHAR_UUID_WATER_HARDNESS,
+}
@@ -5,19 +5,33 @@ https://www.nespresso.com
 For more details about this platform, please refer to the documentation at
 https://home-assistant.io/components/sensor.Nespresso/
 """
+from __future__ import annotations
+
+import asyncio
 import logging
 from abc import ABC
-from typing import Any
+from datetime import datetime
+from typing import TYPE_CHECKING, Any
 
+import voluptuous as vol
 from homeassistant.components.switch import SwitchEntity
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers import config_validation as cv, entity_platform
 from homeassistant.helpers.device_registry import format_mac
 from homeassistant.helpers.entity import DeviceInfo
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+from homeassistant.util import dt as dt_util
+
+from .const import BREW_LEAD_TIME, DOMAIN, SERVICE_SCHEDULE_BREW, NespressoVolume
+from .entity import async_setup_device_entities
+
+if TYPE_CHECKING:
+    from bleak import BLEDevice
 
-from .const import DOMAIN
-from .nespresso import NespressoClient, NespressoDeviceBundle
+    from .nespresso import NespressoClient, NespressoDeviceBundle
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -28,36 +42,72 @@ async def async_setup_entry(
         async_add_devices: AddEntitiesCallback,
 ):
     """Set up the Nespresso sensor."""
-    coordinator = hass.data[DOMAIN][entry.entry_id]
-    async_add_devices(
-        [
-            NespressoSwitch(
-                bundle, coordinator.api
-            )
-            for bundle in coordinator.api.bundles
-        ]
+    async_setup_device_entities(
+        hass,
+        entry,
+        async_add_devices,
+        lambda manager, coordinator: [
+            NespressoSwitch(coordinator, coordinator.bundle, manager.api, entry)
+        ],
+    )
+    entity_platform.async_get_current_platform().async_register_entity_service(
+        SERVICE_SCHEDULE_BREW,
+        {
+            vol.Required("at"): cv.datetime,
+            vol.Optional("volume"): vol.In([v.value for v in NespressoVolume]),
+            vol.Optional("lead_time", default=BREW_LEAD_TIME): vol.All(
+                vol.Coerce(float), vol.Range(min=0)
+            ),
+        },
+        "async_schedule_brew",
     )
 
 
-class NespressoSwitch(SwitchEntity, ABC):
+class NespressoSwitch(CoordinatorEntity, SwitchEntity, ABC):
     """General Representation of a Nespresso sensor."""
 
     def __init__(
-            self, bundle: NespressoDeviceBundle, client: NespressoClient
+            self,
+            coordinator,
+            bundle: NespressoDeviceBundle,
+            client: NespressoClient,
+            entry: ConfigEntry,
     ):
         """Initialize a sensor."""
+        super().__init__(coordinator)
         self._attr_is_on = False
         self._name = "nespresso_" + bundle.device.name
-        self._bundle = bundle
+        self._device_name = bundle.device.name
+        self._address = bundle.device.address
         self._client = client
+        self._entry = entry
+        self._written = None
+        self._scheduled: asyncio.Task | None = None
         _LOGGER.debug("Added sensor entity {}".format(self._name))
 
+    @property
+    def _bundle(self) -> NespressoDeviceBundle | None:
+        """Return the current bundle, None once the machine was forgotten."""
+        return self._client.get_bundle(self._address)
+
+    @property
+    def available(self) -> bool:
+        return super().available and self._bundle is not None
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """The readings have their own entities, only availability matters."""
+        if self.available == self._written:
+            return
+        self._written = self.available
+        self.async_write_ha_state()
+
     @property
     def device_info(self) -> DeviceInfo:
         """Return the device info."""
         return DeviceInfo(
-            name=self._bundle.device.name,
-            identifiers={(DOMAIN, self._bundle.device.address)},
+            name=self._device_name,
+            identifiers={(DOMAIN, self._address)},
             manufacturer="Nespresso",
             model="Prodigio"
         )
@@ -73,31 +123,78 @@ class NespressoSwitch(SwitchEntity, ABC):
 
     @property
     def unique_id(self):
-        return format_mac(self._bundle.device.address)
+        return format_mac(self._address)
 
     @property
     def is_on(self) -> bool:
         """Return True if entity is on."""
         return self._attr_is_on
 
-    @property
-    def state_attributes(self):
-        """Return the state attributes.
-
-        Implemented by component base class, should not be extended by integrations.
-        Convention for attribute names is lowercase snake_case.
-        """
-        return self._bundle.attributes
-
     async def async_turn_on(self, **kwargs: Any) -> None:
+        bundle = self._bundle
+        if bundle is None:
+            return
         self._attr_is_on = True
-        await self._client.make_coffee(
-            self._bundle.device, self._bundle.selected_volume
-        )
+        await self._client.make_coffee(bundle.device, bundle.selected_volume)
         self._attr_is_on = False
 
     async def async_turn_off(self, **kwargs: Any) -> None:
         """Turn the entity off."""
-        if self._attr_is_on:
-            await self._client.cancel_coffee(self._bundle.device)
+        bundle = self._bundle
+        if self._attr_is_on and bundle is not None:
+            await self._client.cancel_coffee(bundle.device)
         self._attr_is_on = False
+
+    async def async_schedule_brew(
+        self, at: datetime, volume: str | None = None, lead_time: float = BREW_LEAD_TIME
+    ) -> None:
+        """Brew at a given time, replacing the brew already scheduled."""
+        bundle = self._bundle
+        if bundle is None:
+            raise HomeAssistantError(f"{self._device_name} is not available")
+        if at.tzinfo is None:
+            at = at.replace(tzinfo=dt_util.DEFAULT_TIME_ZONE)
+        if at <= dt_util.utcnow():
+            raise HomeAssistantError(f"{at} is in the past")
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+        # May sleep for hours, a background task neither holds up
+        # async_block_till_done nor shutdown and is cancelled on unload
+        self._scheduled = self._entry.async_create_background_task(
+            self.hass,
+            self._async_brew_at(
+                bundle.device, at, volume or bundle.selected_volume, lead_time
+            ),
+            f"{DOMAIN} scheduled brew {self._address}",
+        )
+
+    async def _async_brew_at(
+        self,
+        device: BLEDevice,
+        at: datetime,
+        volume: NespressoVolume | str | None,
+        lead_time: float,
+    ) -> None:
+        try:
+            trace = await self._client.brew_at(
+                device, at.timestamp(), volume, lead_time
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            _LOGGER.warning(
+                "Scheduled brew of {} did not fire: {}".format(self._device_name, e)
+            )
+        else:
+            _LOGGER.info(
+                "Scheduled brew of {} fired {:+.1f}ms from {}".format(
+                    self._device_name, trace["jitter"] * 1000, at
+                )
+            )
+        finally:
+            if self._scheduled is asyncio.current_task():
+                self._scheduled = None
+
+    async def async_will_remove_from_hass(self) -> None:
+        """Cancel a scheduled brew with the entity."""
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+        await super().async_will_remove_from_hass()
@@ -0,0 +1,105 @@
+"""Rolling consumption aggregates, ring wrap-around and storage round trip."""
+import json
+
+from custom_components.nespresso_prodigio.analytics import (
+    DAY,
+    ConsumptionHistory,
+)
+
+HOUR = 3600
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _hourly(history: ConsumptionHistory, caps: range, descaling: int = 100) -> None:
+    for hour, count in enumerate(caps):
+        history.append(hour * HOUR, count, descaling)
+
+
+def test_samples_expire_from_the_day_but_not_the_week():
+    history = ConsumptionHistory(clock=VirtualClock())
+    _hourly(history, range(10, 13))
+
+    assert history.brews_per_hour(2 * HOUR) == 1.0
+    # Only the sample without a brew left the day
+    history.expire(DAY + 1)
+    assert history.day.start == 1
+    assert (history.day.brews, history.capsules(history.day)) == (2, 2)
+    history.expire(25 * HOUR + 1)
+    assert (history.day.brews, history.capsules(history.day)) == (1, 1)
+    assert (history.week.brews, history.capsules(history.week)) == (2, 2)
+    # Two capsules in the week, spread over the 25 hours of history
+    assert history.capsules_per_day(25 * HOUR) == 2 / (25 / 24)
+
+
+def test_ring_wraps_around_and_windows_start_after_the_dropped_sample():
+    history = ConsumptionHistory(size=4, clock=VirtualClock())
+    _hourly(history, range(10, 16))
+
+    assert len(history) == 4
+    assert history.seq == 6
+    assert history.latest == (5 * HOUR, 15, 100)
+    assert history.dropped == (11, 100)
+    for window in (history.day, history.week):
+        assert window.start == 2
+        assert (window.brews, history.capsules(window)) == (4, 4)
+    assert history.brews_per_hour(5 * HOUR) == 4 / 5
+
+
+def test_descaling_counter_reset_keeps_the_forecast():
+    history = ConsumptionHistory(clock=VirtualClock())
+    history.record({"caps_number": 1, "descaling_counter": 100}, 0)
+    # Unknown until the machine asked for descaling once
+    assert history.days_until_descaling(0) is None
+    history.record(
+        {"caps_number": 2, "descaling_counter": 200, "descaling_needed": 1}, DAY
+    )
+    assert history.descaling_threshold == 200
+    assert history.days_until_descaling(DAY) == 0.0
+
+    # Descaled, the counter starts over
+    history.record({"caps_number": 2, "descaling_counter": 0}, DAY + 60)
+    history.record({"caps_number": 3, "descaling_counter": 50}, 3 * DAY)
+
+    # 150 left at the 50 per 3 days grown since the reset
+    assert history.days_until_descaling(3 * DAY) == 9.0
+    assert history.capsules_per_day(3 * DAY) == 2 / 3
+
+
+def test_round_trip_through_storage():
+    history = ConsumptionHistory(size=4, clock=VirtualClock())
+    _hourly(history, range(10, 16))
+    history.descaling_threshold = 400
+    history.append(6 * HOUR, 16, 130)
+
+    data = json.loads(json.dumps(history.as_dict()))
+    for size in (4, 16):
+        restored = ConsumptionHistory.from_dict(data, size=size, clock=VirtualClock())
+
+        assert json.loads(json.dumps(restored.as_dict())) == data
+        assert len(restored) == len(history)
+        assert restored.latest == history.latest
+        for window, restored_window in (
+            (history.day, restored.day),
+            (history.week, restored.week),
+        ):
+            assert restored_window.brews == window.brews
+            assert restored.capsules(restored_window) == history.capsules(window)
+        now = 7 * HOUR
+        assert restored.brews_per_hour(now) == history.brews_per_hour(now)
+        assert restored.capsules_per_day(now) == history.capsules_per_day(now)
+        assert restored.days_until_descaling(now) == history.days_until_descaling(now)
+
+
+def test_empty_history_round_trips():
+    restored = ConsumptionHistory.from_dict(ConsumptionHistory().as_dict())
+
+    assert len(restored) == 0
+    assert restored.latest is None
+    assert restored.capsules_per_day(0) is None
@@ -0,0 +1,74 @@
+"""Scheduled brews fire on time while the machine is being polled."""
+import asyncio
+import time
+
+from custom_components.nespresso_prodigio.nespresso import NespressoClient
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    LinkProfile,
+    ProdigioSimulator,
+)
+
+READ_DELAY = 0.3
+
+
+class TimedCommands:
+    """Loop time at which each brew command reached a simulated machine."""
+
+    def __init__(self, fleet: ProdigioSimulator):
+        self.sent = []
+        self._fleet = fleet
+
+    def client_factory(self, device, **kwargs):
+        client = self._fleet.client_factory(device, **kwargs)
+        write = client.write_gatt_char
+        sent = self.sent
+
+        async def timed_write(char_specifier, data, response=False):
+            if len(data) > 8:
+                sent.append(asyncio.get_running_loop().time())
+            return await write(char_specifier, data, response)
+
+        client.write_gatt_char = timed_write
+        return client
+
+
+def test_brew_jitter_is_measured_at_the_write_and_polls_wait():
+    async def scenario():
+        fleet = ProdigioSimulator()
+        machine = fleet.add_machine(link=LinkProfile(read_delay=READ_DELAY))
+        commands = TimedCommands(fleet)
+        client = NespressoClient(
+            fleet.scanner(), DEFAULT_AUTH_CODE, commands.client_factory
+        )
+        await client.discover_nespresso_devices()
+        bundle = client.get_bundle(machine.address)
+
+        # Stopped with an event, wait_for may swallow a cancellation
+        stop = asyncio.Event()
+
+        async def poll_until_stopped():
+            while not stop.is_set():
+                bundle.read_at.clear()
+                await client.poll_bundle(bundle)
+
+        loop = asyncio.get_running_loop()
+        # Polls read back to back from now on, the target is in the middle of one
+        delay = 1.5 + READ_DELAY / 2
+        when = time.time() + delay
+        target = loop.time() + delay
+        poller = asyncio.ensure_future(poll_until_stopped())
+        try:
+            trace = await client.brew_at(bundle.device, when, lead_time=1.0)
+        finally:
+            stop.set()
+        await poller
+
+        assert len(commands.sent) == 1
+        late = commands.sent[0] - target
+        # No poll read was started in the way of the command
+        assert late < READ_DELAY / 4
+        assert abs(trace["jitter"] - late) < 0.05
+        await client.disconnect(bundle.device)
+
+    asyncio.run(scenario())
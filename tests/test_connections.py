@@ -0,0 +1,73 @@
+"""Connection slots follow a machine from one proxy to another."""
+import asyncio
+
+from custom_components.nespresso_prodigio.nespresso import (
+    BLEConnectionScheduler,
+    NespressoClient,
+    RetryPolicy,
+    ble_device,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    ProdigioSimulator,
+)
+
+ADDRESS = "00:00:00:00:00:01"
+
+
+class Holder:
+    """The part of BLEClientWrapper the scheduler looks at."""
+
+    is_busy = False
+    is_pinned = False
+    last_used = 0.0
+
+    def __init__(self, source: str):
+        self.device = ble_device(ADDRESS, "", source)
+
+
+def test_slot_is_released_on_the_source_it_was_taken_on():
+    async def scenario():
+        scheduler = BLEConnectionScheduler(max_connections=1)
+        holder = Holder("proxy_a")
+        await scheduler.acquire(holder)
+        # Advertised through another proxy while connected
+        holder.device = ble_device(ADDRESS, "", "proxy_b")
+
+        scheduler.wake(holder)
+        assert scheduler.held == {"proxy_a": 1}
+        scheduler.release(holder)
+        assert scheduler.held == {}
+
+    asyncio.run(scenario())
+
+
+def test_reconnect_goes_through_the_proxy_of_the_latest_advertisement():
+    async def scenario():
+        fleet = ProdigioSimulator(slots_per_source=1)
+        moving = fleet.add_machine(source="proxy_a")
+        staying = fleet.add_machine(source="proxy_b")
+        client = NespressoClient(
+            fleet.scanner(),
+            DEFAULT_AUTH_CODE,
+            fleet.client_factory,
+            retry_policy=RetryPolicy(attempts=0),
+            max_connections=1,
+        )
+        await client.discover_nespresso_devices()
+        for machine in (moving, staying):
+            await client.poll_bundle(client.get_bundle(machine.address))
+        assert client.connection_metrics["slots"] == {"proxy_a": 1, "proxy_b": 1}
+
+        moving.disconnect_all()
+        moving.source = "proxy_b"
+        client.track_device(moving.device)
+        # The only slot of proxy_b is taken, its idle link makes room
+        await client.poll_bundle(client.get_bundle(moving.address))
+
+        assert client.connection_metrics["slots"] == {"proxy_b": 1}
+        assert fleet.peak_slots == {"proxy_a": 1, "proxy_b": 1}
+        moving.disconnect_all()
+        assert client.connection_metrics["slots"] == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,58 @@
+"""Batch decoding matches decoding the payloads one at a time."""
+from custom_components.nespresso_prodigio.nespresso import (
+    CHAR_UUID_COMMAND,
+    CHAR_UUID_NBCAPS,
+    CHAR_UUID_STATUS,
+    NespressoDeviceBundle,
+    ble_device,
+    decode_payloads,
+    sensor_decoders,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    STATUS_BREWING,
+    STATUS_READY,
+    STATUS_WATER_EMPTY,
+)
+
+STATUS = str(CHAR_UUID_STATUS)
+NBCAPS = str(CHAR_UUID_NBCAPS)
+PAYLOADS = [
+    (STATUS, STATUS_READY),
+    (NBCAPS, (41).to_bytes(4, "big")),
+    (STATUS, STATUS_BREWING),
+    (STATUS, STATUS_BREWING),
+    (STATUS, STATUS_READY),
+    (NBCAPS, (42).to_bytes(4, "big")),
+    (STATUS, STATUS_WATER_EMPTY),
+]
+
+
+def _bundle() -> NespressoDeviceBundle:
+    return NespressoDeviceBundle(ble_device("00:00:00:00:00:01", ""), {})
+
+
+def test_decode_payloads_keeps_the_input_order():
+    assert decode_payloads(PAYLOADS) == [
+        sensor_decoders[uuid_str].decode_data(data) for uuid_str, data in PAYLOADS
+    ]
+
+
+def test_update_many_matches_update_raw():
+    batched, single = _bundle(), _bundle()
+    batched.read_at[NBCAPS] = single.read_at[NBCAPS] = 0.0
+    payloads = PAYLOADS + [(str(CHAR_UUID_COMMAND), b"\x03\x05")]
+
+    assert batched.update_many(payloads)
+    for uuid_str, data in payloads:
+        if uuid_str in sensor_decoders:
+            single.update_raw(uuid_str, data)
+
+    assert batched.attributes == single.attributes
+    assert batched.raw == single.raw
+    for key in ("caps", "descaling", "dropped"):
+        assert batched.history.as_dict()[key] == single.history.as_dict()[key]
+    # The end of the brew asked for the capsule count again
+    assert NBCAPS not in batched.read_at
+    # One change for listeners however long the batch
+    assert batched.version == 1
+    assert not batched.update_many(payloads[-1:])
@@ -0,0 +1,82 @@
+"""Memory stays flat over thousands of discovery cycles with churning machines."""
+import asyncio
+import gc
+import tracemalloc
+
+from custom_components.nespresso_prodigio.nespresso import NespressoClient, RetryPolicy
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    ProdigioSimulator,
+)
+
+FLEET = 200
+# Machines in range at once, the window moves by CHURN machines per cycle
+IN_RANGE = 40
+CHURN = 5
+CYCLE_SECONDS = 60
+TTL = 10 * CYCLE_SECONDS
+WARMUP_CYCLES = 500
+CYCLES = 2500
+# Allowed growth between the end of the warm up and the last cycle
+MAX_GROWTH = 64 * 1024
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_discovery_memory_is_flat():
+    async def scenario():
+        fleet = ProdigioSimulator()
+        machines = fleet.add_fleet(FLEET)
+        clock = VirtualClock()
+        client = NespressoClient(
+            fleet.scanner(),
+            DEFAULT_AUTH_CODE,
+            fleet.client_factory,
+            device_ttl=TTL,
+            retry_policy=RetryPolicy(clock=clock),
+        )
+        client.registry.clock = clock
+        client.instrumentation.enabled = True
+
+        async def cycle(index: int) -> None:
+            first = index * CHURN
+            for number, machine in enumerate(machines):
+                machine.reachable = (number - first) % FLEET < IN_RANGE
+            await client.discover_nespresso_devices()
+            # Advertisements between scans refresh the same machines
+            for machine in machines[first % FLEET : first % FLEET + CHURN]:
+                client.track_device(machine.device)
+            # Reads of the newest machines open connections and instrumentation
+            for bundle in client.bundles[-2:]:
+                await client.poll_bundle(bundle)
+            clock.now += CYCLE_SECONDS
+            await client.evict_stale_devices()
+
+        tracemalloc.start()
+        try:
+            for index in range(WARMUP_CYCLES):
+                await cycle(index)
+            gc.collect()
+            start, _ = tracemalloc.get_traced_memory()
+            for index in range(WARMUP_CYCLES, CYCLES):
+                await cycle(index)
+            gc.collect()
+            end, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # Only what was seen within the ttl is kept
+        assert len(client.registry) <= IN_RANGE + CHURN * TTL // CYCLE_SECONDS
+        assert len(client.instrumentation.snapshot()) <= len(client.registry)
+        assert sum(machine.connects for machine in machines) >= CYCLES
+        assert end - start < MAX_GROWTH
+        for bundle in client.bundles:
+            await client.disconnect(bundle.device)
+
+    asyncio.run(scenario())
@@ -0,0 +1,108 @@
+"""Notifications reach the callback that currently owns the machine."""
+import asyncio
+
+from bleak import BleakError
+
+from custom_components.nespresso_prodigio.nespresso import (
+    CHAR_UUID_SLIDER,
+    NespressoClient,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    STATUS_BREWING,
+    STATUS_READY,
+    STATUS_WATER_EMPTY,
+    ProdigioSimulator,
+)
+
+
+async def _subscribed_client():
+    fleet = ProdigioSimulator()
+    machine = fleet.add_machine()
+    client = NespressoClient(fleet.scanner(), DEFAULT_AUTH_CODE, fleet.client_factory)
+    await client.discover_nespresso_devices()
+    return machine, client, client.get_bundle(machine.address)
+
+
+def test_takeover_routes_notifications_to_the_new_owner():
+    async def scenario():
+        machine, client, bundle = await _subscribed_client()
+        dropped, owner = [], []
+        await client.subscribe_bundle(bundle, dropped.append)
+        machine.set_status(STATUS_BREWING)
+        assert dropped == [bundle]
+
+        # The catch-all entry gives the machine up to its own entry
+        client.unsubscribe_bundle(machine.address)
+        machine.set_status(STATUS_READY)
+        await client.subscribe_bundle(bundle, owner.append)
+        machine.set_status(STATUS_WATER_EMPTY)
+
+        assert dropped == [bundle]
+        assert owner == [bundle]
+        assert bundle.attributes["water_is_empty"] == 1
+        assert client.is_subscribed(bundle.device)
+        await client.disconnect(bundle.device)
+
+    asyncio.run(scenario())
+
+
+def test_subscribing_again_replaces_the_callback():
+    async def scenario():
+        machine, client, bundle = await _subscribed_client()
+        first, second = [], []
+        await client.subscribe_bundle(bundle, first.append)
+        await client.subscribe_bundle(bundle, second.append)
+
+        machine.set_status(STATUS_BREWING)
+        # Also after the link dropped and the subscriptions were restored
+        machine.disconnect_all()
+        await client.poll_bundle(bundle)
+        machine.set_status(STATUS_READY)
+
+        assert first == []
+        assert second == [bundle, bundle]
+        await client.disconnect(bundle.device)
+
+    asyncio.run(scenario())
+
+
+def test_refused_subscription_is_retried_after_reconnecting():
+    async def scenario():
+        fleet = ProdigioSimulator()
+        machine = fleet.add_machine()
+        refused = []
+
+        def client_factory(device, **kwargs):
+            client = fleet.client_factory(device, **kwargs)
+            start_notify = client.start_notify
+
+            async def refuse_slider(char_specifier, callback, **kwargs):
+                if str(char_specifier) == str(CHAR_UUID_SLIDER):
+                    refused.append(char_specifier)
+                    raise BleakError("Notify not supported")
+                await start_notify(char_specifier, callback, **kwargs)
+
+            client.start_notify = refuse_slider
+            return client
+
+        client = NespressoClient(fleet.scanner(), DEFAULT_AUTH_CODE, client_factory)
+        await client.discover_nespresso_devices()
+        bundle = client.get_bundle(machine.address)
+        updates = []
+        # Every poll subscribes again, the refusal holds for the connection
+        for _ in range(3):
+            await client.poll_bundle(bundle)
+            await client.subscribe_bundle(bundle, updates.append)
+        assert len(refused) == 1
+        machine.set_status(STATUS_BREWING)
+        assert updates == [bundle]
+
+        machine.disconnect_all()
+        await client.poll_bundle(bundle)
+        await client.subscribe_bundle(bundle, updates.append)
+        assert len(refused) == 2
+        assert client.is_subscribed(bundle.device)
+        await client.disconnect(bundle.device)
+
+    asyncio.run(scenario())
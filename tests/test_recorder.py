@@ -0,0 +1,109 @@
+"""GATT log round trip, rotation and recovery from a torn last record."""
+import os
+
+from custom_components.nespresso_prodigio.nespresso import (
+    CHAR_UUID_COMMAND,
+    CHAR_UUID_STATUS,
+)
+from custom_components.nespresso_prodigio.recorder import (
+    CONNECT,
+    MAGIC,
+    NOTIFY,
+    READ,
+    WRITE,
+    GattRecorder,
+    read_log,
+    read_records,
+)
+
+ADDRESS = "00:00:00:00:00:01"
+
+
+class Ticks:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        self.now += 1
+        return self.now
+
+
+def test_records_round_trip(tmp_path):
+    path = str(tmp_path / "gattlog")
+    recorder = GattRecorder(path, clock=Ticks())
+    recorder.record(CONNECT, ADDRESS, payload=b"Prodigio_0001")
+    recorder.record(READ, ADDRESS, CHAR_UUID_STATUS, bytearray(b"\x40\x02"))
+    recorder.record(WRITE, ADDRESS, CHAR_UUID_COMMAND, b"\x03\x05")
+    # Not on disk until flushed
+    assert list(read_records(path)) == []
+    recorder.close()
+
+    records = list(read_records(path))
+
+    assert [record.kind for record in records] == [CONNECT, READ, WRITE]
+    assert [record.timestamp for record in records] == [1001.0, 1002.0, 1003.0]
+    assert {record.address for record in records} == {ADDRESS}
+    assert [record.uuid for record in records] == [
+        None,
+        CHAR_UUID_STATUS,
+        CHAR_UUID_COMMAND,
+    ]
+    assert [bytes(record.payload) for record in records] == [
+        b"Prodigio_0001",
+        b"\x40\x02",
+        b"\x03\x05",
+    ]
+
+
+def test_log_rotates_into_backups(tmp_path):
+    path = str(tmp_path / "gattlog")
+    # Room for a few records per file
+    recorder = GattRecorder(path, max_bytes=200, backups=2, clock=Ticks())
+    for index in range(30):
+        recorder.record(NOTIFY, ADDRESS, CHAR_UUID_STATUS, bytes([index]) * 8)
+        recorder.flush()
+    recorder.close()
+
+    assert os.path.exists(path + ".1")
+    assert os.path.exists(path + ".2")
+    assert not os.path.exists(path + ".3")
+    for name in (path, path + ".1", path + ".2"):
+        assert os.path.getsize(name) <= 200
+    payloads = [record.payload[0] for record in read_log(path, backups=2)]
+    # The oldest records were rotated out, the rest are in order
+    assert payloads == list(range(30 - len(payloads), 30))
+
+
+def test_torn_record_is_dropped_on_open(tmp_path):
+    path = str(tmp_path / "gattlog")
+    recorder = GattRecorder(path)
+    recorder.record(READ, ADDRESS, CHAR_UUID_STATUS, b"\x40\x02")
+    recorder.close()
+    complete = os.path.getsize(path)
+    # A crash in the middle of writing the next record
+    with open(path, "ab") as file:
+        file.write(b"\x30\x00\x01\x02\x03")
+
+    recorder = GattRecorder(path)
+    recorder.record(NOTIFY, ADDRESS, CHAR_UUID_STATUS, b"\x40\x06")
+    recorder.close()
+
+    assert [record.kind for record in read_records(path)] == [READ, NOTIFY]
+    assert os.path.getsize(path) > complete
+
+
+def test_torn_magic_and_foreign_files(tmp_path):
+    torn = str(tmp_path / "torn")
+    with open(torn, "wb") as file:
+        file.write(MAGIC[:3])
+    foreign = str(tmp_path / "foreign")
+    with open(foreign, "wb") as file:
+        file.write(b"not a gatt log at all")
+
+    for path in (torn, foreign):
+        recorder = GattRecorder(path)
+        recorder.record(NOTIFY, ADDRESS, CHAR_UUID_STATUS, b"\x40\x06")
+        recorder.close()
+        assert [record.kind for record in read_records(path)] == [NOTIFY]
+    with open(foreign + ".invalid", "rb") as file:
+        assert file.read() == b"not a gatt log at all"
@@ -0,0 +1,421 @@
+"""Retry policy, circuit breaker and operation queue on a virtual clock."""
+import asyncio
+
+import pytest
+from bleak import BleakError
+
+from custom_components.nespresso_prodigio.nespresso import (
+    BREAKER_FAILURES,
+    BREAKER_RESET_TIMEOUT,
+    CHAR_UUID_STATUS,
+    PRIORITY_BACKGROUND,
+    PRIORITY_BREW,
+    PRIORITY_DEFAULT,
+    BLEClientWrapper,
+    CircuitBreaker,
+    CircuitOpenError,
+    GattOperationQueue,
+    RetryPolicy,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    DEFAULT_AUTH_CODE,
+    STATUS_READY,
+    ProdigioSimulator,
+)
+
+
+class VirtualClock:
+    """Time that only moves when slept on or advanced."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    async def sleep(self, delay: float) -> None:
+        self.sleeps.append(delay)
+        self.now += delay
+        await asyncio.sleep(0)
+
+
+def retry_policy(clock: VirtualClock, **kwargs) -> RetryPolicy:
+    # Without jitter every backoff is the full capped delay
+    return RetryPolicy(sleep=clock.sleep, clock=clock, rand=lambda: 1.0, **kwargs)
+
+
+class FlakyOperation:
+    """Fails a number of times, each call taking duration virtual seconds."""
+
+    def __init__(self, clock: VirtualClock, failures: int, duration: float = 0.0):
+        self.clock = clock
+        self.failures = failures
+        self.duration = duration
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        self.clock.now += self.duration
+        if self.calls <= self.failures:
+            raise BleakError("Not connected")
+        return "ok"
+
+
+def test_retry_backs_off_exponentially():
+    clock = VirtualClock()
+    operation = FlakyOperation(clock, failures=3)
+    errors = []
+
+    result = asyncio.run(retry_policy(clock).run(operation, errors.append))
+
+    assert result == "ok"
+    assert operation.calls == 4
+    assert clock.sleeps == [0.5, 1.0, 2.0]
+    assert [str(error) for error in errors] == ["Not connected"] * 3
+
+
+def test_retry_delay_is_capped():
+    policy = retry_policy(VirtualClock(), base_delay=0.5, max_delay=5)
+
+    assert policy.backoff(10) == 5
+
+
+def test_retry_gives_up_after_attempts():
+    clock = VirtualClock()
+    operation = FlakyOperation(clock, failures=10)
+
+    with pytest.raises(BleakError):
+        asyncio.run(retry_policy(clock, attempts=2).run(operation))
+
+    assert operation.calls == 3
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_retry_stops_at_deadline():
+    clock = VirtualClock()
+    operation = FlakyOperation(clock, failures=10, duration=4.0)
+
+    with pytest.raises(BleakError):
+        asyncio.run(retry_policy(clock, attempts=100, deadline=10).run(operation))
+
+    # 4s call, 0.5s backoff, 4s call, 1s backoff, the third call ends past 10s
+    assert operation.calls == 3
+    assert clock.sleeps == [0.5, 1.0]
+
+
+def test_retry_does_not_retry_an_open_circuit():
+    clock = VirtualClock()
+    calls = []
+
+    async def operation():
+        calls.append(clock.now)
+        raise CircuitOpenError("unreachable")
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(retry_policy(clock).run(operation))
+
+    assert len(calls) == 1
+    assert clock.sleeps == []
+
+
+def test_breaker_opens_after_consecutive_failures():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60, clock=clock)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.check("machine")
+    breaker.record_failure()
+
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        breaker.check("machine")
+
+
+def test_breaker_lets_one_probe_through_after_reset_timeout():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+
+    clock.now += 59
+    with pytest.raises(CircuitOpenError):
+        breaker.check("machine")
+    clock.now += 1
+    breaker.check("machine")
+    # Others keep failing fast while the probe runs
+    with pytest.raises(CircuitOpenError):
+        breaker.check("machine")
+
+    breaker.record_success()
+    assert not breaker.is_open
+    breaker.check("machine")
+
+
+def test_breaker_failed_probe_reopens_at_once():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 60
+    breaker.check("machine")
+
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.check("machine")
+    clock.now += 60
+    breaker.check("machine")
+
+
+def test_breaker_probe_that_never_ends_is_retried():
+    clock = VirtualClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60, clock=clock)
+    breaker.record_failure()
+    clock.now += 60
+    breaker.check("machine")
+
+    # The probe was cancelled and recorded nothing
+    clock.now += 60
+
+    breaker.check("machine")
+
+
+def test_wrapper_fails_fast_then_probes_on_a_virtual_clock():
+    async def scenario():
+        clock = VirtualClock()
+        fleet = ProdigioSimulator()
+        machine = fleet.add_machine()
+        client = BLEClientWrapper(
+            machine.device,
+            DEFAULT_AUTH_CODE,
+            fleet.client_factory,
+            retry_policy(clock, attempts=1),
+        )
+        machine.reachable = False
+        for _ in range(BREAKER_FAILURES):
+            with pytest.raises(BleakError):
+                await client.read_gatt_char(CHAR_UUID_STATUS)
+        assert clock.sleeps == [0.5] * BREAKER_FAILURES
+
+        machine.reachable = True
+        with pytest.raises(CircuitOpenError):
+            await client.read_gatt_char(CHAR_UUID_STATUS)
+        assert machine.connects == 0
+
+        clock.now += BREAKER_RESET_TIMEOUT
+        assert await client.read_gatt_char(CHAR_UUID_STATUS) == STATUS_READY
+        assert machine.connects == 1
+        await client.disconnect()
+
+    asyncio.run(scenario())
+
+
+def test_wrapper_retries_a_dropped_read():
+    async def scenario():
+        clock = VirtualClock()
+        fleet = ProdigioSimulator()
+        machine = fleet.add_machine()
+        client = BLEClientWrapper(
+            machine.device, DEFAULT_AUTH_CODE, fleet.client_factory, retry_policy(clock)
+        )
+        assert await client.read_gatt_char(CHAR_UUID_STATUS) == STATUS_READY
+
+        machine.fail_next("Not connected")
+        machine.disconnect_all()
+
+        assert await client.read_gatt_char(CHAR_UUID_STATUS) == STATUS_READY
+        assert machine.connects == 2
+        await client.disconnect()
+
+    asyncio.run(scenario())
+
+
+def test_probe_is_neither_blocked_nor_counted_by_the_breaker():
+    async def scenario():
+        clock = VirtualClock()
+        fleet = ProdigioSimulator()
+        machine = fleet.add_machine()
+        client = BLEClientWrapper(
+            machine.device,
+            DEFAULT_AUTH_CODE,
+            fleet.client_factory,
+            retry_policy(clock, attempts=0),
+        )
+        client.set_auth_code("00" * 8)
+        for _ in range(BREAKER_FAILURES + 1):
+            with pytest.raises(BleakError, match="Insufficient authentication"):
+                await client.probe(CHAR_UUID_STATUS, 15)
+        # Candidate codes failing did not open the circuit
+        client.set_auth_code(DEFAULT_AUTH_CODE)
+        assert await client.read_gatt_char(CHAR_UUID_STATUS) == STATUS_READY
+
+        machine.disconnect_all()
+        machine.reachable = False
+        for _ in range(BREAKER_FAILURES):
+            with pytest.raises(BleakError):
+                await client.read_gatt_char(CHAR_UUID_STATUS)
+        machine.reachable = True
+        # The open circuit does not block the probe
+        assert await client.probe(CHAR_UUID_STATUS, 15) == STATUS_READY
+        await client.disconnect()
+
+    asyncio.run(scenario())
+
+
+async def _blocked_queue():
+    """A queue whose running operation waits for the returned event."""
+    queue = GattOperationQueue()
+    gate = asyncio.Event()
+    first = asyncio.ensure_future(queue.run(gate.wait))
+    await asyncio.sleep(0)
+    return queue, gate, first
+
+
+def _recorder(ran: list, name: str):
+    async def operation():
+        ran.append(name)
+        return name
+
+    return operation
+
+
+def test_queue_runs_waiting_operations_by_priority():
+    async def scenario():
+        queue, gate, first = await _blocked_queue()
+        ran = []
+        waiting = [
+            asyncio.ensure_future(queue.run(_recorder(ran, name), priority=priority))
+            for name, priority in (
+                ("background", PRIORITY_BACKGROUND),
+                ("default", PRIORITY_DEFAULT),
+                ("brew", PRIORITY_BREW),
+                ("second default", PRIORITY_DEFAULT),
+            )
+        ]
+        await asyncio.sleep(0)
+        assert queue.depth == 5
+
+        gate.set()
+        await asyncio.gather(first, *waiting)
+
+        assert ran == ["brew", "default", "second default", "background"]
+        assert queue.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_queue_skips_a_cancelled_waiter():
+    async def scenario():
+        queue, gate, first = await _blocked_queue()
+        ran = []
+        second = asyncio.ensure_future(queue.run(_recorder(ran, "second")))
+        third = asyncio.ensure_future(queue.run(_recorder(ran, "third")))
+        await asyncio.sleep(0)
+
+        second.cancel()
+        gate.set()
+        await asyncio.gather(first, third)
+
+        assert second.cancelled()
+        assert ran == ["third"]
+
+    asyncio.run(scenario())
+
+
+def test_queue_passes_on_a_turn_cancelled_once_handed_over():
+    async def scenario():
+        queue, gate, first = await _blocked_queue()
+        ran = []
+        second = asyncio.ensure_future(queue.run(_recorder(ran, "second")))
+        third = asyncio.ensure_future(queue.run(_recorder(ran, "third")))
+        await asyncio.sleep(0)
+
+        gate.set()
+        # The first operation ends and hands its turn to the second one, which
+        # is cancelled before it gets to run
+        while not first.done():
+            await asyncio.sleep(0)
+        second.cancel()
+        # A turn that is not passed on leaves the third one waiting forever
+        await asyncio.wait_for(asyncio.gather(second, third, return_exceptions=True), 1)
+
+        assert second.cancelled()
+        assert ran == ["third"]
+        assert queue.depth == 0
+        # The queue is not wedged
+        assert await asyncio.wait_for(queue.run(_recorder(ran, "fourth")), 1) == (
+            "fourth"
+        )
+
+    asyncio.run(scenario())
+
+
+def test_queue_joiner_cancelling_keeps_the_shared_operation():
+    async def scenario():
+        queue, gate, first = await _blocked_queue()
+        ran = []
+        owner = asyncio.ensure_future(queue.run(_recorder(ran, "read"), key="read"))
+        joiner = asyncio.ensure_future(queue.run(_recorder(ran, "read"), key="read"))
+        await asyncio.sleep(0)
+
+        joiner.cancel()
+        gate.set()
+
+        assert await owner == "read"
+        assert joiner.cancelled()
+        assert ran == ["read"]
+        assert queue.coalesced == 1
+        await first
+
+    asyncio.run(scenario())
+
+
+def test_queue_owner_cancelling_fails_the_joiners():
+    async def scenario():
+        queue, gate, first = await _blocked_queue()
+        ran = []
+        owner = asyncio.ensure_future(queue.run(_recorder(ran, "read"), key="read"))
+        joiner = asyncio.ensure_future(queue.run(_recorder(ran, "read"), key="read"))
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        gate.set()
+
+        with pytest.raises(BleakError, match="cancelled"):
+            await joiner
+        assert ran == []
+        await first
+
+    asyncio.run(scenario())
+
+
+def test_queue_hold_keeps_less_urgent_operations_waiting():
+    async def scenario():
+        queue, gate, first = await _blocked_queue()
+        ran = []
+        queue.hold(PRIORITY_BREW)
+        background = asyncio.ensure_future(
+            queue.run(_recorder(ran, "background"), priority=PRIORITY_BACKGROUND)
+        )
+        await asyncio.sleep(0)
+        gate.set()
+        await first
+        # Nothing is running, the held operation still waits
+        await asyncio.sleep(0)
+        assert ran == []
+
+        assert await queue.run(_recorder(ran, "brew"), priority=PRIORITY_BREW) == (
+            "brew"
+        )
+        queue.resume()
+        await asyncio.wait_for(background, 1)
+
+        assert ran == ["brew", "background"]
+        assert queue.depth == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,99 @@
+"""Poll intervals picked from scripted status sequences."""
+from custom_components.nespresso_prodigio.nespresso import (
+    CHAR_UUID_STATUS,
+    POLL_INTERVAL_AWAKE,
+    POLL_INTERVAL_BREWING,
+    POLL_INTERVAL_SLEEPING,
+    POLL_INTERVAL_UNREACHABLE_MAX,
+    AdaptivePollSchedule,
+    NespressoDeviceBundle,
+    ble_device,
+)
+from custom_components.nespresso_prodigio.simulator import (
+    STATUS_BREWING,
+    STATUS_READY,
+    STATUS_SLEEPING,
+    STATUS_WATER_EMPTY,
+)
+
+# Ready with the fault bit of the third flag byte set
+STATUS_FAULT = bytes.fromhex("4002002000000000a0")
+# Ready with a capsule in the slot
+STATUS_CAPSULE = bytes.fromhex("4082000000000000a0")
+
+
+def _intervals(statuses) -> list:
+    """Decode each status like a poll would and ask for the next interval.
+
+    None stands for a poll that could not reach the machine.
+    """
+    bundle = NespressoDeviceBundle(ble_device("00:00:00:00:00:01", ""), {})
+    schedule = AdaptivePollSchedule()
+    intervals = []
+    for status in statuses:
+        if status is None:
+            intervals.append(schedule.next_interval(None))
+            continue
+        bundle.update_raw(str(CHAR_UUID_STATUS), status)
+        intervals.append(schedule.next_interval(bundle.attributes))
+    return intervals
+
+
+def test_brew_polls_fast_then_falls_back_to_idle():
+    assert _intervals(
+        [
+            STATUS_SLEEPING,
+            STATUS_READY,
+            STATUS_CAPSULE,
+            STATUS_BREWING,
+            STATUS_BREWING,
+            STATUS_READY,
+            STATUS_SLEEPING,
+        ]
+    ) == [
+        POLL_INTERVAL_SLEEPING,
+        POLL_INTERVAL_AWAKE,
+        POLL_INTERVAL_BREWING,
+        POLL_INTERVAL_BREWING,
+        POLL_INTERVAL_BREWING,
+        POLL_INTERVAL_AWAKE,
+        POLL_INTERVAL_SLEEPING,
+    ]
+
+
+def test_fault_and_empty_tank_poll_at_the_idle_interval():
+    assert _intervals(
+        [STATUS_BREWING, STATUS_FAULT, STATUS_READY, STATUS_WATER_EMPTY]
+    ) == [
+        POLL_INTERVAL_BREWING,
+        POLL_INTERVAL_AWAKE,
+        POLL_INTERVAL_AWAKE,
+        POLL_INTERVAL_AWAKE,
+    ]
+
+
+def test_misses_back_off_up_to_the_cap_and_reset_on_a_read():
+    misses = 8
+    intervals = _intervals([STATUS_BREWING] + [None] * misses + [STATUS_READY])
+
+    backoff = intervals[1:-1]
+    assert backoff[:3] == [
+        2 * POLL_INTERVAL_AWAKE,
+        4 * POLL_INTERVAL_AWAKE,
+        8 * POLL_INTERVAL_AWAKE,
+    ]
+    assert backoff == sorted(backoff)
+    assert backoff[-1] == POLL_INTERVAL_UNREACHABLE_MAX
+    assert intervals[-1] == POLL_INTERVAL_AWAKE
+
+
+def test_is_backing_off_only_between_misses_and_the_next_read():
+    bundle = NespressoDeviceBundle(ble_device("00:00:00:00:00:01", ""), {})
+    bundle.update_raw(str(CHAR_UUID_STATUS), STATUS_WATER_EMPTY)
+    schedule = AdaptivePollSchedule()
+
+    assert not schedule.is_backing_off
+    schedule.next_interval(None)
+    assert schedule.is_backing_off
+    assert schedule.next_interval(bundle.attributes) == POLL_INTERVAL_AWAKE
+    assert not schedule.is_backing_off